@@ -0,0 +1,99 @@
+"""
+Offline bulk loading into the store under DATA_DIR (stop the server first,
+both would write the same log):
+
+    python -m app.cli import corpus.ndjson --name "My corpus"
+    python -m app.cli import corpus.parquet --library-id <uuid>
+
+Rows are ChunkImportRow objects (one per line for NDJSON, one per table row
+for Parquet, which needs pyarrow).
+"""
+import argparse
+import asyncio
+import sys
+from typing import AsyncIterator
+from uuid import UUID
+
+from .config import Config
+from .models.library import LibraryCreate
+from .service.embedding_service import close_embedding_service
+from .service.import_service import Record, import_library_service, ndjson_records
+from .service.library_service import create_library_service
+from .store.in_memory import close_store, open_store, snapshot
+
+_READ_BYTES = 1 << 20
+
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(_READ_BYTES)
+            if not block:
+                return
+            yield block
+
+
+def _parquet_records(path: str, batch_rows: int) -> AsyncIterator[Record]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Reading Parquet needs pyarrow (pip install pyarrow)")
+
+    async def rows() -> AsyncIterator[Record]:
+        row_no = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            for row in batch.to_pylist():
+                row_no += 1
+                # null columns mean "not given"
+                yield row_no, {key: value for key, value in row.items() if value is not None}
+
+    return rows()
+
+
+async def _import(args: argparse.Namespace) -> None:
+    if args.path.endswith(".parquet"):
+        records = _parquet_records(args.path, args.batch_rows)
+    else:
+        records = ndjson_records(_file_chunks(args.path))
+    if args.library_id is not None:
+        library_id = args.library_id
+    else:
+        library_id = create_library_service(LibraryCreate(name=args.name, compression=args.compression)).id
+    try:
+        summary = await import_library_service(library_id, records, args.batch_rows)
+    finally:
+        await close_embedding_service()
+    print(summary.model_dump_json(indent=2))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+    imp = commands.add_parser("import", help="Bulk import an NDJSON or Parquet file into a library")
+    imp.add_argument("path", help="Input file (.ndjson/.jsonl, or .parquet)")
+    target = imp.add_mutually_exclusive_group(required=True)
+    target.add_argument("--library-id", type=UUID, help="Existing library to import into")
+    target.add_argument("--name", help="Create a new library with this name")
+    imp.add_argument("--compression", choices=["none", "int8", "pq"], default="none",
+                     help="Compression of a new library")
+    imp.add_argument("--batch-rows", type=int, default=Config.IMPORT_BATCH_ROWS)
+    args = parser.parse_args(argv)
+
+    if not Config.DATA_DIR:
+        print("DATA_DIR must be set: the import is written to the store's data directory", file=sys.stderr)
+        return 2
+    open_store(Config.DATA_DIR)
+    try:
+        asyncio.run(_import(args))
+        # one snapshot now, so the next start doesn't replay every imported row from the log
+        snapshot()
+    except (KeyError, ValueError) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        close_store()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,4 +7,69 @@ load_dotenv() # Load environment variables from .env
 
 class Config:
     API_KEY = os.getenv('API_KEY')
-    COHERE_KEY = os.getenv('COHERE_KEY')
\ No newline at end of file
+    COHERE_KEY = os.getenv('COHERE_KEY')
+
+    # log level for the app's loggers (DEBUG logs every search's algorithm and candidate count)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+    # HNSW graph parameters (per-request ef_search overrides the default)
+    HNSW_M = int(os.getenv('HNSW_M', '16'))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '200'))
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+
+    # IVF: lists probed per query by default, and library size that triggers k-means training
+    IVF_NPROBE = int(os.getenv('IVF_NPROBE', '8'))
+    IVF_TRAIN_THRESHOLD = int(os.getenv('IVF_TRAIN_THRESHOLD', '10000'))
+
+    # compressed libraries: rows buffered before the quantizer is trained, PQ sub-vector width
+    QUANTIZATION_TRAIN_SIZE = int(os.getenv('QUANTIZATION_TRAIN_SIZE', '1024'))
+    PQ_SUBVECTOR_DIM = int(os.getenv('PQ_SUBVECTOR_DIM', '4'))
+
+    # bulk ingestion: texts per upstream embed call (Cohere caps at 96) and concurrent calls
+    EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '96'))
+    EMBED_CONCURRENCY = int(os.getenv('EMBED_CONCURRENCY', '4'))
+
+    # bulk import: rows validated, embedded and inserted per batch (bounds memory)
+    IMPORT_BATCH_ROWS = int(os.getenv('IMPORT_BATCH_ROWS', '4096'))
+
+    # embedding client: "cohere" or "fake" (deterministic, offline), model, timeout (s),
+    # retries on timeouts/429/5xx, and how long single-text embeds wait to be coalesced (ms)
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'cohere')
+    EMBED_MODEL = os.getenv('EMBED_MODEL', 'embed-v4.0')
+    EMBED_TIMEOUT = float(os.getenv('EMBED_TIMEOUT', '10'))
+    EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', '3'))
+    EMBED_COALESCE_MS = float(os.getenv('EMBED_COALESCE_MS', '5'))
+    FAKE_EMBEDDING_DIM = int(os.getenv('FAKE_EMBEDDING_DIM', '1024'))
+
+    # query-embedding cache: max entries (0 disables), TTL in seconds (0 = none),
+    # and an optional SQLite file so cached embeddings survive restarts, capped
+    # at EMBED_CACHE_DISK_SIZE rows (oldest evicted first)
+    EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', '4096'))
+    EMBED_CACHE_TTL = float(os.getenv('EMBED_CACHE_TTL', '86400'))
+    EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH')
+    EMBED_CACHE_DISK_SIZE = int(os.getenv('EMBED_CACHE_DISK_SIZE', '100000'))
+
+    # search results cached per (library version, query, k, metric, algorithm); 0 disables
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '1024'))
+
+    # search executor: worker threads for kNN scoring, max queued + running searches
+    # before new ones get 503, and per-request timeout in seconds (0 = none)
+    SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', str(min(8, os.cpu_count() or 1))))
+    SEARCH_QUEUE_DEPTH = int(os.getenv('SEARCH_QUEUE_DEPTH', '64'))
+    SEARCH_TIMEOUT = float(os.getenv('SEARCH_TIMEOUT', '30'))
+
+    # filtered search: scan only the matching rows when they are at most this fraction
+    # of the library; above it, filter during index traversal or post-filter brute force
+    SEARCH_PREFILTER_SELECTIVITY = float(os.getenv('SEARCH_PREFILTER_SELECTIVITY', '0.1'))
+
+    # persistence: directory for the write-ahead log and snapshots (unset = memory only),
+    # snapshot every SNAPSHOT_INTERVAL seconds or once the log passes SNAPSHOT_WAL_BYTES
+    DATA_DIR = os.getenv('DATA_DIR')
+    SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '300'))
+    SNAPSHOT_WAL_BYTES = int(os.getenv('SNAPSHOT_WAL_BYTES', str(256 * 1024 * 1024)))
+
+    # memory-mapped vectors (needs DATA_DIR): full-precision libraries keep embeddings in
+    # immutable segment files; rows buffered in RAM before a flush, segments before a merge
+    MMAP_VECTORS = os.getenv('MMAP_VECTORS', 'false').lower() in ('1', 'true', 'yes')
+    MEMTABLE_ROWS = int(os.getenv('MEMTABLE_ROWS', '4096'))
+    MAX_SEGMENTS = int(os.getenv('MAX_SEGMENTS', '8'))
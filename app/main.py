@@ -1,3 +1,6 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI
 
 from .dependencies import get_key_header
@@ -5,13 +8,38 @@ from .routers import libraries
 from .routers import documents
 from .routers import chunks
 from .routers import health
+from .routers import metrics
+from .service.embedding_service import close_embedding_service
+from .service.executor import shutdown_search_executor
+from .store.in_memory import open_store, close_store
+from .config import Config
+
+
+# key=value messages on one line each, so log pipelines can parse them;
+# LOG_LEVEL applies to the app's loggers, libraries stay at WARNING
+logging.basicConfig(format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s")
+logging.getLogger("app").setLevel(Config.LOG_LEVEL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if Config.DATA_DIR:
+        # recover the latest snapshot + write-ahead log before serving
+        open_store(Config.DATA_DIR)
+    yield
+    # release the pooled embedding connections and search threads
+    await close_embedding_service()
+    shutdown_search_executor()
+    close_store()
+
 
-app = FastAPI(dependencies=[Depends(get_key_header)])
+app = FastAPI(dependencies=[Depends(get_key_header)], lifespan=lifespan)
 
 app.include_router(libraries.router)
 # app.include_router(documents.router)
 # app.include_router(chunks.router)
 app.include_router(health.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
@@ -17,6 +17,22 @@ class ChunkCreate(ChunkBase):
     """Fields required to create a new Chunk"""
     pass
 
+class ChunkBulkCreate(BaseModel):
+    """Many chunks for one document; chunks without an embedding are embedded server-side"""
+    chunks: conlist(ChunkCreate, min_length=1, max_length=10000) = Field( # type: ignore
+        ..., description="Chunks to create, in document order"
+    )
+
+class ChunkImportRow(ChunkBase):
+    """
+    One line of a bulk import file. Rows sharing a `document` key go to the
+    same new document; its metadata comes from the first row that sets it.
+    """
+    document: str = Field(..., description="Key grouping rows into documents (scoped to the file)")
+    document_metadata: Optional[Dict[str, Any]] = Field(
+        None, description="Metadata for the row's document"
+    )
+
 class ChunkUpdate(BaseModel):
     """
     Partial update for a Chunk; any field may be omitted.
@@ -0,0 +1,31 @@
+from uuid import UUID
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+
+class IndexBuildRequest(BaseModel):
+    """(Re)build a library's search index with explicit parameters"""
+    algorithm: Literal["vptree", "hnsw", "ivf"] = Field(
+        "ivf", description="Index to build"
+    )
+    metric: Literal["cosine", "dot", "l2", "l2_squared"] = Field(
+        "cosine", description="Metric the index serves (vptree: not dot)"
+    )
+    nlist: Optional[int] = Field(
+        None, ge=2, description="IVF: number of k-means clusters, at least 2 (default 4*sqrt(N))"
+    )
+    M: Optional[int] = Field(
+        None, gt=1, description="HNSW: links per node"
+    )
+    ef_construction: Optional[int] = Field(
+        None, gt=0, description="HNSW: candidate list size while inserting"
+    )
+
+
+class IndexInfo(BaseModel):
+    """State of a built index"""
+    library_id: UUID = Field(..., description="Indexed library ID")
+    algorithm: str = Field(..., description="Index algorithm")
+    metric: str = Field(..., description="Distance metric")
+    size: int = Field(..., description="Live vectors in the index")
+    nlist: Optional[int] = Field(None, description="IVF: number of posting lists")
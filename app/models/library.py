@@ -1,5 +1,5 @@
 from uuid import UUID
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 
@@ -8,6 +8,14 @@ class LibraryBase(BaseModel):
     metadata: Dict[str, Any] = Field (
         default_factory=dict, description="Arbitrary key/value metadata"
     )
+    compression: Literal["none", "int8", "pq"] = Field(
+        "none",
+        description="How chunk embeddings are stored: float32, 8-bit scalar-quantized, or product-quantized codes with an 8-bit refine (fixed at creation)",
+    )
+    rerank: bool = Field(
+        False,
+        description="Compressed libraries only: also keep float32 vectors to exactly re-rank the top candidates (costs more memory than no compression); without them indexes hold the codes too and returned embeddings are decoded approximations",
+    )
 
 class LibraryCreate(LibraryBase):
     """Fields to create a new Library"""
@@ -28,3 +36,14 @@ class Library(LibraryBase):
     class Config:
         orm_mode = True
 
+
+
+class ImportSummary(BaseModel):
+    """Outcome of a bulk import into a library"""
+    library_id: UUID
+    documents: int = Field(..., description="Documents created")
+    chunks: int = Field(..., description="Chunks created")
+    embedded: int = Field(..., description="Chunks embedded server-side (rows without an embedding)")
+    indexes: List[str] = Field(
+        default_factory=list, description="Search indexes rebuilt after the import, as algorithm/metric"
+    )
@@ -1,26 +1,122 @@
 from uuid import UUID
 from typing import List, Literal, Dict, Any, Optional
-from pydantic import BaseModel, Field, model_validator, ValidationError, conlist, constr
+from pydantic import BaseModel, ConfigDict, Field, model_validator, ValidationError, conlist, constr
 from .chunk import Chunk
 from .library import Library
 
-class SearchRequest(BaseModel):
-    """Paylod for a kNN search"""
-    text: constr(min_length=1) = Field( # type: ignore
-        ..., description="Query text to embed and search"
+
+class MetadataFilter(BaseModel):
+    """
+    Metadata filter expression, either a condition or a boolean node:
+    - {"key": "lang", "eq": "en"}, {"key": "year", "gte": 2020, "lt": 2024},
+      {"key": "tag", "in": ["a", "b"]} (several operators on one key are ANDed)
+    - {"and": [...]} / {"or": [...]}
+    Conditions match chunk metadata, or the parent document's with scope="document".
+    Nested keys use dots ("author.name"); list values match any element.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    key: Optional[str] = Field(None, min_length=1, description="Metadata key")
+    scope: Literal["chunk", "document"] = Field(
+        "chunk", description="Match the chunk's metadata or its document's"
     )
+    eq: Optional[Any] = Field(None, description="Value equals (null matches explicit nulls)")
+    in_: Optional[List[Any]] = Field(None, alias="in", description="Value is one of")
+    gt: Optional[float] = Field(None, description="Numeric value >")
+    gte: Optional[float] = Field(None, description="Numeric value >=")
+    lt: Optional[float] = Field(None, description="Numeric value <")
+    lte: Optional[float] = Field(None, description="Numeric value <=")
+    and_: Optional[List["MetadataFilter"]] = Field(None, alias="and", min_length=1)
+    or_: Optional[List["MetadataFilter"]] = Field(None, alias="or", min_length=1)
+
+    @model_validator(mode="after")
+    def _one_kind(self) -> "MetadataFilter":
+        ops = {"eq", "in_", "gt", "gte", "lt", "lte"} & self.model_fields_set
+        kinds = [bool(ops) or self.key is not None, self.and_ is not None, self.or_ is not None]
+        if sum(kinds) != 1:
+            raise ValueError("A filter is exactly one of: a condition (key + operators), 'and', 'or'")
+        if kinds[0] and (self.key is None or not ops):
+            raise ValueError("A filter condition needs a key and at least one of eq, in, gt, gte, lt, lte")
+        return self
+
+# fields a search hit can carry; embeddings are opt-in, they dominate response size
+HitField = Literal["id", "score", "document_id", "text", "metadata", "embedding"]
+DEFAULT_INCLUDE = ("id", "score", "text", "metadata")
+
+
+class SearchOptions(BaseModel):
+    """Search parameters shared by single and batch searches"""
     k: int = Field(
         ...,
         gt=0,
         description="Number of nearest neighbors to return (must be > 0)",
     )
-    metric: Literal["cosine", "l2"] = Field(
+    metric: Literal["cosine", "dot", "l2", "l2_squared"] = Field(
         "cosine",
-        description="Distance metric to use",
+        description="Metric to rank by: cosine or dot (similarity, higher is closer), l2 or l2_squared (distance, lower is closer)",
     )
-    algorithm: Literal["brute", "vptree"] = Field(
+    algorithm: Literal["brute", "vptree", "hnsw", "ivf"] = Field(
         "brute", description="Search algorithm to use"
     )
+    ef_search: Optional[int] = Field(
+        None,
+        gt=0,
+        description="HNSW candidate list size; higher = better recall, slower (hnsw only)",
+    )
+    nprobe: Optional[int] = Field(
+        None,
+        gt=0,
+        description="IVF posting lists to scan; higher = better recall, slower (ivf only)",
+    )
+    filter: Optional[MetadataFilter] = Field(
+        None, description="Only return chunks whose metadata matches this expression"
+    )
+    include: List[HitField] = Field(
+        default_factory=lambda: list(DEFAULT_INCLUDE),
+        min_length=1,
+        description="Fields returned per hit, e.g. [\"id\"] for ids only; add \"embedding\" to get vectors",
+    )
+
+
+class SearchRequest(SearchOptions):
+    """Paylod for a kNN search: exactly one of text, vector, similar_to_chunk_id"""
+    text: Optional[constr(min_length=1)] = Field( # type: ignore
+        None, description="Query text to embed and search"
+    )
+    vector: Optional[conlist(float, min_length=1)] = Field( # type: ignore
+        None, description="Query embedding, used as is (must match the library's dimension)"
+    )
+    similar_to_chunk_id: Optional[UUID] = Field(
+        None, description="Find chunks similar to this stored chunk (itself excluded)"
+    )
+
+    @model_validator(mode="after")
+    def _one_query(self) -> "SearchRequest":
+        given = [self.text is not None, self.vector is not None, self.similar_to_chunk_id is not None]
+        if sum(given) != 1:
+            raise ValueError("Provide exactly one of 'text', 'vector' or 'similar_to_chunk_id'")
+        return self
+
+
+class BatchQuery(BaseModel):
+    """One query of a batch: text to embed, or a raw vector"""
+    text: Optional[constr(min_length=1)] = Field(None, description="Query text to embed") # type: ignore
+    vector: Optional[conlist(float, min_length=1)] = Field( # type: ignore
+        None, description="Query embedding, used as is"
+    )
+
+    @model_validator(mode="after")
+    def _text_or_vector(self) -> "BatchQuery":
+        if (self.text is None) == (self.vector is None):
+            raise ValueError("Each query needs exactly one of 'text' or 'vector'")
+        return self
+
+
+class BatchSearchRequest(SearchOptions):
+    """Many queries with the same parameters, answered in one pass over the library"""
+    queries: conlist(BatchQuery, min_length=1, max_length=256) = Field( # type: ignore
+        ..., description="Queries, answered in order"
+    )
 
 
 class SearchResult(BaseModel):
@@ -28,13 +124,18 @@ class SearchResult(BaseModel):
     chunk: Chunk = Field(..., description="Matched chunk")
     score: float = Field(
         ...,
-        description="Similarity score (cosine) or distance (L2). Higher=more simiar for cosine; lower=closer for L2"
+        description="Similarity score (cosine, dot) or distance (l2, l2_squared). Higher=more similar for similarities; lower=closer for distances"
     )
 
 class SearchHit(BaseModel):
     """
+    One search hit carrying only the fields named in the request's `include`
     - id: UUID of the chunk
     - score: similarity/distance
     """
-    id: UUID = Field(..., description="Chunk ID")
-    score: float = Field(..., description="Hit score")
+    id: Optional[UUID] = Field(None, description="Chunk ID")
+    score: Optional[float] = Field(None, description="Hit score")
+    document_id: Optional[UUID] = Field(None, description="Parent document ID")
+    text: Optional[str] = Field(None, description="Chunk text")
+    metadata: Optional[Dict[str, Any]] = Field(None, description="Chunk metadata")
+    embedding: Optional[List[float]] = Field(None, description="Chunk embedding")
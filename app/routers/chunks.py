@@ -1,14 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status, Body
-from typing import List
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Header, Path, status, Body
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from uuid import uuid4, UUID
-from ..models.chunk import Chunk, ChunkCreate, ChunkUpdate
-from ..service.chunk_service import create_chunk_service, list_chunks_service, get_chunk_service, update_chunk_service, delete_chunk_service
-from ..config import Config
-
-import cohere
-
-CO_API_KEY = Config.COHERE_KEY
-co = cohere.ClientV2(api_key=CO_API_KEY)
+from ..models.chunk import Chunk, ChunkCreate, ChunkUpdate, ChunkBulkCreate
+from ..service.chunk_service import create_chunk_service, bulk_create_chunks_service, list_chunks_service, get_chunk_service, update_chunk_service, delete_chunk_service
+from ..service.embedding_service import get_embedding_service, EmbeddingServiceError
+from ..service.export_service import JSON, NDJSON, NPY, negotiate, export_ndjson_service, export_npy_service
 
 router = APIRouter(
     prefix="/{document_id}/chunks",
@@ -30,33 +28,74 @@ async def create_chunk(
     payload: ChunkCreate = Body(..., description="text + embedding + metadata"),
 ) -> Chunk:
         try:
-             text = payload.text
-             response = co.embed(
-                  texts=[text],
-                  model="embed-v4.0",
-                  input_type="classification",
-                  embedding_types=["float"]
-             )
-             embedding = response.embeddings.float_[0]
-             payload.embedding = embedding
-             return create_chunk_service(library_id, document_id, payload)
+             payload.embedding = await get_embedding_service().embed_one(payload.text)
+             return await asyncio.to_thread(create_chunk_service, library_id, document_id, payload)
         except KeyError:
-             raise HTTPException("Parent library or document not found")
+             raise HTTPException(status_code=404, detail="Parent library or document not found")
+        except ValueError as e:
+             raise HTTPException(status_code=422, detail=str(e))
+        except EmbeddingServiceError as e:
+             raise HTTPException(status_code=502, detail=str(e))
+
+@router.post(
+    ":bulk",
+    response_model=List[Chunk],
+    status_code=status.HTTP_201_CREATED,
+    summary="Create many Chunks in one request",
+)
+async def bulk_create_chunks(
+    library_id: UUID = Path(..., description="UUID of the library"),
+    document_id: UUID = Path(..., description="UUID of the document"),
+    payload: ChunkBulkCreate = Body(..., description="Chunks to create; embeddings optional"),
+) -> List[Chunk]:
+    """
+    Chunks sent without an embedding are embedded in max-size batches, several
+    batches in flight at once, then everything is inserted in one store step.
+    """
+    missing = [chunk for chunk in payload.chunks if chunk.embedding is None]
+    if missing:
+        try:
+            embeddings = await get_embedding_service().embed([chunk.text for chunk in missing])
+        except EmbeddingServiceError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+        for chunk, embedding in zip(missing, embeddings):
+            chunk.embedding = embedding
+    try:
+        # the insert (and its index upkeep) runs in a worker thread, off the event loop
+        return await asyncio.to_thread(bulk_create_chunks_service, library_id, document_id, payload.chunks)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Parent library or document not found")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 
 @router.get(
     "",
     response_model=List[Chunk],
     status_code=status.HTTP_200_OK,
-    summary="List all chunks in respective library + id"
+    summary="List all chunks in respective library + id",
+    responses={200: {"content": {NDJSON: {}, NPY: {}}}},
 )
 async def list_chunks(
     library_id: UUID = Path(..., description="UUID of the library"), 
     document_id: UUID = Path(..., description="UUID of the document"),
+    accept: Optional[str] = Header(None),
 ) -> List[Chunk]:
+    """
+    JSON list by default; with Accept: application/x-ndjson or application/x-npy
+    the chunks are streamed like a library export, without the response model.
+    """
+    media_type = negotiate(accept, [JSON, NDJSON, NPY])
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Chunks are available as {JSON}, {NDJSON} or {NPY}")
     try:
+        if media_type == NDJSON:
+            return StreamingResponse(export_ndjson_service(library_id, document_id), media_type=NDJSON)
+        if media_type == NPY:
+            return StreamingResponse(export_npy_service(library_id, document_id), media_type=NPY)
         return list_chunks_service(library_id, document_id)
     except KeyError:
-        raise HTTPException("Parent library or document not found")
+        raise HTTPException(status_code=404, detail="Parent library or document not found")
 
 
 @router.get(
@@ -88,9 +127,11 @@ async def update_chunk(
     payload: ChunkUpdate = Body(..., description="Field to update (all optional)"),
 ) -> Chunk:
     try:
-         return update_chunk_service(library_id, document_id, chunk_id, payload)
+         return await asyncio.to_thread(update_chunk_service, library_id, document_id, chunk_id, payload)
     except KeyError:
         raise HTTPException(status_code=404, detail="Chunk not found")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 @router.delete(
     "/{chunk_id}",
@@ -103,6 +144,6 @@ async def delete_chunk(
     chunk_id: UUID = Path(..., description="UUID of the chunk"),
 ) -> None:
     try:
-        delete_chunk_service(library_id, document_id, chunk_id)
+        await asyncio.to_thread(delete_chunk_service, library_id, document_id, chunk_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="Chunk not found")
\ No newline at end of file
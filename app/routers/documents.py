@@ -1,19 +1,17 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status, Path, Body
+from fastapi.responses import JSONResponse
 from typing import List
 from uuid import uuid4, UUID
 from .chunks import router as chunks_router
 from ..models.document import Document, DocumentCreate, DocumentUpdate
-from ..models.search import SearchRequest, SearchResult
+from ..models.search import SearchHit, SearchRequest
 from ..service.document_service import create_document_service, list_documents_service, get_document_service, update_document_service, delete_document_service
 
-from ..service.search_service import search_document_service
+from ..service.search_service import query_vector_service, search_document_service
 
-from ..config import Config
-
-import cohere
-
-CO_API_KEY = Config.COHERE_KEY
-co = cohere.ClientV2(api_key=CO_API_KEY)
+from ..service.embedding_service import get_embedding_service, EmbeddingServiceError
+from ..service.executor import run_search, SearchOverloadedError
 
 router = APIRouter(
     prefix="/{library_id}/documents",
@@ -36,7 +34,7 @@ async def create_document(
     payload: DocumentCreate = Body(..., description="Metadata + Chunk ids")
 ) -> Document:
     try:
-        return create_document_service(library_id,  payload)
+        return await asyncio.to_thread(create_document_service, library_id, payload)
     except KeyError:
         raise HTTPException(status_code=404, detail="Chunk not found in library")
 
@@ -81,7 +79,7 @@ async def update_document(
     payload: DocumentUpdate = Body(..., description="Field to update (all optional)"),
 ) -> Document:
     try:
-        return update_document_service(library_id, document_id, payload)
+        return await asyncio.to_thread(update_document_service, library_id, document_id, payload)
     except KeyError:
         raise HTTPException(status_code=404, detail="Document and/or chunk not found")
 
@@ -95,13 +93,13 @@ async def delete_document(
     document_id: UUID = Path(..., description="UUID of the document"),
 ) -> None:
     try:
-        delete_document_service(library_id, document_id)
+        await asyncio.to_thread(delete_document_service, library_id, document_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="Document not found")
 
 @router.post(
     "/{document_id}/search",
-    response_model=List[SearchResult],
+    response_model=List[SearchHit],
     status_code=status.HTTP_200_OK,
     summary="kNN search within a Document",
 )
@@ -109,28 +107,52 @@ async def search_document(
     library_id: UUID = Path(..., description="UUID of the library"), 
     document_id: UUID = Path(..., description="UUID of the document"),
     payload: SearchRequest = Body(..., description="Search parameters")
-) -> List[SearchResult]:
+) -> List[SearchHit]:
     """top-k most similar chunks within a specific document"""
     try:
-        text = payload.text
-        response = co.embed(
-            texts=[text],
-            model="embed-v4.0",
-            input_type="classification",
-            embedding_types=["float"]
-        )
-        embedding = response.embeddings.float_[0]
+        if payload.text is not None:
+            embedding = await get_embedding_service().embed_query(payload.text)
+        else:
+            # raw vector / "more like this chunk": no embedding round-trip
+            embedding = query_vector_service(library_id, payload.vector, payload.similar_to_chunk_id)
 
-        return search_document_service(
+        results = await run_search(
+            search_document_service,
             library_id=library_id,
             document_id=document_id,
             query_embedding=embedding,
             k=payload.k,
             metric=payload.metric,
-            algorithm=payload.algorithm
+            algorithm=payload.algorithm,
+            ef_search=payload.ef_search,
+            nprobe=payload.nprobe,
+            filter=payload.filter,
+            include=payload.include,
+            # the source chunk is its own nearest neighbour
+            exclude_id=payload.similar_to_chunk_id,
         )
+        # rows are already JSON-ready: skip response-model validation
+        return JSONResponse(content=results)
     except KeyError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=str(e),
-        )
\ No newline at end of file
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
+        )
+    except EmbeddingServiceError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    except SearchOverloadedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Search timed out",
+        )
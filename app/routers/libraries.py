@@ -1,22 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Path, status
-from typing import List
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Path, Request, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
 from uuid import uuid4, UUID
 
 from ..dependencies import get_key_header
 # from .chunks import router as chunks_router
 from .documents import router as documents_router
-from ..models.library import Library, LibraryCreate, LibraryUpdate
-from ..models.search import SearchRequest, SearchResult
+from ..models.library import ImportSummary, Library, LibraryCreate, LibraryUpdate
+from ..models.search import BatchSearchRequest, SearchHit, SearchRequest
+from ..models.index import IndexBuildRequest, IndexInfo
 
 from ..service.library_service import create_library_service, list_libraries_service, get_library_service, update_library_service, delete_library_service
 
-from ..service.search_service import search_library_service
-from ..config import Config
-
-import cohere
-
-CO_API_KEY = Config.COHERE_KEY
-co = cohere.ClientV2(api_key=CO_API_KEY)
+from ..service.search_service import query_vector_service, search_library_batch_service, search_library_service
+from ..service.index_service import build_index_service
+from ..service.export_service import NDJSON, NPY, negotiate, export_ndjson_service, export_npy_service
+from ..service.import_service import import_library_service, ndjson_records
+from ..service.embedding_service import get_embedding_service, EmbeddingServiceError
+from ..service.executor import run_search, SearchOverloadedError
 
 
 router = APIRouter(
@@ -39,7 +41,7 @@ async def create_library(
         ..., description="Name + metadata for the new library"
     ),
 ) -> Library:  
-    return create_library_service(payload)
+    return await asyncio.to_thread(create_library_service, payload)
 
 
 @router.get(
@@ -65,6 +67,62 @@ async def get_library(library_id: UUID = Path(..., description="UUID of the libr
         raise HTTPException(status_code=404, detail="Library not found")
 
 
+@router.get(
+    "/{library_id}/export",
+    status_code=status.HTTP_200_OK,
+    summary="Export every chunk of a Library",
+    responses={200: {"content": {NDJSON: {}, NPY: {}}}},
+)
+async def export_library(
+    library_id: UUID = Path(..., description="UUID of the library"),
+    accept: Optional[str] = Header(None),
+) -> StreamingResponse:
+    """
+    Streams the whole library, bypassing the response models:
+    - application/x-ndjson (default): one chunk per line, with text and metadata
+    - application/x-npy: ids + raw float32 embeddings as a NumPy record array
+    """
+    media_type = negotiate(accept, [NDJSON, NPY])
+    if media_type is None:
+        raise HTTPException(status_code=406, detail=f"Export is available as {NDJSON} or {NPY}")
+    try:
+        if media_type == NPY:
+            return StreamingResponse(
+                export_npy_service(library_id),
+                media_type=NPY,
+                headers={"Content-Disposition": f'attachment; filename="{library_id}.npy"'},
+            )
+        return StreamingResponse(export_ndjson_service(library_id), media_type=NDJSON)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Library not found")
+
+
+@router.post(
+    "/{library_id}/import",
+    response_model=ImportSummary,
+    status_code=status.HTTP_200_OK,
+    summary="Bulk import documents and chunks from an NDJSON body",
+    openapi_extra={"requestBody": {"content": {NDJSON: {"schema": {"type": "string"}}}}},
+)
+async def import_library(
+    request: Request,
+    library_id: UUID = Path(..., description="UUID of the library"),
+) -> ImportSummary:
+    """
+    One ChunkImportRow per line: {"document": key, "text": ..., "embedding"?: [...],
+    "metadata"?: {...}, "document_metadata"?: {...}}. The body is read as it
+    arrives; rows without an embedding are embedded server-side in batches.
+    """
+    try:
+        return await import_library_service(library_id, ndjson_records(request.stream()))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Library not found")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except EmbeddingServiceError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
 @router.put(
     "/{library_id}",
     response_model=Library,
@@ -78,7 +136,7 @@ async def update_library(
     ),
 ) -> Library:
     try:
-        return update_library_service(library_id, payload)
+        return await asyncio.to_thread(update_library_service, library_id, payload)
     except KeyError:
         raise HTTPException(status_code=404, detail="Library not found")
 
@@ -89,49 +147,144 @@ async def update_library(
 )
 async def delete_library(library_id: UUID = Path(..., description="UUID of the library")) -> None:
     try:
-        delete_library_service(library_id)
+        await asyncio.to_thread(delete_library_service, library_id)
     except KeyError:
         raise HTTPException(status_code=404, detail="Library not found")
 
 @router.post(
     "/{library_id}/search",
-    response_model=List[SearchResult],
+    response_model=List[SearchHit],
     status_code=status.HTTP_200_OK,
     summary="kNN search within a Library",
 )
 async def search_library(
     library_id: UUID = Path(..., description="UUID of the library"),
     payload: SearchRequest = Body(..., description="Search parameters"),
-) -> List[SearchResult]:
+) -> List[SearchHit]:
     """top-k most similar chunks within the given library"""
     try:
-        text = payload.text
-        response = co.embed(
-            texts=[text],
-            model="embed-v4.0",
-            input_type="classification",
-            embedding_types=["float"]
-        )
-        embedding = response.embeddings.float_[0]
+        if payload.text is not None:
+            embedding = await get_embedding_service().embed_query(payload.text)
+        else:
+            # raw vector / "more like this chunk": no embedding round-trip
+            embedding = query_vector_service(library_id, payload.vector, payload.similar_to_chunk_id)
 
-        return search_library_service(
+        results = await run_search(
+            search_library_service,
             library_id=library_id,
             query_embedding=embedding,
             k=payload.k,
             metric=payload.metric,
-            algorithm=payload.algorithm
+            algorithm=payload.algorithm,
+            ef_search=payload.ef_search,
+            nprobe=payload.nprobe,
+            filter=payload.filter,
+            include=payload.include,
+            # the source chunk is its own nearest neighbour
+            exclude_id=payload.similar_to_chunk_id,
         )
-    except KeyError:
+        # rows are already JSON-ready: skip response-model validation
+        return JSONResponse(content=results)
+    except KeyError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Library {library_id} not found",
+            detail=e.args[0] if e.args else f"Library {library_id} not found",
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
+        )
+    except EmbeddingServiceError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    except SearchOverloadedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Search timed out",
         )
 
 
+@router.post(
+    "/{library_id}/search:batch",
+    response_model=List[List[SearchHit]],
+    status_code=status.HTTP_200_OK,
+    summary="Many kNN searches within a Library in one request",
+)
+async def search_library_batch(
+    library_id: UUID = Path(..., description="UUID of the library"),
+    payload: BatchSearchRequest = Body(..., description="Queries + shared search parameters"),
+) -> List[List[SearchHit]]:
+    """one top-k result list per query, in query order"""
+    try:
+        # all texts go out in one batched embed call (minus query-cache hits)
+        texts = [query.text for query in payload.queries if query.text is not None]
+        embedded = iter(await get_embedding_service().embed_queries(texts) if texts else [])
+        embeddings = [
+            next(embedded) if query.text is not None else query.vector
+            for query in payload.queries
+        ]
 
+        results = await run_search(
+            search_library_batch_service,
+            library_id=library_id,
+            query_embeddings=embeddings,
+            k=payload.k,
+            metric=payload.metric,
+            algorithm=payload.algorithm,
+            ef_search=payload.ef_search,
+            nprobe=payload.nprobe,
+            filter=payload.filter,
+            include=payload.include,
+        )
+        return JSONResponse(content=results)
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Library {library_id} not found",
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
+        )
+    except EmbeddingServiceError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    except SearchOverloadedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"},
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Search timed out",
+        )
 
 
-
-
-
-
+@router.post(
+    "/{library_id}/index",
+    response_model=IndexInfo,
+    status_code=status.HTTP_200_OK,
+    summary="Build (or retrain) a Library's search index",
+)
+async def build_index(
+    library_id: UUID = Path(..., description="UUID of the library"),
+    payload: IndexBuildRequest = Body(..., description="Index algorithm + parameters"),
+) -> IndexInfo:
+    try:
+        # a full build can take seconds; keep it off the event loop
+        return await asyncio.to_thread(build_index_service, library_id, payload)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Library not found")
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
+        )
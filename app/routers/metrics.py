@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from ..dependencies import get_key_header
+from ..service.metrics_service import render_metrics
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    dependencies=[Depends(get_key_header)],
+)
+
+@router.get("", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Prometheus scrape target: per-stage latency, lock waits, caches and store sizes"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
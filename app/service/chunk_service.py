@@ -2,7 +2,8 @@ from uuid import uuid4, UUID
 from typing import List
 
 from ..models.chunk import Chunk, ChunkCreate, ChunkUpdate
-from ..store.in_memory import get_library, get_document, save_chunk, get_chunk, list_chunks, add_chunk_to_document, remove_chunk_from_document
+from ..utils.metrics import STAGE_SECONDS
+from ..store.in_memory import get_library, get_document, patch_chunk, get_chunk, get_chunk_record, list_chunks, add_chunk_to_document, add_chunks_to_document, remove_chunk_from_document
 
 def create_chunk_service(
         library_id: UUID, document_id: UUID, payload: ChunkCreate
@@ -23,11 +24,40 @@ def create_chunk_service(
     )
 
     # save chunk and attach to parent document
-    add_chunk_to_document(chunk, document_id)
+    with STAGE_SECONDS.time("insert"):
+        add_chunk_to_document(chunk, document_id)
 
     return chunk
 
 
+def bulk_create_chunks_service(
+        library_id: UUID, document_id: UUID, payloads: List[ChunkCreate]
+) -> List[Chunk]:
+    if get_library(library_id) is None:
+        raise KeyError("Library not found")
+    doc = get_document(document_id)
+    if doc is None or doc.library_id != library_id:
+        raise KeyError("Document not found")
+
+    chunks = [
+        Chunk(
+            id=uuid4(),
+            library_id=library_id,
+            document_id=document_id,
+            text=payload.text,
+            embedding=payload.embedding,
+            metadata=payload.metadata,
+        )
+        for payload in payloads
+    ]
+
+    # one locked store operation for the whole batch
+    with STAGE_SECONDS.time("insert"):
+        add_chunks_to_document(chunks, document_id)
+
+    return chunks
+
+
 def list_chunks_service(
     library_id: UUID, document_id: UUID
 ) -> List[Chunk]:
@@ -43,7 +73,6 @@ def list_chunks_service(
 def get_chunk_service(
     library_id: UUID, document_id: UUID, chunk_id: UUID
 ) -> Chunk:
-    doc_ = get_document
     chunk = get_chunk(chunk_id)
     if (
         chunk is None
@@ -57,14 +86,24 @@ def get_chunk_service(
 def update_chunk_service(
     library_id: UUID, document_id: UUID, chunk_id: UUID, payload: ChunkUpdate
 ) -> Chunk:
-    chunk = get_chunk_service(library_id, document_id, chunk_id)
-    updated = chunk.model_copy(update=payload.model_dump(exclude_none=True))
-    save_chunk(updated)
-    return updated
+    _check_chunk(library_id, document_id, chunk_id)
+    # only the given fields are rewritten; the vector stays put unless it is one of them
+    return patch_chunk(chunk_id, payload.model_dump(exclude_none=True))
 
 def delete_chunk_service(
     library_id: UUID, document_id: UUID, chunk_id: UUID
 ) -> None:
-    _ = get_chunk_service(library_id, document_id, chunk_id)
+    _check_chunk(library_id, document_id, chunk_id)
     # delete chunk and remove reference to parent document
     remove_chunk_from_document(chunk_id, document_id)
+
+
+def _check_chunk(library_id: UUID, document_id: UUID, chunk_id: UUID) -> None:
+    # ownership only: compares ids on the stored record, the vector isn't copied out
+    record = get_chunk_record(chunk_id)
+    if (
+        record is None
+        or record.library_id != library_id
+        or record.document_id != document_id
+    ):
+        raise KeyError("Chunk not found")
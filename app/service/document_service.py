@@ -2,7 +2,7 @@ from uuid import uuid4, UUID
 from typing import List
 
 from ..models.document import Document, DocumentCreate, DocumentUpdate
-from ..store.in_memory import save_document, get_document, list_documents, delete_document, get_library, get_chunk, save_chunk
+from ..store.in_memory import save_document, get_document, list_documents, delete_document, get_library, get_chunk_record, patch_chunk
 
 
 def create_document_service(
@@ -20,12 +20,11 @@ def create_document_service(
     save_document(doc)
     # attach existing chunks if chunk_ids supplied
     for chunk_id in payload.chunk_ids:
-        chunk = get_chunk(chunk_id)
+        chunk = get_chunk_record(chunk_id)
         if chunk is None or chunk.library_id != library_id:
             raise KeyError(f"Chunk {chunk_id} not found in library")
-        chunk = chunk.model_copy(update={"document_id": doc.id})
-        save_chunk(chunk)
-        doc.chunk_ids.append(chunk.id)
+        patch_chunk(chunk_id, {"document_id": doc.id})
+        doc.chunk_ids.append(chunk_id)
     # persist updated doc with new chunk_ids
     save_document(doc)
     return doc
@@ -59,18 +58,15 @@ def update_document_service(
         # detach previous
         for chunk_id in doc.chunk_ids:
             if chunk_id not in new_ids:
-                chunk = get_chunk(chunk_id)
-                chunk = chunk.model_copy(update={"document_id": None})
-                save_chunk(chunk)
+                patch_chunk(chunk_id, {"document_id": None})
         
         # attach new
         for chunk_id in new_ids:
-            chunk = get_chunk(chunk_id)
+            chunk = get_chunk_record(chunk_id)
             # ensures the chunk exists and that it is in this library
             if chunk is None or chunk.library_id != library_id:
                 raise KeyError(f"Chunk {chunk_id} not found")
-            chunk = chunk.model_copy(update={"document_id": document_id})
-            save_chunk(chunk)
+            patch_chunk(chunk_id, {"document_id": document_id})
 
         data["chunk_ids"] = new_ids
 
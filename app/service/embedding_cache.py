@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..utils.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC + collapsed whitespace; case is kept since embeddings are case-sensitive"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Query-embedding cache keyed by (model, input_type, normalized text).
+    Vectors are kept as read-only float32 arrays in an LRU with TTL. With a
+    path, entries are also written through to a SQLite file and looked up
+    there on a memory miss, so a restart starts warm. Every purge_every
+    writes the file drops expired rows and its oldest ones beyond
+    disk_maxsize, so it stays bounded however long the process runs.
+
+    The file is never touched on the event loop: get_many() looks misses up
+    in a worker thread, and put() hands rows to a writer thread that commits
+    whatever has queued up in one transaction.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        disk_maxsize: int = 100000,
+        purge_every: int = 1024,
+    ):
+        self.ttl = ttl
+        self.disk_maxsize = disk_maxsize
+        self.purge_every = max(purge_every, 1)
+        self._disk_writes = 0
+        self._memory = LRUCache(maxsize, ttl=ttl)
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        self._writes: "queue.Queue[Optional[Tuple[bytes, float, bytes]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.disk_hits = 0
+        if path:
+            self._open(path)
+
+    @staticmethod
+    def key(model: str, input_type: str, text: str) -> Tuple[str, str, str]:
+        return (model, input_type, normalize_text(text))
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[np.ndarray]:
+        """Blocking lookup in both tiers; async code uses get_many"""
+        vec = self._memory.get(key)
+        if vec is not None or self._disk is None:
+            return vec
+        return self._promote(key, self._disk_get([key])[0])
+
+    async def get_many(self, keys: Sequence[Tuple[str, str, str]]) -> List[Optional[np.ndarray]]:
+        """Memory hits straight away, the misses looked up on disk in one worker-thread call"""
+        vectors = [self._memory.get(key) for key in keys]
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing and self._disk is not None:
+            found = await asyncio.to_thread(self._disk_get, [keys[i] for i in missing])
+            for i, vec in zip(missing, found):
+                vectors[i] = self._promote(keys[i], vec)
+        return vectors
+
+    def put(self, key: Tuple[str, str, str], embedding) -> np.ndarray:
+        vec = np.array(embedding, dtype=np.float32)
+        vec.flags.writeable = False
+        self._memory.put(key, vec)
+        if self._disk is not None:
+            self._writes.put((self._digest(key), time.time(), vec.tobytes()))
+        return vec
+
+    def flush(self) -> None:
+        """Wait until every put so far is committed to the file"""
+        if self._writer is not None:
+            self._writes.join()
+
+    def stats(self) -> Dict[str, float]:
+        return {**self._memory.stats(), "disk_hits": self.disk_hits}
+
+    def close(self) -> None:
+        if self._writer is not None:
+            # the writer commits what is still queued before it exits
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+        if self._disk is not None:
+            with self._disk_lock:
+                self._disk.close()
+                self._disk = None
+
+    def _promote(self, key: Tuple[str, str, str], vec: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        if vec is not None:
+            self.disk_hits += 1
+            self._memory.put(key, vec)
+        return vec
+
+    # ----------------- disk spill ------------------
+
+    def _open(self, path: str) -> None:
+        self._disk = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(digest BLOB PRIMARY KEY, created REAL NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._disk.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+        self._purge()
+        self._writer = threading.Thread(target=self._write_loop, name="embedding-cache-writer", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _digest(key: Tuple[str, str, str]) -> bytes:
+        return hashlib.sha256("\0".join(key).encode()).digest()
+
+    def _disk_get(self, keys: Sequence[Tuple[str, str, str]]) -> List[Optional[np.ndarray]]:
+        with self._disk_lock:
+            rows = [
+                self._disk.execute(
+                    "SELECT created, vector FROM embeddings WHERE digest = ?", (self._digest(key),)
+                ).fetchone()
+                for key in keys
+            ]
+        expired = -1.0 if self.ttl is None else time.time() - self.ttl
+        return [
+            None if row is None or row[0] < expired else np.frombuffer(row[1], dtype=np.float32)
+            for row in rows
+        ]
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._writes.get()]
+            while not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            rows = [row for row in batch if row is not None]
+            try:
+                if rows:
+                    self._disk_put(rows)
+            except Exception:
+                # the memory tier still has them; only the warm restart loses these rows
+                logger.exception("embedding cache write of %d rows failed", len(rows))
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+            if len(rows) < len(batch):
+                return
+
+    def _disk_put(self, rows: List[Tuple[bytes, float, bytes]]) -> None:
+        with self._disk_lock:
+            self._disk.execute("BEGIN")
+            try:
+                self._disk.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+                before, self._disk_writes = self._disk_writes, self._disk_writes + len(rows)
+                if before // self.purge_every != self._disk_writes // self.purge_every:
+                    self._purge()
+            except BaseException:
+                self._disk.execute("ROLLBACK")
+                raise
+            self._disk.execute("COMMIT")
+
+    def _purge(self) -> None:
+        # caller holds _disk_lock (or is still opening); both deletes walk the created index
+        if self.ttl is not None:
+            self._disk.execute("DELETE FROM embeddings WHERE created < ?", (time.time() - self.ttl,))
+        self._disk.execute(
+            "DELETE FROM embeddings WHERE created <= ("
+            "SELECT created FROM embeddings ORDER BY created DESC LIMIT 1 OFFSET ?)",
+            (self.disk_maxsize,),
+        )
@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import random
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+import numpy as np
+
+from ..config import Config
+from ..utils.metrics import STAGE_SECONDS
+from .embedding_cache import EmbeddingCache
+
+
+class EmbeddingServiceError(Exception):
+    """The upstream embedding provider failed after all retries"""
+
+
+# ----------------- backends ------------------
+
+class CohereBackend:
+    """
+    Cohere embed via the async client, sharing one pooled httpx.AsyncClient
+    (keep-alive connections, bounded pool, per-request timeout).
+    """
+
+    def __init__(self, api_key: Optional[str], model: str, timeout: float, max_connections: int):
+        import cohere
+
+        self.model = model
+        self._http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self._client = cohere.AsyncClientV2(
+            api_key=api_key, timeout=timeout, httpx_client=self._http
+        )
+
+    async def embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        response = await self._client.embed(
+            texts=texts,
+            model=self.model,
+            input_type=input_type,
+            embedding_types=["float"],
+        )
+        return response.embeddings.float_
+
+    def is_retryable(self, exc: Exception) -> bool:
+        if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+            return True
+        status_code = getattr(exc, "status_code", None)
+        return status_code == 429 or (status_code is not None and status_code >= 500)
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+class FakeBackend:
+    """
+    Offline backend: deterministic pseudo-random unit vectors seeded by a hash
+    of (input_type, text). Same text, same vector; no network.
+    """
+
+    def __init__(self, dim: int = 1024, model: str = "fake"):
+        self.dim = dim
+        self.model = model
+        self.calls = 0
+
+    async def embed(self, texts: List[str], input_type: str) -> List[List[float]]:
+        self.calls += 1
+        out = []
+        for text in texts:
+            seed = hashlib.sha256(f"{input_type}\0{text}".encode()).digest()
+            rng = np.random.default_rng(int.from_bytes(seed[:8], "little"))
+            vec = rng.standard_normal(self.dim)
+            out.append((vec / np.linalg.norm(vec)).tolist())
+        return out
+
+    def is_retryable(self, exc: Exception) -> bool:
+        return False
+
+    async def aclose(self) -> None:
+        pass
+
+
+# ----------------- service ------------------
+
+class _LoopState:
+    """asyncio primitives are bound to one event loop, so each loop gets its own"""
+
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # input_type -> pending (text, future) waiting for the next coalesced call
+        self.pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self.flush_handles: Dict[str, asyncio.TimerHandle] = {}
+        # coalesced calls in flight; the loop only keeps weak references to tasks
+        self.tasks: Set[asyncio.Task] = set()
+
+
+class EmbeddingService:
+    """
+    Shared async embedding client.
+    - embed(): splits into max-size batches, bounded concurrency, retry with
+      exponential backoff + jitter on timeouts / 429 / 5xx.
+    - embed_one(): micro-batcher; single-text requests arriving within
+      coalesce_ms of each other are merged into one upstream call.
+    - embed_query(): embed_one behind the query-embedding cache, if any;
+      embed_queries() is the same for a batch of texts.
+    """
+
+    def __init__(
+        self,
+        backend,
+        batch_size: int = 96,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        backoff: float = 0.2,
+        coalesce_ms: float = 5.0,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.backend = backend
+        self.cache = cache
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.coalesce_ms = coalesce_ms
+        self._loops: Dict[asyncio.AbstractEventLoop, _LoopState] = {}
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            # drop state of loops that have gone away (e.g. per-test loops)
+            for old in [old for old in self._loops if old.is_closed()]:
+                del self._loops[old]
+            state = self._loops[loop] = _LoopState(self.concurrency)
+        return state
+
+    async def embed(
+        self, texts: List[str], input_type: str = "classification"
+    ) -> List[List[float]]:
+        batches = [
+            texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        ]
+        results = await asyncio.gather(
+            *(self._call(batch, input_type) for batch in batches)
+        )
+        return [embedding for batch in results for embedding in batch]
+
+    async def embed_one(self, text: str, input_type: str = "classification") -> List[float]:
+        state = self._state()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = state.pending.setdefault(input_type, [])
+        pending.append((text, future))
+
+        if len(pending) >= self.batch_size:
+            self._flush(state, input_type)
+        elif input_type not in state.flush_handles:
+            state.flush_handles[input_type] = loop.call_later(
+                self.coalesce_ms / 1000.0, self._flush, state, input_type
+            )
+        return await future
+
+    async def embed_query(self, text: str, input_type: str = "classification") -> np.ndarray:
+        """Query embedding as a read-only float32 array, served from the cache when possible"""
+        if self.cache is None:
+            return np.asarray(await self.embed_one(text, input_type), dtype=np.float32)
+        key = self.cache.key(self.backend.model, input_type, text)
+        vec = (await self.cache.get_many([key]))[0]
+        if vec is None:
+            vec = self.cache.put(key, await self.embed_one(text, input_type))
+        return vec
+
+    async def embed_queries(self, texts: List[str], input_type: str = "classification") -> List[np.ndarray]:
+        """embed_query for many texts: cache hits are served locally, the misses go out batched"""
+        if self.cache is None:
+            return [np.asarray(vec, dtype=np.float32) for vec in await self.embed(texts, input_type)]
+        keys = [self.cache.key(self.backend.model, input_type, text) for text in texts]
+        vectors = await self.cache.get_many(keys)
+        # duplicate texts in one batch are embedded once
+        missing = {key: text for key, text, vec in zip(keys, texts, vectors) if vec is None}
+        if missing:
+            fresh = await self.embed(list(missing.values()), input_type)
+            stored = {key: self.cache.put(key, vec) for key, vec in zip(missing, fresh)}
+            vectors = [stored[key] if vec is None else vec for key, vec in zip(keys, vectors)]
+        return vectors
+
+    def _flush(self, state: _LoopState, input_type: str) -> None:
+        handle = state.flush_handles.pop(input_type, None)
+        if handle is not None:
+            handle.cancel()
+        batch = state.pending.pop(input_type, [])
+        if batch:
+            task = asyncio.ensure_future(self._deliver(batch, input_type))
+            state.tasks.add(task)
+            task.add_done_callback(state.tasks.discard)
+
+    async def _deliver(self, batch: List[Tuple[str, asyncio.Future]], input_type: str) -> None:
+        try:
+            embeddings = await self._call([text for text, _ in batch], input_type)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    async def _call(self, texts: List[str], input_type: str) -> List[List[float]]:
+        # timed as the caller sees it: waiting for a slot, retries and backoff included
+        with STAGE_SECONDS.time("embed"):
+            state = self._state()
+            attempt = 0
+            while True:
+                try:
+                    async with state.semaphore:
+                        return await self.backend.embed(texts, input_type)
+                except Exception as exc:
+                    if attempt >= self.max_retries or not self.backend.is_retryable(exc):
+                        raise EmbeddingServiceError(f"Embedding request failed: {exc}") from exc
+                    # exponential backoff with full jitter
+                    await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+                    attempt += 1
+
+    async def aclose(self) -> None:
+        await self.backend.aclose()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_service: Optional[EmbeddingService] = None
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Process-wide EmbeddingService, created on first use from Config"""
+    global _service
+    if _service is None:
+        if Config.EMBEDDING_BACKEND == "fake":
+            backend = FakeBackend(dim=Config.FAKE_EMBEDDING_DIM)
+        else:
+            backend = CohereBackend(
+                api_key=Config.COHERE_KEY,
+                model=Config.EMBED_MODEL,
+                timeout=Config.EMBED_TIMEOUT,
+                max_connections=Config.EMBED_CONCURRENCY * 2,
+            )
+        _service = EmbeddingService(
+            backend,
+            batch_size=Config.EMBED_BATCH_SIZE,
+            concurrency=Config.EMBED_CONCURRENCY,
+            max_retries=Config.EMBED_MAX_RETRIES,
+            coalesce_ms=Config.EMBED_COALESCE_MS,
+            cache=EmbeddingCache(
+                Config.EMBED_CACHE_SIZE,
+                ttl=Config.EMBED_CACHE_TTL or None,
+                path=Config.EMBED_CACHE_PATH,
+                disk_maxsize=Config.EMBED_CACHE_DISK_SIZE,
+            ) if Config.EMBED_CACHE_SIZE > 0 else None,
+        )
+    return _service
+
+
+def set_embedding_service(service: Optional[EmbeddingService]) -> None:
+    """Swap the process-wide service, e.g. for a FakeBackend in tests"""
+    global _service
+    _service = service
+
+
+def embedding_cache_stats() -> Optional[dict]:
+    """Query-embedding cache stats, None until the service exists or when caching is off"""
+    if _service is None or _service.cache is None:
+        return None
+    return _service.cache.stats()
+
+
+async def close_embedding_service() -> None:
+    global _service
+    if _service is not None:
+        await _service.aclose()
+        _service = None
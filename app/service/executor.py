@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from ..config import Config
+
+
+class SearchOverloadedError(Exception):
+    """Too many searches queued or running; the client should back off and retry"""
+
+
+class SearchExecutor:
+    """
+    Runs CPU-bound search work off the event loop on a bounded thread pool.
+    What the threads buy depends on the algorithm:
+    - brute force, IVF list scans and quantized scans spend their time in
+      NumPy products and argpartitions, which release the GIL, so these
+      searches do run in parallel, without copying the matrices.
+    - VP-tree and HNSW traversals are Python loops that hold the GIL; threads
+      keep them off the event loop but run them one at a time, so their
+      throughput is that of a single core however many workers there are.
+
+    - max_pending bounds queued + running calls; past it submit() fails fast
+      with SearchOverloadedError instead of growing an unbounded queue.
+    - timeout (seconds) bounds how long a request waits; a call that has not
+      started yet is cancelled, one already running finishes in the background.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: Optional[float] = None):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="search")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise SearchOverloadedError(
+                    f"Search queue is full ({self.max_pending} pending); retry later"
+                )
+            self._pending += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        # released when the work really ends, not when the caller gives up on it
+        future.add_done_callback(self._release)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def _release(self, _: Optional[Future]) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executor: Optional[SearchExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> SearchExecutor:
+    """Process-wide SearchExecutor, created on first use from Config"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = SearchExecutor(
+                workers=Config.SEARCH_WORKERS,
+                max_pending=Config.SEARCH_QUEUE_DEPTH,
+                timeout=Config.SEARCH_TIMEOUT or None,
+            )
+        return _executor
+
+
+async def run_search(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await get_search_executor().run(fn, *args, **kwargs)
+
+
+def shutdown_search_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -0,0 +1,112 @@
+import io
+import json
+from typing import Iterator, List, Optional, Sequence
+from uuid import UUID
+
+import numpy as np
+
+from ..store.in_memory import chunk_fields, export_chunks, get_document, get_library, list_chunk_ids
+
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+NPY = "application/x-npy"
+
+_ROW_FIELDS = ("id", "document_id", "text", "metadata", "embedding")
+_NDJSON_BATCH = 512  # rows read from the store (and sent) per chunk of the stream
+_NPY_BLOCK = 4096  # rows per write of the binary body
+
+
+def negotiate(accept: Optional[str], offered: Sequence[str]) -> Optional[str]:
+    """
+    Media type to answer with: the client's highest-q acceptable one, ties
+    going to the server's order. No Accept header picks offered[0]; None
+    means nothing offered is acceptable (406).
+    """
+    if not accept:
+        return offered[0]
+    best, best_q = None, 0.0
+    for entry in accept.split(","):
+        media, _, params = entry.strip().partition(";")
+        media = media.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q <= 0:
+            continue
+        for candidate in offered:
+            kind = candidate.split("/")[0]
+            if media in (candidate, "*/*", kind + "/*") and (
+                q > best_q or (q == best_q and offered.index(candidate) < offered.index(best))
+            ):
+                best, best_q = candidate, q
+    return best
+
+
+def check_export_target(library_id: UUID, document_id: Optional[UUID] = None) -> None:
+    """Raise KeyError before a stream starts: afterwards the status is already sent"""
+    if get_library(library_id) is None:
+        raise KeyError("Library not found")
+    if document_id is not None:
+        doc = get_document(document_id)
+        if doc is None or doc.library_id != library_id:
+            raise KeyError("Document not found")
+
+
+def export_ndjson_service(library_id: UUID, document_id: Optional[UUID] = None) -> Iterator[bytes]:
+    """
+    One JSON object per chunk and line, read from the store a batch at a time
+    so the whole list is never built. Each batch is consistent on its own;
+    chunks deleted mid-export are skipped.
+    """
+    check_export_target(library_id, document_id)
+    chunk_ids = list_chunk_ids(library_id, document_id)
+
+    def rows() -> Iterator[bytes]:
+        lib = str(library_id)
+        for start in range(0, len(chunk_ids), _NDJSON_BATCH):
+            lines: List[str] = []
+            for row in chunk_fields(chunk_ids[start:start + _NDJSON_BATCH], _ROW_FIELDS):
+                if row is None:
+                    continue
+                row["library_id"] = lib
+                lines.append(json.dumps(row))
+            if lines:
+                yield ("\n".join(lines) + "\n").encode()
+
+    return rows()
+
+
+def export_npy_service(library_id: UUID, document_id: Optional[UUID] = None) -> Iterator[bytes]:
+    """
+    A NumPy .npy file of one structured record per chunk: id and document_id
+    as 36-byte ASCII UUIDs (empty when detached) and the embedding as raw
+    float32 (NaN for chunks without one). Text and metadata are left to the
+    NDJSON format. np.load() reads it back without any parsing.
+    """
+    check_export_target(library_id, document_id)
+
+    def body() -> Iterator[bytes]:
+        # built lazily: the response streams from a worker thread, off the event loop
+        records, vectors = export_chunks(library_id, document_id)
+        table = np.empty(len(records), dtype=[
+            ("id", "S36"),
+            ("document_id", "S36"),
+            ("embedding", "<f4", (vectors.shape[1],)),
+        ])
+        table["id"] = [str(chunk.id) for chunk in records]
+        table["document_id"] = ["" if chunk.document_id is None else str(chunk.document_id) for chunk in records]
+        table["embedding"] = vectors
+        del records, vectors
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(table))
+        yield header.getvalue()
+        for start in range(0, len(table), _NPY_BLOCK):
+            yield table[start:start + _NPY_BLOCK].tobytes()
+
+    return body()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Set, Tuple
+from uuid import UUID, uuid4
+
+from pydantic import ValidationError
+
+from ..config import Config
+from ..models.chunk import Chunk, ChunkImportRow
+from ..models.document import Document
+from ..models.library import ImportSummary
+from ..store.in_memory import get_library, import_batch, rebuild_library_index, suspend_library_indexes
+from ..utils.metrics import STAGE_SECONDS
+from .embedding_service import get_embedding_service
+
+
+logger = logging.getLogger(__name__)
+
+# (line number, parsed row), line numbers counted from 1 for error messages
+Record = Tuple[int, Dict[str, Any]]
+
+
+async def ndjson_records(chunks: AsyncIterable[bytes]) -> AsyncIterator[Record]:
+    """Parse an NDJSON byte stream line by line; blank lines are skipped"""
+    buffer = b""
+    line_no = 0
+    async for data in chunks:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, _parse(line_no, line)
+    if buffer.strip():
+        yield line_no + 1, _parse(line_no + 1, buffer)
+
+
+async def import_library_service(
+    library_id: UUID,
+    records: AsyncIterable[Record],
+    batch_rows: int = Config.IMPORT_BATCH_ROWS,
+) -> ImportSummary:
+    """
+    Stream rows into a library, holding at most batch_rows of them at a time:
+    each batch has its missing embeddings computed in batched upstream calls
+    and is inserted in one store step. The library's search indexes are
+    detached for the duration and rebuilt once at the end.
+    A bad row raises ValueError; batches before it stay imported.
+    A document's metadata comes from the first of its rows that sets it,
+    whichever batch that row is in.
+    """
+    if get_library(library_id) is None:
+        raise KeyError("Library not found")
+
+    summary = ImportSummary(library_id=library_id, documents=0, chunks=0, embedded=0)
+    documents: Dict[str, UUID] = {}
+    described: Set[str] = set()
+    batch: List[Tuple[int, ChunkImportRow]] = []
+    suspended = await asyncio.to_thread(suspend_library_indexes, library_id)
+    failed = True
+    try:
+        async for line_no, row in records:
+            try:
+                batch.append((line_no, ChunkImportRow.model_validate(row)))
+            except ValidationError as e:
+                problems = "; ".join(
+                    f"{'.'.join(map(str, err['loc'])) or 'row'}: {err['msg']}" for err in e.errors()
+                )
+                raise ValueError(_at(line_no, summary, problems))
+            if len(batch) >= batch_rows:
+                await _flush(library_id, batch, documents, described, summary)
+                batch = []
+        if batch:
+            await _flush(library_id, batch, documents, described, summary)
+        failed = False
+    finally:
+        for algorithm, metric, params in suspended:
+            try:
+                await asyncio.to_thread(rebuild_library_index, library_id, algorithm, metric, params)
+            except Exception:
+                if not failed:
+                    raise
+                # the import error is the one to report; searches rebuild the index lazily
+                logger.exception("rebuilding %s/%s index of library %s after a failed import failed",
+                                 algorithm, metric, library_id)
+                continue
+            summary.indexes.append(f"{algorithm}/{metric}")
+    return summary
+
+
+async def _flush(
+    library_id: UUID,
+    batch: List[Tuple[int, ChunkImportRow]],
+    documents: Dict[str, UUID],
+    described: Set[str],
+    summary: ImportSummary,
+) -> None:
+    missing = [row for _, row in batch if row.embedding is None]
+    if missing:
+        embeddings = await get_embedding_service().embed([row.text for row in missing])
+        for row, embedding in zip(missing, embeddings):
+            row.embedding = embedding
+
+    new_documents: Dict[str, Document] = {}
+    # metadata first given in this batch for documents saved by earlier ones
+    late_metadata: Dict[UUID, Dict[str, Any]] = {}
+    chunks: List[Chunk] = []
+    for _, row in batch:
+        if row.document not in documents:
+            documents[row.document] = uuid4()
+            new_documents[row.document] = Document(id=documents[row.document], library_id=library_id)
+        if row.document_metadata is not None and row.document not in described:
+            described.add(row.document)
+            doc = new_documents.get(row.document)
+            if doc is not None:
+                doc.metadata = row.document_metadata
+            else:
+                late_metadata[documents[row.document]] = row.document_metadata
+        # rows are already validated: skip a second pass over every float
+        chunks.append(Chunk.model_construct(
+            id=uuid4(),
+            library_id=library_id,
+            document_id=documents[row.document],
+            text=row.text,
+            embedding=row.embedding,
+            metadata=row.metadata,
+        ))
+    try:
+        with STAGE_SECONDS.time("insert"):
+            await asyncio.to_thread(import_batch, library_id, list(new_documents.values()), chunks, late_metadata)
+    except ValueError as e:
+        raise ValueError(_at(batch[0][0], summary, f"batch starting here rejected: {e}"))
+    summary.documents += len(new_documents)
+    summary.chunks += len(chunks)
+    summary.embedded += len(missing)
+
+
+def _parse(line_no: int, line: bytes) -> Dict[str, Any]:
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"line {line_no}: invalid JSON ({e})")
+    if not isinstance(row, dict):
+        raise ValueError(f"line {line_no}: expected a JSON object")
+    return row
+
+
+def _at(line_no: int, summary: ImportSummary, message: str) -> str:
+    return f"line {line_no}: {message} ({summary.chunks} chunks imported before it)"
@@ -0,0 +1,28 @@
+from uuid import UUID
+
+from ..models.index import IndexBuildRequest, IndexInfo
+from ..store.in_memory import get_library, rebuild_library_index
+
+
+def build_index_service(
+    library_id: UUID, payload: IndexBuildRequest
+) -> IndexInfo:
+    if get_library(library_id) is None:
+        raise KeyError("Library not found")
+
+    params = payload.model_dump(exclude_none=True, exclude={"algorithm", "metric"})
+    if payload.algorithm == "ivf":
+        # explicit requests train k-means now, whatever the library size
+        params["train_threshold"] = 0
+
+    index = rebuild_library_index(library_id, payload.algorithm, payload.metric, params)
+    if index is None:
+        raise ValueError("Library has no embedded chunks to index")
+
+    return IndexInfo(
+        library_id=library_id,
+        algorithm=payload.algorithm,
+        metric=payload.metric,
+        size=len(index),
+        nlist=index.nlist if payload.algorithm == "ivf" else None,
+    )
@@ -1,14 +1,17 @@
+import logging
 from uuid import uuid4, UUID
 from typing import List
 
 from ..models.library import Library, LibraryCreate, LibraryUpdate
 from ..store.in_memory import save_library, get_library, list_libraries, delete_library
 
+logger = logging.getLogger(__name__)
+
 
 def create_library_service(payload: LibraryCreate) -> Library:
     lib = Library(id=uuid4(), **payload.model_dump())
-    print("lib: ", lib)
     save_library(lib)
+    logger.info("library created id=%s name=%r compression=%s", lib.id, lib.name, lib.compression)
 
     return lib
 
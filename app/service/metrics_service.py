@@ -0,0 +1,56 @@
+from typing import List, Tuple
+
+from ..store.in_memory import library_stats
+from ..utils.metrics import REGISTRY, CallbackMetric
+from .embedding_service import embedding_cache_stats
+from .search_service import result_cache_stats
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text format"""
+    return REGISTRY.render()
+
+
+def _library_gauge(field: str):
+    return lambda: [((str(stats["library_id"]),), stats[field]) for stats in library_stats()]
+
+
+def _index_sizes() -> List[Tuple[Tuple[str, ...], float]]:
+    return [
+        ((str(stats["library_id"]), algorithm, metric), size)
+        for stats in library_stats()
+        for (algorithm, metric), size in stats["indexes"].items()
+    ]
+
+
+def _cache_stat(field: str):
+    def collect() -> List[Tuple[Tuple[str, ...], float]]:
+        caches = [("search_results", result_cache_stats()), ("query_embeddings", embedding_cache_stats())]
+        return [((name,), stats[field]) for name, stats in caches if stats is not None]
+    return collect
+
+
+for _field, _help in (
+    ("chunks", "Chunks per library"),
+    ("documents", "Documents per library"),
+    ("vectors", "Embeddings held in the library's matrix"),
+):
+    REGISTRY.register(CallbackMetric(
+        f"vectordb_library_{_field}", _help, "gauge", ["library_id"], _library_gauge(_field)
+    ))
+REGISTRY.register(CallbackMetric(
+    "vectordb_index_size", "Vectors in each search index", "gauge",
+    ["library_id", "algorithm", "metric"], _index_sizes,
+))
+REGISTRY.register(CallbackMetric(
+    "vectordb_cache_hits_total", "Cache lookups served from the cache", "counter", ["cache"], _cache_stat("hits"),
+))
+REGISTRY.register(CallbackMetric(
+    "vectordb_cache_misses_total", "Cache lookups that missed", "counter", ["cache"], _cache_stat("misses"),
+))
+REGISTRY.register(CallbackMetric(
+    "vectordb_cache_hit_ratio", "Hits / lookups since start", "gauge", ["cache"], _cache_stat("hit_ratio"),
+))
+REGISTRY.register(CallbackMetric(
+    "vectordb_cache_entries", "Entries currently cached", "gauge", ["cache"], _cache_stat("size"),
+))
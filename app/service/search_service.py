@@ -1,10 +1,56 @@
-from uuid import uuid4, UUID
-from typing import List, Tuple, Callable
-from ..models.search import SearchResult
-from ..store.in_memory import list_all_chunks_in_library, list_chunks
-from ..utils.knn import brute_force_knn, cosine_similarity, l2_distance, build_vptree, vptree_knn
-from ..models.chunk import Chunk
+import hashlib
+import logging
+import math
+from uuid import UUID
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
+
+from ..config import Config
+from ..models.search import DEFAULT_INCLUDE, MetadataFilter
+from ..store.in_memory import (
+    chunk_fields, filter_chunk_ids, list_chunk_ids, get_chunk, get_library_index, library_dimension,
+    library_embedding_parts, library_vector_count, library_version,
+)
+from ..utils.knn import brute_force_knn_batch, merge_top_k, quantized_knn
+from ..utils.lru_cache import LRUCache
+from ..utils.metrics import STAGE_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+# (chunk_id, score) pairs, best first
+Hits = List[Tuple[UUID, float]]
+
+# raw hits keyed by the library's data version, so any chunk mutation makes
+# older entries unreachable and LRU eviction reclaims them
+_result_cache = LRUCache(Config.SEARCH_CACHE_SIZE)
+
+
+
+def query_vector_service(
+    library_id: UUID,
+    vector: Optional[List[float]] = None,
+    chunk_id: Optional[UUID] = None,
+) -> np.ndarray:
+    """
+    Query vector given directly or taken from a stored chunk, checked
+    against the library's dimension; no embedding call involved.
+    """
+    if library_version(library_id) is None:
+        raise KeyError(f"Library {library_id} not found")
+    if chunk_id is not None:
+        chunk = get_chunk(chunk_id)
+        if chunk is None or chunk.library_id != library_id:
+            raise KeyError(f"Chunk {chunk_id} not found in library {library_id}")
+        if chunk.embedding is None:
+            raise ValueError(f"Chunk {chunk_id} has no embedding")
+        vector = chunk.embedding
+    q = np.asarray(vector, dtype=np.float32)
+    dim = library_dimension(library_id)
+    if dim is not None and q.shape[0] != dim:
+        raise ValueError(f"Query dimension {q.shape[0]} does not match library dimension {dim}")
+    return q
 
 
 def search_library_service(
@@ -13,12 +59,34 @@ def search_library_service(
     k: int,
     metric: str = "cosine",
     algorithm: str = "brute",
-) -> List[SearchResult]:
-    candidates = list_all_chunks_in_library(library_id)
-    if not candidates:
-        return []
-    
-    return _run_knn(candidates, query_embedding, k, metric, algorithm)
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    filter: Optional[MetadataFilter] = None,
+    include: Sequence[str] = DEFAULT_INCLUDE,
+    exclude_id: Optional[UUID] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Top-k hits as plain dicts holding only the `include` fields.
+    exclude_id drops one chunk (the source of a "similar to" search).
+    """
+    fetch = k if exclude_id is None else k + 1
+
+    def search() -> Hits:
+        allowed = None
+        if filter is not None:
+            with STAGE_SECONDS.time("candidate_fetch"):
+                allowed = filter_chunk_ids(library_id, filter)
+        return _run_knn(
+            library_id, query_embedding, fetch, metric, algorithm,
+            ef_search=ef_search, nprobe=nprobe, allowed=allowed,
+        )
+
+    hits = _cached(
+        (library_id, None, _query_digest(query_embedding), fetch, metric, algorithm, ef_search, nprobe,
+         _filter_key(filter)),
+        search,
+    )
+    return _project(hits, k, include, exclude_id)
 
 
 def search_document_service(
@@ -28,41 +96,272 @@ def search_document_service(
     k: int,
     metric: str = "cosine",
     algorithm: str = "brute",
-) -> List[SearchResult]:
-    candidates = list_chunks(library_id, document_id)
-    print("candidates: ", candidates)
-    if not candidates:
-        return []
-    
-    return _run_knn(candidates, query_embedding, k, metric, algorithm)
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    filter: Optional[MetadataFilter] = None,
+    include: Sequence[str] = DEFAULT_INCLUDE,
+    exclude_id: Optional[UUID] = None,
+) -> List[Dict[str, Any]]:
+    fetch = k if exclude_id is None else k + 1
+
+    def search() -> Hits:
+        with STAGE_SECONDS.time("candidate_fetch"):
+            candidates = list_chunk_ids(library_id, document_id)
+            if filter is not None:
+                allowed = filter_chunk_ids(library_id, filter)
+                candidates = [chunk_id for chunk_id in candidates if chunk_id in allowed]
+        if not candidates:
+            return []
+
+        return _run_knn(
+            library_id, query_embedding, fetch, metric, algorithm, candidates,
+            ef_search, nprobe,
+        )
+
+    hits = _cached(
+        (library_id, document_id, _query_digest(query_embedding), fetch, metric, algorithm, ef_search, nprobe,
+         _filter_key(filter)),
+        search,
+    )
+    return _project(hits, k, include, exclude_id)
+
+
+def search_library_batch_service(
+    library_id: UUID,
+    query_embeddings: List[List[float]],
+    k: int,
+    metric: str = "cosine",
+    algorithm: str = "brute",
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    filter: Optional[MetadataFilter] = None,
+    include: Sequence[str] = DEFAULT_INCLUDE,
+) -> List[List[Dict[str, Any]]]:
+    """
+    One hit list per query. Cached queries are answered from the result
+    cache; brute-force misses are scored together with one matrix-matrix
+    product per pass over the library, index searches run one by one.
+    """
+    if library_version(library_id) is None:
+        raise KeyError(f"Library {library_id} not found")
+    queries = [np.asarray(q, dtype=np.float32) for q in query_embeddings]
+    if len({q.shape for q in queries}) > 1:
+        raise ValueError("All query vectors must have the same dimension")
+    keys = [
+        _versioned((library_id, None, _query_digest(q), k, metric, algorithm, ef_search, nprobe, _filter_key(filter)))
+        for q in queries
+    ]
+    results = [None if key is None else _result_cache.get(key) for key in keys]
+    todo = [i for i, found in enumerate(results) if found is None]
+    if todo:
+        computed = _run_knn_batch(
+            library_id, np.stack([queries[i] for i in todo]), k, metric, algorithm, ef_search, nprobe, filter
+        )
+        for i, found in zip(todo, computed):
+            results[i] = found
+            if keys[i] is not None:
+                _result_cache.put(keys[i], found)
+    return [_project(hits, k, include) for hits in results]
+
+
+def result_cache_stats() -> dict:
+    return _result_cache.stats()
+
+
+def _filter_key(filter: Optional[MetadataFilter]) -> Optional[str]:
+    return None if filter is None else filter.model_dump_json(by_alias=True, exclude_unset=True)
+
+
+def _query_digest(query_embedding: List[float]) -> bytes:
+    q = np.ascontiguousarray(query_embedding, dtype=np.float32)
+    return hashlib.blake2b(q.tobytes(), digest_size=16).digest()
+
+
+def _versioned(key: tuple) -> Optional[tuple]:
+    # read the version before searching: a write that lands mid-search makes
+    # the stored entry unreachable rather than stale
+    if _result_cache.maxsize <= 0:
+        return None
+    version = library_version(key[0])
+    if version is None:
+        return None
+    return (version,) + key
+
+
+def _cached(key: tuple, search: Callable[[], Hits]) -> Hits:
+    key = _versioned(key)
+    if key is None:
+        return search()
+    results = _result_cache.get(key)
+    if results is None:
+        results = search()
+        _result_cache.put(key, results)
+    return results
 
 
 def _run_knn(
-    chunks: List[Chunk],
+    library_id: UUID,
     query_embedding: List[float],
     k: int,
     metric: str,
     algorithm: str = "brute",
-) -> List[SearchResult]:
-
-    metric_fn: Callable = cosine_similarity if metric == "cosine" else l2_distance
-
-    prepared = [(chunk.id, chunk.embedding, chunk) for chunk in chunks]
-
-    # dispatch on algorithm
-    raw_hits = []
-    if algorithm == "vptree":
-        print("Vptree")
-        tree = build_vptree(prepared, metric_fn)
-        raw_hits = vptree_knn(tree, query_embedding, k, metric_fn)
-    else:
-        print("brute force")
-        raw_hits = brute_force_knn(
-            query_embedding, prepared, k, metric_fn
-        )
+    chunk_ids: Optional[List[UUID]] = None,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    allowed: Optional[Dict[UUID, None]] = None,
+) -> Hits:
+    """
+    kNN over the library, or only over `chunk_ids` when given (document search).
+    `allowed` (chunk ids matching a metadata filter) restricts library searches:
+    - few matches: pre-filter, i.e. an exact scan of just those rows, which
+      costs O(matches) instead of O(library)
+    - many matches: index searches skip non-matching ids during traversal;
+      brute force over-fetches by 1/selectivity and post-filters
+    """
+    candidate_ids = chunk_ids
+    if allowed is not None and chunk_ids is None:
+        if not allowed:
+            return []
+        total = library_vector_count(library_id)
+        if len(allowed) <= Config.SEARCH_PREFILTER_SELECTIVITY * total:
+            candidate_ids = list(allowed)
+        elif algorithm == "brute":
+            # each fetched row matches with probability ~selectivity; 2x margin
+            fetch = min(total, math.ceil(2 * k * total / len(allowed)))
+            hits = [
+                (chunk_id, score)
+                for chunk_id, score in _scan(library_id, query_embedding, fetch, metric, None)
+                if chunk_id in allowed
+            ]
+            if len(hits) < k and fetch < total:
+                # unlucky: too few survived, scan the matches exactly instead
+                hits = _scan(library_id, query_embedding, k, metric, list(allowed))
+            return hits[:k]
+
+    # dispatch on algorithm; document-scoped and pre-filtered searches are small
+    # enough that an exact scan of their rows beats walking the library-wide index
+    if algorithm != "brute" and candidate_ids is None:
+        logger.debug("knn library=%s algorithm=%s metric=%s k=%d filtered=%s",
+                     library_id, algorithm, metric, k, allowed is not None)
+        # covers a lazy first build of the index too
+        with STAGE_SECONDS.time("index_lookup"):
+            index = get_library_index(library_id, algorithm, metric)
+            if index is None:
+                return []
+            if algorithm == "hnsw":
+                return index.search(query_embedding, k, ef_search, allowed=allowed)
+            if algorithm == "ivf":
+                return index.search(query_embedding, k, nprobe, allowed=allowed)
+            return index.search(query_embedding, k, allowed=allowed)
 
+    logger.debug("knn library=%s algorithm=brute metric=%s k=%d candidates=%s",
+                 library_id, metric, k, "all" if candidate_ids is None else len(candidate_ids))
+    return _scan(library_id, query_embedding, k, metric, candidate_ids)
+
+
+def _run_knn_batch(
+    library_id: UUID,
+    queries: np.ndarray,
+    k: int,
+    metric: str,
+    algorithm: str,
+    ef_search: Optional[int],
+    nprobe: Optional[int],
+    filter: Optional[MetadataFilter],
+) -> List[Hits]:
+    allowed = None
+    if filter is not None:
+        with STAGE_SECONDS.time("candidate_fetch"):
+            allowed = filter_chunk_ids(library_id, filter)
+    if allowed is not None and not allowed:
+        return [[] for _ in queries]
+    prefilter = allowed is not None and len(allowed) <= Config.SEARCH_PREFILTER_SELECTIVITY * library_vector_count(library_id)
+    if algorithm == "brute" and (allowed is None or prefilter):
+        return _scan_batch(library_id, queries, k, metric, None if allowed is None else list(allowed))
     return [
-        SearchResult(chunk=chunk, score=score)
-        for _, score, chunk in raw_hits
+        _run_knn(library_id, q, k, metric, algorithm, ef_search=ef_search, nprobe=nprobe, allowed=allowed)
+        for q in queries
     ]
 
+
+def _scan(
+    library_id: UUID,
+    query_embedding: List[float],
+    k: int,
+    metric: str,
+    chunk_ids: Optional[List[UUID]],
+) -> Hits:
+    """Exact top-k (chunk_id, score) over the library's rows, or only chunk_ids"""
+    return _scan_batch(library_id, np.asarray(query_embedding, dtype=np.float32)[None, :], k, metric, chunk_ids)[0]
+
+
+def _scan_batch(
+    library_id: UUID,
+    queries: np.ndarray,
+    k: int,
+    metric: str,
+    chunk_ids: Optional[List[UUID]],
+) -> List[Hits]:
+    """_scan for a (queries, dim) block: every part of the library is read once for all of them"""
+    with STAGE_SECONDS.time("candidate_fetch"):
+        parts = library_embedding_parts(library_id, chunk_ids)
+    with STAGE_SECONDS.time("scoring"):
+        return _score_parts(parts, queries, k, metric)
+
+
+def _score_parts(parts: List[Any], queries: np.ndarray, k: int, metric: str) -> List[Hits]:
+    # per query: ids and score arrays collected across parts
+    ids: List[List[UUID]] = [[] for _ in queries]
+    scores: List[List[np.ndarray]] = [[] for _ in queries]
+    for snapshot in parts:
+        if snapshot.codes is not None:
+            # compressed library: approximate scan, exact re-rank when float32 rows are kept
+            found = [
+                quantized_knn(
+                    q, snapshot.codes, snapshot.norms, snapshot.quantizer,
+                    k, metric, snapshot.mask, snapshot.vectors,
+                )
+                for q in queries
+            ]
+        else:
+            found = brute_force_knn_batch(
+                queries, snapshot.vectors, snapshot.norms, k, metric, snapshot.mask
+            )
+        for i, (rows, part_scores) in enumerate(found):
+            ids[i].extend(snapshot.ids[row] for row in rows)
+            scores[i].append(part_scores)
+    if len(parts) <= 1:
+        return [list(zip(q_ids, q_scores[0].tolist())) if q_scores else [] for q_ids, q_scores in zip(ids, scores)]
+    # memory-mapped library: one top-k per segment, merged
+    merged_hits = []
+    for q_ids, q_scores in zip(ids, scores):
+        best, merged = merge_top_k(q_scores, k, metric)
+        merged_hits.append([(q_ids[i], score) for i, score in zip(best, merged.tolist())])
+    return merged_hits
+
+
+def _project(
+    hits: Hits, k: int, include: Sequence[str], exclude_id: Optional[UUID] = None
+) -> List[Dict[str, Any]]:
+    # build response rows straight from the store's records: no Chunk models,
+    # and vectors are only read when the caller asked for them
+    with STAGE_SECONDS.time("serialize"):
+        return _rows(hits, k, include, exclude_id)
+
+
+def _rows(
+    hits: Hits, k: int, include: Sequence[str], exclude_id: Optional[UUID]
+) -> List[Dict[str, Any]]:
+    if exclude_id is not None:
+        hits = [hit for hit in hits if hit[0] != exclude_id]
+    hits = hits[:k]
+    fields = chunk_fields([chunk_id for chunk_id, _ in hits], include)
+    results = []
+    for (_, score), row in zip(hits, fields):
+        # a chunk deleted after the snapshot comes back as None
+        if row is None:
+            continue
+        if "score" in include:
+            row["score"] = float(score)
+        results.append(row)
+    return results
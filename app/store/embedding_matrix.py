@@ -0,0 +1,279 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+
+class MatrixSnapshot(NamedTuple):
+    """
+    Read-only view of a library's embeddings at one point in time.
+    - vectors: (n, dim) float32 rows, or None for compressed libraries without full vectors
+    - norms: (n,) L2 norm of each row
+    - ids: chunk id for each row
+    - mask: (n,) bool of live rows, or None when every row is live
+    - codes/quantizer: compressed rows and the quantizer that decodes them
+    """
+    vectors: Optional[np.ndarray]
+    norms: np.ndarray
+    ids: Sequence[UUID]
+    mask: Optional[np.ndarray]
+    codes: Optional[np.ndarray] = None
+    quantizer: Optional[Any] = None
+
+
+class EmbeddingMatrix:
+    """
+    Contiguous float32 row-major matrix of one library's chunk embeddings.
+
+    Rows are append-only: an update tombstones the old row and appends a new
+    one, so a snapshot taken earlier never sees its rows change underneath it.
+    Dead rows are reclaimed by compaction, which allocates fresh arrays.
+
+    With a quantizer, rows are kept as compressed codes. The quantizer is
+    trained once train_size rows exist (until then rows stay float32); after
+    that the float32 rows are dropped unless keep_full is set for re-ranking.
+    Without them, norms are those of the decoded rows: scans score q·x̂, and
+    pairing it with the original |x| skews cosine and l2 rankings.
+    """
+    __slots__ = (
+        "dim", "_vectors", "_norms", "_alive", "_ids", "_row_of", "_size",
+        "_quantizer", "_codes", "_keep_full", "_train_size",
+    )
+
+    MIN_CAPACITY = 64
+    COMPACT_MIN_DEAD = 1024
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        quantizer: Optional[Any] = None,
+        keep_full: bool = True,
+        train_size: int = 1024,
+    ):
+        self.dim = dim
+        self._vectors: Optional[np.ndarray] = np.empty((0, dim or 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._ids: List[Optional[UUID]] = []
+        self._row_of: Dict[UUID, int] = {}
+        self._size = 0  # rows in use, live or dead
+        self._quantizer = quantizer
+        self._codes: Optional[np.ndarray] = None  # set once the quantizer is trained
+        self._keep_full = keep_full
+        self._train_size = train_size
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, chunk_id: UUID) -> bool:
+        return chunk_id in self._row_of
+
+    @property
+    def compressed(self) -> bool:
+        return self._codes is not None
+
+    @property
+    def row_quantizer(self) -> Optional[Any]:
+        """The quantizer when rows are kept as codes only; search indexes then keep codes too"""
+        return self._quantizer if self._vectors is None else None
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the row arrays (allocated capacity, live or not)"""
+        arrays = (self._vectors, self._codes, self._norms, self._alive)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def upsert(self, chunk_id: UUID, embedding: Sequence[float]) -> None:
+        vec = np.asarray(embedding, dtype=np.float32)
+        if vec.ndim != 1 or vec.shape[0] == 0:
+            raise ValueError("Embedding must be a non-empty 1-d vector")
+        if not self._row_of and not self.compressed:
+            # empty matrix adopts the dimension of its first vector
+            if self.dim != vec.shape[0]:
+                self._reset(vec.shape[0])
+        elif vec.shape[0] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {vec.shape[0]} does not match library dimension {self.dim}"
+            )
+
+        self.remove(chunk_id)
+        if self._size == self._norms.shape[0]:
+            self._grow()
+        row = self._size
+        if self._vectors is not None:
+            self._vectors[row] = vec
+        if self._codes is not None:
+            self._codes[row] = self._quantizer.encode(vec[None, :])[0]
+        if self._vectors is None:
+            vec = self._quantizer.decode(self._codes[row:row + 1])[0]
+        self._norms[row] = np.linalg.norm(vec)
+        self._alive[row] = True
+        self._ids.append(chunk_id)
+        self._row_of[chunk_id] = row
+        self._size += 1
+
+        if self._quantizer is not None and not self.compressed and len(self._row_of) >= self._train_size:
+            self._train()
+
+    def bulk_load(self, chunk_ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        """Fill an empty matrix in one step (recovery); same end state as upserting each row"""
+        if self._row_of or not len(chunk_ids):
+            for chunk_id, vec in zip(chunk_ids, vectors):
+                self.upsert(chunk_id, vec)
+            return
+        n, dim = vectors.shape
+        self._reset(dim)
+        capacity = max(self.MIN_CAPACITY, n)
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._vectors[:n] = vectors
+        self._norms = np.empty(capacity, dtype=np.float32)
+        self._norms[:n] = np.linalg.norm(self._vectors[:n], axis=1)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[:n] = True
+        self._ids = list(chunk_ids)
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._size = n
+        if self._quantizer is not None and n >= self._train_size:
+            self._train()
+
+    def load_codes(self, chunk_ids: Sequence[UUID], codes: np.ndarray, state: Dict[str, np.ndarray]) -> None:
+        """
+        Fill an empty compressed matrix from snapshotted codes and quantizer
+        state (recovery without float32 rows): nothing is retrained or
+        re-encoded, so decoded vectors survive restarts unchanged.
+        """
+        self._quantizer.load_state(state)
+        n = len(chunk_ids)
+        self._reset(self._quantizer.dim)
+        capacity = max(self.MIN_CAPACITY, n)
+        self._vectors = None
+        self._codes = np.empty((capacity, codes.shape[1]), dtype=np.uint8)
+        self._codes[:n] = codes
+        self._norms = np.empty(capacity, dtype=np.float32)
+        self._norms[:n] = np.linalg.norm(self._quantizer.decode(codes), axis=1)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[:n] = True
+        self._ids = list(chunk_ids)
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._size = n
+
+    def remove(self, chunk_id: UUID) -> None:
+        row = self._row_of.pop(chunk_id, None)
+        if row is None:
+            return
+        self._alive[row] = False
+        dead = self._size - len(self._row_of)
+        if dead >= self.COMPACT_MIN_DEAD and dead > len(self._row_of):
+            self._compact()
+
+    def vector(self, chunk_id: UUID) -> Optional[np.ndarray]:
+        """One chunk's embedding (decoded from codes when no float32 row is kept)"""
+        row = self._row_of.get(chunk_id)
+        if row is None:
+            return None
+        if self._vectors is not None:
+            return self._vectors[row]
+        return self._quantizer.decode(self._codes[row:row + 1])[0]
+
+    def snapshot(self, chunk_ids: Optional[Sequence[UUID]] = None) -> MatrixSnapshot:
+        """
+        Snapshot every live row, or only the rows of chunk_ids (a gathered copy).
+        """
+        if chunk_ids is not None:
+            pairs = [(cid, self._row_of[cid]) for cid in chunk_ids if cid in self._row_of]
+            rows = np.fromiter((row for _, row in pairs), dtype=np.intp, count=len(pairs))
+            return MatrixSnapshot(
+                vectors=None if self._vectors is None else self._vectors[rows],
+                norms=self._norms[rows],
+                ids=[cid for cid, _ in pairs],
+                mask=None,
+                codes=None if self._codes is None else self._codes[rows],
+                quantizer=self._quantizer if self.compressed else None,
+            )
+
+        n = self._size
+        mask = None if len(self._row_of) == n else self._alive[:n].copy()
+        return MatrixSnapshot(
+            vectors=None if self._vectors is None else self._vectors[:n],
+            norms=self._norms[:n],
+            ids=self._ids,
+            mask=mask,
+            codes=None if self._codes is None else self._codes[:n],
+            quantizer=self._quantizer if self.compressed else None,
+        )
+
+    def parts(self, chunk_ids: Optional[Sequence[UUID]] = None) -> List[MatrixSnapshot]:
+        """snapshot() as a list, the shape segmented matrices return"""
+        return [self.snapshot(chunk_ids)]
+
+    def live_items(self) -> Tuple[List[UUID], np.ndarray]:
+        """(chunk ids, vectors) of every live row, in row order"""
+        live = np.flatnonzero(self._alive[:self._size])
+        if self._vectors is not None:
+            vectors = self._vectors[live]
+        else:
+            vectors = self._quantizer.decode(self._codes[live])
+        return [self._ids[row] for row in live], vectors
+
+    # ----------------- internals ------------------
+
+    def _reset(self, dim: int) -> None:
+        self.dim = dim
+        self._vectors = np.empty((self.MIN_CAPACITY, dim), dtype=np.float32)
+        self._norms = np.empty(self.MIN_CAPACITY, dtype=np.float32)
+        self._alive = np.zeros(self.MIN_CAPACITY, dtype=bool)
+        self._ids = []
+        self._row_of = {}
+        self._size = 0
+
+    def _train(self) -> None:
+        n = self._size
+        live = np.flatnonzero(self._alive[:n])
+        self._quantizer.train(self._vectors[live])
+        codes = np.zeros((self._norms.shape[0], self._quantizer.code_width), dtype=np.uint8)
+        codes[:n] = self._quantizer.encode(self._vectors[:n])
+        self._codes = codes
+        if not self._keep_full:
+            self._vectors = None
+            self._norms[:n] = np.linalg.norm(self._quantizer.decode(codes[:n]), axis=1)
+
+    def _grow(self) -> None:
+        capacity = max(self.MIN_CAPACITY, self._norms.shape[0] * 2)
+        n = self._size
+        if self._vectors is not None:
+            vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            vectors[:n] = self._vectors[:n]
+            self._vectors = vectors
+        if self._codes is not None:
+            codes = np.empty((capacity, self._codes.shape[1]), dtype=np.uint8)
+            codes[:n] = self._codes[:n]
+            self._codes = codes
+        norms = np.empty(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        norms[:n] = self._norms[:n]
+        alive[:n] = self._alive[:n]
+        self._norms, self._alive = norms, alive
+
+    def _compact(self) -> None:
+        n = self._size
+        live = np.flatnonzero(self._alive[:n])
+        m = len(live)
+        capacity = max(self.MIN_CAPACITY, m * 2)
+        # new arrays/list so outstanding snapshots keep their old rows
+        if self._vectors is not None:
+            vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            vectors[:m] = self._vectors[live]
+            self._vectors = vectors
+        if self._codes is not None:
+            codes = np.empty((capacity, self._codes.shape[1]), dtype=np.uint8)
+            codes[:m] = self._codes[live]
+            self._codes = codes
+        norms = np.empty(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        norms[:m] = self._norms[live]
+        alive[:m] = True
+        ids = [self._ids[row] for row in live]
+
+        self._norms, self._alive, self._ids = norms, alive, ids
+        self._row_of = {cid: row for row, cid in enumerate(ids)}
+        self._size = m
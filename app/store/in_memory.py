@@ -1,126 +1,1163 @@
-from threading import RLock
-from typing import Dict, List, Optional
+import gc
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from itertools import count
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
 from uuid import UUID
 
+import numpy as np
+
 from ..models.library import Library
 from ..models.document import Document
 from ..models.chunk import Chunk
+from ..config import Config
+from ..utils.hnsw import HNSWIndex
+from ..utils.ivf import IVFIndex
+from ..utils.metadata_index import MetadataIndex, evaluate
+from ..utils.metrics import LOCK_WAIT_SECONDS
+from ..utils.quantization import make_quantizer
+from ..utils.rwlock import RWLock
+from ..utils.vptree import VPTreeIndex
+from .embedding_matrix import EmbeddingMatrix, MatrixSnapshot
+from .records import ChunkRecord
+from .segments import SegmentedMatrix
+from . import persistence
+
+logger = logging.getLogger(__name__)
 
 
 # ----------------- in-memory ------------------
-_lock = RLock()
+# Locking: every library hashes to one of _STRIPES reader-writer locks. Reads
+# of a library share its stripe, writes take it exclusively, so a bulk insert
+# into one tenant only blocks that tenant (and the few sharing its stripe).
+# The tables below are shared, but each key belongs to exactly one library and
+# single dict operations are atomic, so per-library locking keeps them
+# consistent. Searches only hold a read lock long enough to take a snapshot.
+_STRIPES = 64
+_stripes = [RWLock() for _ in range(_STRIPES)]
 _libraries: Dict[UUID, Library] = {}
 _documents: Dict[UUID, Document] = {}
-_chunks: Dict[UUID, Chunk] = {}
+# chunk records hold ids, text and metadata only; embeddings live in _matrices
+# and are attached when a Chunk model is materialized for a reader
+_chunks: Dict[UUID, ChunkRecord] = {}
+# secondary indexes (dicts used as insertion-ordered sets), kept in step with
+# the tables above so listings and cascading deletes cost O(result size)
+_library_documents: Dict[UUID, Dict[UUID, None]] = {}
+_library_chunks: Dict[UUID, Dict[UUID, None]] = {}
+_document_chunks: Dict[UUID, Dict[UUID, None]] = {}
+# per-library inverted indexes over chunk and document metadata, for search filters
+_chunk_metadata: Dict[UUID, MetadataIndex] = {}
+_document_metadata: Dict[UUID, MetadataIndex] = {}
+# libraries restored from a snapshot whose chunk metadata index isn't built yet
+_unindexed: Dict[UUID, None] = {}
+# per-library float32 embedding matrix, the only copy of each vector (a SegmentedMatrix
+# of memory-mapped files when MMAP_VECTORS is on and the store has a data dir)
+_matrices: Dict[UUID, Any] = {}
+# per-library search indexes keyed by (algorithm, metric), built lazily on first search
+_indexes: Dict[UUID, Dict[Tuple[str, str], Any]] = {}
+# per-stripe index upkeep (index, op, chunk_id, vector): queued in lock order by writers,
+# applied once the stripe is released, so HNSW inserts don't hold up the library's readers
+_index_work = [deque() for _ in range(_STRIPES)]
+_index_appliers = [threading.Lock() for _ in range(_STRIPES)]
+# explicit rebuilds in progress, library -> (algorithm, metric) -> new index
+_building: Dict[UUID, Dict[Tuple[str, str], Any]] = {}
+# per-library data version, bumped on every chunk or document mutation; drawn from one
+# global sequence so a value is never reused, even across delete/recreate
+_versions: Dict[UUID, int] = {}
+_version_seq = count(1)
+
+# algorithm -> factory(metric, params, quantizer); params override the configured defaults,
+# and a quantizer (libraries keeping codes only) makes the index keep codes, not float32 rows
+_INDEX_TYPES = {
+    "vptree": lambda metric, params, quantizer: VPTreeIndex(metric, quantizer=quantizer),
+    "hnsw": lambda metric, params, quantizer: HNSWIndex(
+        metric,
+        M=params.get("M", Config.HNSW_M),
+        ef_construction=params.get("ef_construction", Config.HNSW_EF_CONSTRUCTION),
+        ef_search=params.get("ef_search", Config.HNSW_EF_SEARCH),
+        quantizer=quantizer,
+    ),
+    "ivf": lambda metric, params, quantizer: IVFIndex(
+        metric,
+        nlist=params.get("nlist"),
+        nprobe=params.get("nprobe", Config.IVF_NPROBE),
+        train_threshold=params.get("train_threshold", Config.IVF_TRAIN_THRESHOLD),
+        quantizer=quantizer,
+    ),
+}
+# algorithm -> the params an index was built with, so a rebuild can reproduce it
+_INDEX_PARAMS = {
+    "vptree": lambda index: {},
+    "hnsw": lambda index: {
+        "M": index.M, "ef_construction": index.ef_construction, "ef_search": index.ef_search,
+    },
+    "ivf": lambda index: {
+        "nlist": index.requested_nlist, "nprobe": index.nprobe, "train_threshold": index.train_threshold,
+    },
+}
+
+
+# ----------------- durability ------------------
+# With a data dir (open_store), every mutation is appended to the write-ahead
+# log while the library lock is held, and the public write call returns only
+# once its records are fsynced (group commit, outside the lock). The wait
+# blocks, so async callers run writes in a worker thread; concurrent writers
+# then share one fsync.
+_wal: Optional[persistence.WriteAheadLog] = None
+_wal_seq = threading.local()
+
+
+def _log(op: str, body: Dict[str, Any], vector: Optional[Any] = None) -> None:
+    if _wal is None:
+        return
+    record = persistence.encode_record(op, body, vector)
+    step = getattr(_wal_seq, "step", None)
+    if step is None:
+        _wal_seq.last = _wal.append(persistence.encode_batch([record]))
+    else:
+        # flushed as one frame when the step's write lock is released
+        step.append(record)
+
+
+def _durable(fn: Callable) -> Callable:
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        _wal_seq.last = 0
+        result = fn(*args, **kwargs)
+        if _wal is not None and _wal_seq.last:
+            _wal.wait(_wal_seq.last)
+        return result
+    return wrapper
 
 
 # ----------------- library related funciton ------------------
 
+@_durable
 def save_library(lib: Library) -> None:
-    with _lock:
-        _libraries[lib.id] = lib
+    with _write(lib.id):
+        _put_library(lib)
 
 def get_library(library_id: UUID) -> Optional[Library]:
-    with _lock:
-        return _libraries.get(library_id)
+    return _libraries.get(library_id)
     
 def list_libraries() -> List[Library]:
-    with _lock:
-        return list(_libraries.values())
+    return list(_libraries.values())
 
+@_durable
 def delete_library(library_id: UUID) -> None:
-    with _lock:
-        # remove library
-        _libraries.pop(library_id, None)
-        # remove its documents
-        for doc_id, doc in list(_documents.items()):
-            if doc.library_id == library_id:
-                _documents.pop(doc_id)
+    with _write(library_id):
+        _drop_library(library_id)
+
+
+def _put_library(lib: Library) -> None:
+    _libraries[lib.id] = lib
+    _log("library", {"library": lib.model_dump(mode="json")})
+
+
+def _drop_library(library_id: UUID) -> None:
+    _log("library_delete", {"id": str(library_id)})
+    # remove library
+    _libraries.pop(library_id, None)
+    matrix = _matrices.pop(library_id, None)
+    if isinstance(matrix, SegmentedMatrix):
+        _retired.extend(matrix.files())
+    _indexes.pop(library_id, None)
+    _versions.pop(library_id, None)
+    _building.pop(library_id, None)
+    _chunk_metadata.pop(library_id, None)
+    _unindexed.pop(library_id, None)
+    _document_metadata.pop(library_id, None)
+    # remove its documents
+    for doc_id in _library_documents.pop(library_id, {}):
+        _documents.pop(doc_id, None)
+        _document_chunks.pop(doc_id, None)
 
-        # remove its chunks
-        for chunk_id, chunk in list(_chunks.items()):
-            if chunk.library_id == library_id:
-                _chunks.pop(chunk_id)
+    # remove its chunks
+    for chunk_id in _library_chunks.pop(library_id, {}):
+        chunk = _chunks.pop(chunk_id, None)
+        if chunk is not None:
+            _index_discard(_document_chunks, chunk.document_id, chunk_id)
 
 
 
 # ----------------- document related funciton ------------------
 
+@_durable
 def save_document(doc: Document) -> None:
-    with _lock:
-        _documents[doc.id] = doc
+    previous = _documents.get(doc.id)
+    with _write(doc.library_id, None if previous is None else previous.library_id):
+        _put_document(doc)
 
 def get_document(document_id: UUID) -> Optional[Document]:
-    with _lock:
-        return _documents.get(document_id)
+    return _documents.get(document_id)
     
 def list_documents(library_id: UUID) -> List[Document]:
-    with _lock:
-        return [doc for doc in _documents.values() if doc.library_id == library_id]
+    with _read(library_id):
+        return [_documents[doc_id] for doc_id in _library_documents.get(library_id, ())]
     
+@_durable
 def delete_document(document_id: UUID) -> None:
-    with _lock:
-        _documents.pop(document_id, None)
-        # remove its chunks
-        for chunk_id, chunk in list(_chunks.items()):
-            if chunk.document_id == document_id:
-                _chunks.pop(chunk_id)
+    doc = _documents.get(document_id)
+    if doc is None:
+        return
+    with _write(doc.library_id):
+        _drop_document(document_id)
+
+
+def _put_document(doc: Document) -> None:
+    previous = _documents.get(doc.id)
+    if previous is not None and previous.library_id != doc.library_id:
+        _index_discard(_library_documents, previous.library_id, doc.id)
+        _bump_version(previous.library_id)
+    if previous is not None and previous.library_id in _document_metadata:
+        _document_metadata[previous.library_id].remove(doc.id, previous.metadata)
+    _documents[doc.id] = doc
+    _index_add(_library_documents, doc.library_id, doc.id)
+    _document_metadata.setdefault(doc.library_id, MetadataIndex()).add(doc.id, doc.metadata)
+    # scope="document" filters read this metadata: cached results for the library are stale
+    _bump_version(doc.library_id)
+    _log("document", {"document": doc.model_dump(mode="json")})
+
+
+def _attach_chunks(document_id: UUID, chunk_ids: List[UUID]) -> None:
+    # copy-on-write: readers holding the old Document keep a stable list;
+    # logged as a delta so growing a document doesn't rewrite its id list
+    doc = _documents[document_id]
+    _documents[document_id] = doc.model_copy(update={"chunk_ids": doc.chunk_ids + chunk_ids})
+    _log("document_attach", {"id": str(document_id), "chunk_ids": [str(cid) for cid in chunk_ids]})
+
+
+def _detach_chunk(document_id: UUID, chunk_id: UUID) -> None:
+    doc = _documents[document_id]
+    if chunk_id in doc.chunk_ids:
+        _documents[document_id] = doc.model_copy(
+            update={"chunk_ids": [cid for cid in doc.chunk_ids if cid != chunk_id]}
+        )
+        _log("document_detach", {"id": str(document_id), "chunk_id": str(chunk_id)})
+
+
+def _drop_document(document_id: UUID) -> None:
+    doc = _documents.pop(document_id, None)
+    if doc is None:
+        return
+    _log("document_delete", {"id": str(document_id)})
+    _index_discard(_library_documents, doc.library_id, document_id)
+    _bump_version(doc.library_id)
+    if doc.library_id in _document_metadata:
+        _document_metadata[doc.library_id].remove(document_id, doc.metadata)
+    # remove its chunks
+    for chunk_id in list(_document_chunks.get(document_id, ())):
+        _pop_chunk(chunk_id)
 
 
 
 # ----------------- chunk related funciton ------------------
 
+@_durable
 def save_chunk(chunk: Chunk) -> None:
-    with _lock:
-        _chunks[chunk.id] = chunk
+    previous = _chunks.get(chunk.id)
+    with _write(chunk.library_id, None if previous is None else previous.library_id):
+        _put_chunk(chunk)
 
 def get_chunk(chunk_id: UUID) -> Optional[Chunk]:
-    with _lock:
-        return _chunks.get(chunk_id)
+    return _read_chunk(chunk_id)
+
+def get_chunk_record(chunk_id: UUID) -> Optional[ChunkRecord]:
+    """A chunk's ids, text and metadata without its vector, for checks that don't need it"""
+    # records are never mutated, so the one read needs no lock
+    return _chunks.get(chunk_id)
+
+@_durable
+def patch_chunk(chunk_id: UUID, changes: Dict[str, Any]) -> Chunk:
+    """
+    Update some of a chunk's text, metadata, document_id and embedding. The
+    stored vector is only touched when the embedding is among the changes.
+    """
+    record = _chunks.get(chunk_id)
+    if record is None:
+        raise KeyError("Chunk not found")
+    with _write(record.library_id):
+        _patch_chunk(chunk_id, changes)
+        return _materialize(_chunks[chunk_id])
+
+def get_chunks(chunk_ids: List[UUID]) -> List[Optional[Chunk]]:
+    return [_read_chunk(chunk_id) for chunk_id in chunk_ids]
     
 def list_chunks(library_id: UUID, document_id: UUID) -> List[Chunk]:
-    with _lock:
-        result = []
-        for chunk in _chunks.values():
-            print("chunk id: ", chunk.library_id)
-            print("chunk document id: ", chunk.document_id)
-            if chunk.library_id == library_id and chunk.document_id == document_id:
-                result.append(chunk)
-
-        print("result: ", result)
-        return result
+    with _read(library_id):
+        return [
+            _materialize(_chunks[chunk_id])
+            for chunk_id in _document_chunks.get(document_id, ())
+            if _chunks[chunk_id].library_id == library_id
+        ]
     
+def list_chunk_ids(library_id: UUID, document_id: Optional[UUID] = None) -> List[UUID]:
+    """Ids of the library's chunks (or one document's), without materializing them"""
+    with _read(library_id):
+        return _chunk_ids(library_id, document_id)
+
+
+def export_chunks(
+    library_id: UUID, document_id: Optional[UUID] = None
+) -> Tuple[List[ChunkRecord], np.ndarray]:
+    """
+    The library's chunk records (or one document's) and their embeddings as one
+    (n, dim) float32 matrix, read under a single lock so both agree. Rows
+    without an embedding are NaN.
+    """
+    with _read(library_id):
+        records = [_chunks[chunk_id] for chunk_id in _chunk_ids(library_id, document_id)]
+        matrix = _matrices.get(library_id)
+        dim = 0 if matrix is None or not len(matrix) else matrix.dim
+        vectors = np.full((len(records), dim), np.nan, dtype=np.float32)
+        if not dim:
+            return records, vectors
+        if document_id is None:
+            # one pass over the matrix in its own row order, scattered into record order
+            ids, live = matrix.live_items()
+            pos = {chunk.id: i for i, chunk in enumerate(records)}
+            vectors[np.fromiter((pos[chunk_id] for chunk_id in ids), dtype=np.intp, count=len(ids))] = live
+        else:
+            for i, chunk in enumerate(records):
+                vec = matrix.vector(chunk.id)
+                if vec is not None:
+                    vectors[i] = vec
+        return records, vectors
+
+
+def chunk_fields(chunk_ids: List[UUID], fields: Collection[str]) -> List[Optional[Dict[str, Any]]]:
+    """
+    JSON-ready dicts with just the requested fields of each chunk (None for
+    missing chunks). Embeddings are read only when asked for.
+    """
+    rows: List[Optional[Dict[str, Any]]] = []
+    for chunk_id in chunk_ids:
+        chunk = _chunks.get(chunk_id)
+        if chunk is None:
+            rows.append(None)
+            continue
+        row: Dict[str, Any] = {}
+        if "id" in fields:
+            row["id"] = str(chunk_id)
+        if "document_id" in fields:
+            row["document_id"] = None if chunk.document_id is None else str(chunk.document_id)
+        if "text" in fields:
+            row["text"] = chunk.text
+        if "metadata" in fields:
+            row["metadata"] = chunk.metadata
+        if "embedding" in fields:
+            with _read(chunk.library_id):
+                vector = _vector(chunk)
+            row["embedding"] = None if vector is None else vector.tolist()
+        rows.append(row)
+    return rows
+
+
+@_durable
 def delete_chunk(chunk_id: UUID) -> None:
-    with _lock:
-        _chunks.pop(chunk_id, None)
+    chunk = _chunks.get(chunk_id)
+    if chunk is None:
+        return
+    with _write(chunk.library_id):
+        _pop_chunk(chunk_id)
 
 def list_all_chunks_in_library(library_id: UUID) -> List[Chunk]:
-    with _lock:
+    with _read(library_id):
         return [
-            chunk
-            for chunk in _chunks.values()
-            if chunk.library_id == library_id
+            _materialize(_chunks[chunk_id])
+            for chunk_id in _library_chunks.get(library_id, ())
         ]
 
 
+@_durable
 def add_chunk_to_document(
     chunk: Chunk, document_id: UUID
 ) -> None:
-    with _lock:
-        _chunks[chunk.id] = chunk
-        doc = _documents[document_id]
-        doc.chunk_ids.append(chunk.id)
-        _documents[document_id] = doc
+    doc = _documents[document_id]
+    with _write(doc.library_id, chunk.library_id):
+        _put_chunk(chunk)
+        _attach_chunks(document_id, [chunk.id])
+
+
+@_durable
+def add_chunks_to_document(
+    chunks: List[Chunk], document_id: UUID
+) -> None:
+    """Save many chunks and attach them to their document as one atomic step"""
+    doc = _documents[document_id]
+    with _write(doc.library_id, *{chunk.library_id for chunk in chunks}):
+        # validate every dimension up front so a bad row inserts nothing
+        dims = {len(chunk.embedding) for chunk in chunks if chunk.embedding is not None}
+        matrix = _matrices.get(doc.library_id)
+        if matrix is not None and len(matrix):
+            dims.add(matrix.dim)
+        if len(dims) > 1:
+            raise ValueError(f"Embeddings have mixed dimensions {sorted(dims)}")
+
+        for chunk in chunks:
+            _put_chunk(chunk)
+        _attach_chunks(document_id, [chunk.id for chunk in chunks])
 
 
+@_durable
+def import_batch(
+    library_id: UUID,
+    documents: List[Document],
+    chunks: List[Chunk],
+    document_metadata: Optional[Dict[UUID, Dict[str, Any]]] = None,
+) -> None:
+    """
+    Bulk import step: save new documents and their chunks (possibly for
+    documents saved by earlier batches) under one lock, with one log wait.
+    document_metadata sets the metadata of documents saved by earlier batches.
+    """
+    with _write(library_id):
+        dims = {len(chunk.embedding) for chunk in chunks if chunk.embedding is not None}
+        matrix = _matrices.get(library_id)
+        if matrix is not None and len(matrix):
+            dims.add(matrix.dim)
+        if len(dims) > 1:
+            raise ValueError(f"Embeddings have mixed dimensions {sorted(dims)}")
+
+        for doc in documents:
+            _put_document(doc)
+        for document_id, metadata in (document_metadata or {}).items():
+            doc = _documents.get(document_id)
+            if doc is not None and doc.library_id == library_id:
+                _put_document(doc.model_copy(update={"metadata": metadata}))
+        attach: Dict[UUID, List[UUID]] = {}
+        for chunk in chunks:
+            _put_chunk(chunk)
+            attach.setdefault(chunk.document_id, []).append(chunk.id)
+        for document_id, chunk_ids in attach.items():
+            _attach_chunks(document_id, chunk_ids)
+
+
+def suspend_library_indexes(library_id: UUID) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Detach the library's search indexes so a bulk import skips per-insert
+    index upkeep; returns (algorithm, metric, params) for each, params being
+    what it was built with, so the rebuild keeps explicit settings.
+    A search in the meantime builds what it needs lazily, as usual.
+    """
+    with _write(library_id):
+        indexes = _indexes.pop(library_id, {})
+        _bump_version(library_id)
+        return [
+            (algorithm, metric, _INDEX_PARAMS[algorithm](index))
+            for (algorithm, metric), index in indexes.items()
+        ]
+
+
+@_durable
 def remove_chunk_from_document(
     chunk_id: UUID, document_id: UUID
 ) -> None:
-    with _lock:
+    doc = _documents[document_id]
+    chunk = _chunks.get(chunk_id)
+    with _write(doc.library_id, None if chunk is None else chunk.library_id):
         # remove the chunk record
-        _chunks.pop(chunk_id, None)
+        _pop_chunk(chunk_id)
         # remove the reference in the document
-        doc = _documents[document_id]
-        if chunk_id in doc.chunk_ids:
-            doc.chunk_ids.remove(chunk_id)
-            _documents[document_id] = doc
+        _detach_chunk(document_id, chunk_id)
+
+
+def library_version(library_id: UUID) -> Optional[int]:
+    """Current data version of a library (changes on any chunk or document mutation), None if missing"""
+    if library_id not in _libraries:
+        return None
+    return _versions.get(library_id, 0)
+
+
+def library_vector_count(library_id: UUID) -> int:
+    """Chunks with an embedding in the library"""
+    matrix = _matrices.get(library_id)
+    return 0 if matrix is None else len(matrix)
+
+
+def library_dimension(library_id: UUID) -> Optional[int]:
+    """Embedding dimension of the library, None until it holds a vector"""
+    matrix = _matrices.get(library_id)
+    return None if matrix is None or not len(matrix) else matrix.dim
+
+
+def library_stats() -> List[Dict[str, Any]]:
+    """
+    Per-library sizes for monitoring: chunk, document and vector counts, and
+    the size of each search index. Read without locks (lengths only), so
+    scrapes never wait behind writers.
+    """
+    stats = []
+    for library_id in list(_libraries):
+        matrix = _matrices.get(library_id)
+        stats.append({
+            "library_id": library_id,
+            "chunks": len(_library_chunks.get(library_id, ())),
+            "documents": len(_library_documents.get(library_id, ())),
+            "vectors": 0 if matrix is None else len(matrix),
+            "indexes": {key: len(index) for key, index in list(_indexes.get(library_id, {}).items())},
+        })
+    return stats
+
+
+def filter_chunk_ids(library_id: UUID, expr: Any) -> Dict[UUID, None]:
+    """Ids of the library's chunks matching a MetadataFilter, via the inverted indexes"""
+    with _read(library_id):
+        return dict(evaluate(expr, lambda cond: _filter_condition(library_id, cond)))
+
+
+def _filter_condition(library_id: UUID, cond: Any) -> Dict[UUID, None]:
+    if cond.scope == "chunk":
+        index = _chunk_metadata_index(library_id)
+    else:
+        index = _document_metadata.get(library_id)
+    if index is None:
+        return {}
+    ops = cond.model_fields_set
+    parts = []
+    if "eq" in ops:
+        parts.append(index.equal(cond.key, cond.eq))
+    if cond.in_ is not None:
+        matched: Dict[UUID, None] = {}
+        for value in cond.in_:
+            matched.update(index.equal(cond.key, value))
+        parts.append(matched)
+    if {"gt", "gte", "lt", "lte"} & ops:
+        parts.append(index.range(cond.key, cond.gt, cond.gte, cond.lt, cond.lte))
+    parts.sort(key=len)
+    members = parts[0]
+    for part in parts[1:]:
+        members = {member: None for member in members if member in part}
+    if cond.scope == "chunk":
+        return members
+    # document matches stand for every chunk of those documents in this library
+    chunk_ids: Dict[UUID, None] = {}
+    for doc_id in members:
+        for chunk_id in _document_chunks.get(doc_id, ()):
+            if _chunks[chunk_id].library_id == library_id:
+                chunk_ids[chunk_id] = None
+    return chunk_ids
+
+
+def _chunk_metadata_index(library_id: UUID) -> Optional[MetadataIndex]:
+    # caller holds the library's lock (read is enough: writers are excluded, and two
+    # readers building at once build the same index)
+    if library_id in _unindexed:
+        index = MetadataIndex()
+        for chunk_id in _library_chunks.get(library_id, ()):
+            index.add(chunk_id, _chunks[chunk_id].metadata)
+        _chunk_metadata[library_id] = index
+        _unindexed.pop(library_id, None)
+    return _chunk_metadata.get(library_id)
+
+
+def library_embedding_parts(
+    library_id: UUID, chunk_ids: Optional[List[UUID]] = None
+) -> List[MatrixSnapshot]:
+    """
+    Snapshot of a library's embeddings, optionally limited to chunk_ids: one
+    part for an in-RAM matrix, one per segment (plus memtable) for a mapped one
+    """
+    with _read(library_id):
+        matrix = _matrices.get(library_id)
+        if matrix is None:
+            return []
+        return matrix.parts(chunk_ids)
+
+
+def get_library_index(library_id: UUID, algorithm: str, metric: str) -> Optional[Any]:
+    """
+    Persistent search index for (library, algorithm, metric).
+    The first call builds it from the embedding matrix; afterwards the store
+    keeps it up to date on every chunk mutation.
+    """
+    index = _indexes.get(library_id, {}).get((algorithm, metric))
+    if index is not None:
+        return index
+    with _write(library_id):
+        # another request may have started the build while we waited
+        index = _indexes.get(library_id, {}).get((algorithm, metric))
+        if index is not None:
+            return index
+        index = _begin_index_build(library_id, algorithm, metric, {})
+        if index is None:
+            return None
+        _indexes.setdefault(library_id, {})[(algorithm, metric)] = index
+
+    # the O(N log N) build runs outside the library lock; searches wait on it
+    try:
+        index.finish_build()
+    except Exception:
+        # waiting searches get the error; drop the index so the next one retries
+        with _write(library_id):
+            indexes = _indexes.get(library_id, {})
+            if indexes.get((algorithm, metric)) is index:
+                del indexes[(algorithm, metric)]
+        raise
+    return index
+
+
+def rebuild_library_index(
+    library_id: UUID, algorithm: str, metric: str, params: Dict[str, Any]
+) -> Optional[Any]:
+    """
+    Build a fresh index with explicit params (e.g. IVF nlist) and swap it in
+    once ready; searches keep using the previous index meanwhile.
+    """
+    key = (algorithm, metric)
+    with _write(library_id):
+        index = _begin_index_build(library_id, algorithm, metric, params)
+        if index is None:
+            return None
+        _building.setdefault(library_id, {})[key] = index
+
+    try:
+        index.finish_build()
+    except Exception:
+        with _write(library_id):
+            _end_index_build(library_id, key, index)
+        raise
+    with _write(library_id):
+        # a newer rebuild or a library delete supersedes this one
+        if not _end_index_build(library_id, key, index):
+            return None
+        _indexes.setdefault(library_id, {})[(algorithm, metric)] = index
+        _bump_version(library_id)
+    return index
+
+
+def _begin_index_build(
+    library_id: UUID, algorithm: str, metric: str, params: Dict[str, Any]
+) -> Optional[Any]:
+    # caller holds the library's write lock and must register the index before releasing it, so
+    # every later chunk mutation reaches the new index
+    matrix = _matrices.get(library_id)
+    if matrix is None or len(matrix) == 0:
+        return None
+    index = _INDEX_TYPES[algorithm](metric, params, matrix.row_quantizer)
+    index.begin_build(*matrix.live_items())
+    return index
+
+
+def _end_index_build(library_id: UUID, key: Tuple[str, str], index: Any) -> bool:
+    # caller holds the library's write lock; False when the build was superseded
+    building = _building.get(library_id, {})
+    if building.get(key) is not index:
+        return False
+    del building[key]
+    if not building:
+        del _building[library_id]
+    return True
+
+
+# ----------------- locking ------------------
+
+def _stripe(library_id: UUID) -> int:
+    return hash(library_id) % _STRIPES
+
+
+@contextmanager
+def _read(library_id: UUID) -> Iterator[None]:
+    lock = _stripes[_stripe(library_id)]
+    start = time.perf_counter()
+    lock.acquire_read()
+    LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, "read")
+    try:
+        yield
+    finally:
+        lock.release_read()
+
+
+@contextmanager
+def _write_all() -> Iterator[None]:
+    """Exclusive access to the whole store (recovery, snapshot capture)"""
+    try:
+        with ExitStack() as stack:
+            start = time.perf_counter()
+            for lock in _stripes:
+                stack.enter_context(lock.write())
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, "write_all")
+            yield
+    finally:
+        _apply_index_work(range(_STRIPES))
+
+
+@contextmanager
+def _write(*library_ids: Optional[UUID]) -> Iterator[None]:
+    """Write-lock the stripes of every given library, in a fixed order so two writers never deadlock"""
+    stripes = sorted({_stripe(lib_id) for lib_id in library_ids if lib_id is not None})
+    outermost = getattr(_wal_seq, "step", None) is None
+    try:
+        with ExitStack() as stack:
+            start = time.perf_counter()
+            for stripe in stripes:
+                stack.enter_context(_stripes[stripe].write())
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, "write")
+            if outermost:
+                _wal_seq.step = []
+            try:
+                yield
+            finally:
+                if outermost:
+                    # every record of the step in one frame, still under the lock so
+                    # frames of one library stay in lock order; recovery replays all or none
+                    step, _wal_seq.step = _wal_seq.step, None
+                    if step and _wal is not None:
+                        _wal_seq.last = _wal.append(persistence.encode_batch(step))
+    finally:
+        if outermost:
+            _apply_index_work(stripes)
+
+
+def _apply_index_work(stripes: Iterable[int]) -> None:
+    # runs with no stripe held; the applier lock keeps each stripe's work in lock order, and
+    # whoever holds it drains the queue, so a writer returns only once its own work is in
+    for stripe in stripes:
+        work = _index_work[stripe]
+        if not work:
+            continue
+        with _index_appliers[stripe]:
+            while work:
+                index, op, chunk_id, vector = work.popleft()
+                try:
+                    if op == "add":
+                        index.add(chunk_id, vector)
+                    else:
+                        index.remove(chunk_id)
+                except Exception:
+                    logger.exception("search index %s of %s failed", op, chunk_id)
+
+
+# ----------------- embedding matrix upkeep (caller holds the library's write lock) ------------------
+
+def _bump_version(library_id: UUID) -> None:
+    _versions[library_id] = next(_version_seq)
+
+
+def _put_chunk(chunk: Chunk) -> None:
+    previous = _chunks.get(chunk.id)
+    if previous is not None and previous.library_id != chunk.library_id:
+        _matrix_remove(previous.library_id, chunk.id)
+        _bump_version(previous.library_id)
+
+    if chunk.embedding is None:
+        _matrix_remove(chunk.library_id, chunk.id)
+    else:
+        # validate before the chunk record changes so a bad vector leaves no trace
+        _matrix_upsert(chunk.library_id, chunk.id, chunk.embedding)
+    record = ChunkRecord.from_model(chunk)
+    _store_record(previous, record)
+    _log("chunk", {"chunk": record.to_json()}, chunk.embedding)
+
+
+def _patch_chunk(chunk_id: UUID, changes: Dict[str, Any]) -> None:
+    previous = _chunks[chunk_id]
+    fields = {key: value for key, value in changes.items() if key != "embedding"}
+    embedding = changes.get("embedding")
+    if embedding is not None:
+        _matrix_upsert(previous.library_id, chunk_id, embedding)
+    _store_record(previous, previous.replace(**fields))
+    body: Dict[str, Any] = {"id": str(chunk_id), **fields}
+    if "document_id" in fields:
+        body["document_id"] = None if fields["document_id"] is None else str(fields["document_id"])
+    _log("chunk_patch", body, embedding)
+
+
+def _store_record(previous: Optional[ChunkRecord], record: ChunkRecord) -> None:
+    # swap in the new record and move it between the secondary indexes it changed
+    _chunks[record.id] = record
+    moved = previous is not None and previous.library_id != record.library_id
+    if previous is None or moved or previous.metadata is not record.metadata:
+        if previous is not None and previous.library_id in _chunk_metadata:
+            _chunk_metadata[previous.library_id].remove(record.id, previous.metadata)
+        if record.library_id not in _unindexed:
+            _chunk_metadata.setdefault(record.library_id, MetadataIndex()).add(record.id, record.metadata)
+    if previous is not None and previous.document_id != record.document_id:
+        _index_discard(_document_chunks, previous.document_id, record.id)
+    if moved:
+        _index_discard(_library_chunks, previous.library_id, record.id)
+    _index_add(_library_chunks, record.library_id, record.id)
+    if record.document_id is not None:
+        # detached chunks (document_id=None) belong to no document
+        _index_add(_document_chunks, record.document_id, record.id)
+    _bump_version(record.library_id)
+
+
+def _matrix_upsert(library_id: UUID, chunk_id: UUID, embedding: Any) -> None:
+    matrix = _matrices.get(library_id)
+    if matrix is None:
+        matrix = _matrices[library_id] = _new_matrix(library_id)
+    quantizer = matrix.row_quantizer
+    matrix.upsert(chunk_id, embedding)
+    if matrix.row_quantizer is not quantizer:
+        # the quantizer just trained: indexes holding float32 rows are rebuilt from codes on next use
+        _indexes.pop(library_id, None)
+    if isinstance(matrix, SegmentedMatrix) and matrix.needs_merge():
+        _start_merge(library_id, matrix)
+    _queue_index_work(library_id, "add", chunk_id, embedding)
+
+
+def _new_matrix(library_id: UUID, segmented: Optional[bool] = None) -> Any:
+    lib = _libraries.get(library_id)
+    if segmented is None:
+        segmented = Config.MMAP_VECTORS and _data_dir is not None
+    if segmented and (lib is None or lib.compression == "none"):
+        return SegmentedMatrix(
+            _vector_dir(library_id),
+            memtable_rows=Config.MEMTABLE_ROWS,
+            max_segments=Config.MAX_SEGMENTS,
+        )
+    if lib is None or lib.compression == "none":
+        return EmbeddingMatrix()
+    return EmbeddingMatrix(
+        quantizer=make_quantizer(lib.compression, Config.PQ_SUBVECTOR_DIM),
+        keep_full=lib.rerank,
+        train_size=Config.QUANTIZATION_TRAIN_SIZE,
+    )
+
+
+def _read_chunk(chunk_id: UUID) -> Optional[Chunk]:
+    record = _chunks.get(chunk_id)
+    if record is None:
+        return None
+    with _read(record.library_id):
+        # re-read under the lock so record and vector belong to the same write
+        record = _chunks.get(chunk_id)
+        return None if record is None else _materialize(record)
+
+
+def _materialize(record: ChunkRecord) -> Chunk:
+    # caller holds the library's lock; the API model gets its own list of the vector
+    vector = _vector(record)
+    return record.to_model(None if vector is None else vector.tolist())
+
+
+def _vector(record: ChunkRecord) -> Optional[np.ndarray]:
+    matrix = _matrices.get(record.library_id)
+    return None if matrix is None else matrix.vector(record.id)
+
+
+def _pop_chunk(chunk_id: UUID) -> None:
+    chunk = _chunks.pop(chunk_id, None)
+    if chunk is not None:
+        _index_discard(_library_chunks, chunk.library_id, chunk_id)
+        _index_discard(_document_chunks, chunk.document_id, chunk_id)
+        if chunk.library_id in _chunk_metadata:
+            _chunk_metadata[chunk.library_id].remove(chunk_id, chunk.metadata)
+        _matrix_remove(chunk.library_id, chunk_id)
+        _bump_version(chunk.library_id)
+        _log("chunk_delete", {"id": str(chunk_id)})
+
+
+def _chunk_ids(library_id: UUID, document_id: Optional[UUID]) -> List[UUID]:
+    if document_id is None:
+        return list(_library_chunks.get(library_id, ()))
+    return [
+        chunk_id for chunk_id in _document_chunks.get(document_id, ())
+        if _chunks[chunk_id].library_id == library_id
+    ]
+
+
+def _index_add(index: Dict[UUID, Dict[UUID, None]], key: UUID, member: UUID) -> None:
+    index.setdefault(key, {})[member] = None
+
+
+def _index_discard(index: Dict[UUID, Dict[UUID, None]], key: UUID, member: UUID) -> None:
+    members = index.get(key)
+    if members is not None:
+        members.pop(member, None)
+        if not members:
+            del index[key]
+
+
+def _matrix_remove(library_id: UUID, chunk_id: UUID) -> None:
+    matrix = _matrices.get(library_id)
+    if matrix is not None:
+        matrix.remove(chunk_id)
+    _queue_index_work(library_id, "remove", chunk_id)
+
+
+def _start_merge(library_id: UUID, matrix: SegmentedMatrix) -> None:
+    plan = matrix.plan_merge()
+    if plan is None:
+        return
+
+    def run() -> None:
+        # the copy reads immutable files, so only the swap takes the lock
+        try:
+            written = matrix.write_merge(plan)
+        except BaseException:
+            with _write(library_id):
+                matrix.abort_merge(plan)
+            raise
+        with _write(library_id):
+            if _matrices.get(library_id) is matrix:
+                _retired.extend(matrix.install_merge(plan, written))
+            else:
+                matrix.abort_merge(plan)
+
+    threading.Thread(target=run, name="segment-merge", daemon=True).start()
+
+
+def _queue_index_work(library_id: UUID, op: str, chunk_id: UUID, vector: Any = None) -> None:
+    # the indexes are picked now, under the lock: one registered later was built from a
+    # matrix that already has this change
+    work = _index_work[_stripe(library_id)]
+    for index in _library_indexes(library_id):
+        work.append((index, op, chunk_id, vector))
+
+
+def _library_indexes(library_id: UUID) -> List[Any]:
+    indexes = list(_indexes.get(library_id, {}).values())
+    indexes.extend(_building.get(library_id, {}).values())
+    return indexes
+
+
+# ----------------- recovery & snapshots ------------------
+
+_data_dir: Optional[str] = None
+# segment files replaced by merges or library deletes; the current snapshot may
+# still reference them, so they are deleted once the next snapshot is written
+_retired: List[str] = []
+_snapshotter: Optional[threading.Thread] = None
+_snapshot_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def open_store(data_dir: str) -> None:
+    """
+    Recover from data_dir (latest snapshot + WAL tail), then log every
+    mutation there and snapshot in the background.
+    """
+    global _wal, _data_dir, _snapshotter
+    os.makedirs(data_dir, exist_ok=True)
+    with _write_all():
+        _data_dir = data_dir
+        _recover(data_dir)
+        segments = persistence.list_segments(data_dir)
+        _wal = persistence.WriteAheadLog(data_dir, segments[-1] if segments else 1)
+    _stop.clear()
+    _snapshotter = threading.Thread(target=_snapshot_loop, name="snapshotter", daemon=True)
+    _snapshotter.start()
+
+
+def close_store() -> None:
+    """Flush the WAL and stop background snapshots"""
+    global _wal, _snapshotter
+    _stop.set()
+    if _snapshotter is not None:
+        _snapshotter.join()
+        _snapshotter = None
+    if _wal is not None:
+        _wal.close()
+        _wal = None
+
+
+def snapshot() -> None:
+    """
+    Write a snapshot of the whole store and drop the WAL segments it covers.
+    Writers are paused only while the state is captured (dict copies and
+    matrix views); encoding and fsync happen with no lock held.
+    """
+    with _snapshot_lock:
+        if _wal is not None:
+            _write_snapshot()
+
+
+def _write_snapshot() -> None:
+    with _write_all():
+        segment = _wal.rotate()
+        libraries = list(_libraries.values())
+        documents = list(_documents.values())
+        captured = []
+        manifests = {}
+        for lib in libraries:
+            matrix = _matrices.get(lib.id)
+            if isinstance(matrix, SegmentedMatrix):
+                # segment files are already on disk: reference them, write only the memtable
+                manifests[str(lib.id)] = matrix.manifest()
+                view = matrix.memtable_snapshot()
+            else:
+                view = None if matrix is None else matrix.snapshot()
+            captured.append(([_chunks[chunk_id] for chunk_id in _library_chunks.get(lib.id, ())], view))
+        retired = list(_retired)
+
+    def blocks():
+        for chunks, view in captured:
+            # ids travel once, packed; the library id is the block's
+            records = [
+                {"text": chunk.text, "metadata": chunk.metadata}
+                if chunk.document_id is None else
+                {"document_id": str(chunk.document_id), "text": chunk.text, "metadata": chunk.metadata}
+                for chunk in chunks
+            ]
+            ids = b"".join(chunk.id.bytes for chunk in chunks)
+            if view is None:
+                yield records, ids, np.empty(0, dtype=np.uint32), None, None
+                continue
+            live = np.arange(len(view.norms)) if view.mask is None else np.flatnonzero(view.mask)
+            position = {chunk.id: i for i, chunk in enumerate(chunks)}
+            positions = np.fromiter((position[view.ids[row]] for row in live), dtype=np.uint32, count=len(live))
+            if view.vectors is not None:
+                yield records, ids, positions, view.vectors[live], None
+            else:
+                # codes as they are: re-encoding decoded rows would drift on every restart
+                yield records, ids, positions, view.codes[live], view.quantizer.state()
+
+    persistence.write_snapshot(
+        _data_dir,
+        segment,
+        [lib.model_dump(mode="json") for lib in libraries],
+        [doc.model_dump(mode="json") for doc in documents],
+        blocks(),
+        manifests,
+    )
+    for old in persistence.list_segments(_data_dir):
+        if old < segment:
+            os.remove(persistence.segment_path(_data_dir, old))
+    for path in retired:
+        if os.path.exists(path):
+            os.remove(path)
+    del _retired[:len(retired)]
+
+
+def _snapshot_loop() -> None:
+    last = time.monotonic()
+    while not _stop.wait(1.0):
+        due = time.monotonic() - last >= Config.SNAPSHOT_INTERVAL
+        if _wal is not None and _wal.size and (due or _wal.size >= Config.SNAPSHOT_WAL_BYTES):
+            snapshot()
+            last = time.monotonic()
+
+
+def _recover(data_dir: str) -> None:
+    # millions of small allocations would otherwise trigger repeated full GC passes
+    gc.disable()
+    try:
+        _load(data_dir)
+    finally:
+        gc.enable()
+
+
+def _load(data_dir: str) -> None:
+    loaded = persistence.read_snapshot(data_dir)
+    first_segment = 1
+    # vector segments written after the snapshot are rebuilt from the log
+    _remove_unreferenced_segments(data_dir, {} if loaded is None else loaded[0].get("segments", {}))
+    if loaded is not None:
+        header, blocks = loaded
+        first_segment = header["wal_segment"]
+        _restore_snapshot(header, blocks)
+    for segment in persistence.list_segments(data_dir):
+        if segment < first_segment:
+            continue
+        for payload in persistence.read_segment(persistence.segment_path(data_dir, segment)):
+            for record in persistence.decode_batch(payload):
+                _replay(*persistence.decode_record(record))
+
+
+def _restore_snapshot(
+    header: Dict[str, Any],
+    blocks: List[Tuple[bytes, bytes, Optional[np.ndarray], Optional[np.ndarray], Optional[Dict[str, np.ndarray]]]],
+) -> None:
+    for data in header["libraries"]:
+        lib = Library.model_validate(data)
+        _libraries[lib.id] = lib
+    for data in header["documents"]:
+        _put_document(Document.model_validate(data))
+
+    for lib_data, (records, packed_ids, positions, rows, state) in zip(header["libraries"], blocks):
+        library_id = UUID(lib_data["id"])
+        records = json.loads(records)
+        ids = [UUID(bytes=packed_ids[i:i + 16]) for i in range(0, len(packed_ids), 16)]
+        if positions is None:
+            # before version 3 the ids are the rows' own and records carry theirs
+            vector_ids, chunk_ids = ids, [UUID(data["id"]) for data in records]
+        else:
+            # rows point at their records, so every id is decoded once
+            chunk_ids = ids
+            vector_ids = list(map(chunk_ids.__getitem__, positions.tolist()))
+        manifest = header.get("segments", {}).get(str(library_id))
+        matrix = None
+        if manifest is not None:
+            # memory-mapped library: map its segment files, nothing is read into RAM
+            matrix = _matrices[library_id] = _new_matrix(library_id, segmented=True)
+            matrix.load_manifest(manifest)
+        if vector_ids:
+            if matrix is None:
+                matrix = _matrices[library_id] = _new_matrix(library_id)
+            if state is not None:
+                matrix.load_codes(vector_ids, rows, state)
+            else:
+                matrix.bulk_load(vector_ids, rows)
+        # records were validated when written: parse each distinct document id once
+        documents: Dict[Optional[str], Optional[UUID]] = {None: None}
+        for chunk_id, data in zip(chunk_ids, records):
+            raw_doc = data.get("document_id")
+            document_id = documents.get(raw_doc)
+            if document_id is None and raw_doc is not None:
+                document_id = documents[raw_doc] = UUID(raw_doc)
+            _chunks[chunk_id] = ChunkRecord(chunk_id, library_id, document_id, data["text"], data["metadata"])
+            if document_id is not None:
+                _document_chunks.setdefault(document_id, {})[chunk_id] = None
+        if chunk_ids:
+            _library_chunks.setdefault(library_id, {}).update(dict.fromkeys(chunk_ids))
+            # the metadata index is only needed by filtered searches: the first one builds it
+            _chunk_metadata.pop(library_id, None)
+            _unindexed[library_id] = None
+        _bump_version(library_id)
+
+
+def _vector_dir(library_id: UUID) -> str:
+    return os.path.join(_data_dir, "vectors", str(library_id))
+
+
+def _remove_unreferenced_segments(data_dir: str, manifests: Dict[str, Any]) -> None:
+    root = os.path.join(data_dir, "vectors")
+    if not os.path.isdir(root):
+        return
+    for library in os.listdir(root):
+        keep = {entry["name"] for entry in manifests.get(library, {}).get("segments", ())}
+        directory = os.path.join(root, library)
+        for name in os.listdir(directory):
+            if name not in keep:
+                os.remove(os.path.join(directory, name))
+        if not keep:
+            os.rmdir(directory)
+
+
+def _replay(record: Dict[str, Any], vector: Optional[np.ndarray]) -> None:
+    op = record["op"]
+    if op == "library":
+        _put_library(Library.model_validate(record["library"]))
+    elif op == "library_delete":
+        _drop_library(UUID(record["id"]))
+    elif op == "document":
+        _put_document(Document.model_validate(record["document"]))
+    elif op == "document_attach":
+        _attach_chunks(UUID(record["id"]), [UUID(cid) for cid in record["chunk_ids"]])
+    elif op == "document_detach":
+        _detach_chunk(UUID(record["id"]), UUID(record["chunk_id"]))
+    elif op == "document_delete":
+        _drop_document(UUID(record["id"]))
+    elif op == "chunk":
+        chunk = Chunk.model_validate(record["chunk"])
+        if vector is not None:
+            chunk.embedding = vector.tolist()
+        _put_chunk(chunk)
+    elif op == "chunk_patch":
+        changes = {key: record[key] for key in ("text", "metadata") if key in record}
+        if "document_id" in record:
+            changes["document_id"] = None if record["document_id"] is None else UUID(record["document_id"])
+        if vector is not None:
+            changes["embedding"] = vector
+        _patch_chunk(UUID(record["id"]), changes)
+    elif op == "chunk_delete":
+        _pop_chunk(UUID(record["id"]))
+
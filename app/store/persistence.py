@@ -0,0 +1,288 @@
+import io
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+# ----------------- record encoding ------------------
+# WAL frame:      u32 payload length | u32 crc32(payload) | payload
+# frame payload:  (u32 record length | record)+, every record of one store step,
+#                 so a torn frame drops the whole step, never half of it
+# record:         u32 json length | json {"op": ..., ...} | optional raw float32 vector
+
+_FRAME = struct.Struct("<II")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+def encode_record(op: str, body: Dict[str, Any], vector: Optional[Any] = None) -> bytes:
+    header = dict(body, op=op)
+    blob = b""
+    if vector is not None:
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+    raw = json.dumps(header, separators=(",", ":")).encode()
+    return _U32.pack(len(raw)) + raw + blob
+
+
+def encode_batch(records: List[bytes]) -> bytes:
+    return b"".join(_U32.pack(len(record)) + record for record in records)
+
+
+def decode_batch(payload: bytes) -> Iterator[bytes]:
+    pos = 0
+    while pos < len(payload):
+        (size,) = _U32.unpack_from(payload, pos)
+        yield payload[pos + _U32.size:pos + _U32.size + size]
+        pos += _U32.size + size
+
+
+def decode_record(payload: bytes) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    (size,) = _U32.unpack_from(payload)
+    header = json.loads(payload[4:4 + size])
+    blob = payload[4 + size:]
+    vector = np.frombuffer(blob, dtype=np.float32) if blob else None
+    return header, vector
+
+
+# ----------------- write-ahead log ------------------
+
+_SEGMENT = re.compile(r"^wal-(\d{8})\.log$")
+
+
+def segment_path(directory: str, segment: int) -> str:
+    return os.path.join(directory, f"wal-{segment:08d}.log")
+
+
+def list_segments(directory: str) -> List[int]:
+    found = (_SEGMENT.match(name) for name in os.listdir(directory))
+    return sorted(int(m.group(1)) for m in found if m)
+
+
+def read_segment(path: str) -> Iterator[bytes]:
+    """
+    Yield record payloads in order. A torn or corrupt frame (crash mid-write)
+    ends the segment; the file is truncated there so new appends stay readable.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + _FRAME.size <= len(data):
+        size, crc = _FRAME.unpack_from(data, pos)
+        end = pos + _FRAME.size + size
+        payload = data[pos + _FRAME.size:end]
+        if end > len(data) or zlib.crc32(payload) != crc:
+            break
+        yield payload
+        pos = end
+    if pos != len(data):
+        with open(path, "r+b") as f:
+            f.truncate(pos)
+
+
+class WriteAheadLog:
+    """
+    Append-only log with group commit: append() only buffers a frame and
+    returns its sequence number; one flusher thread writes everything
+    buffered so far and fsyncs once, then wakes every waiter in that batch.
+    Concurrent writers therefore share fsyncs instead of paying one each.
+    """
+
+    def __init__(self, directory: str, segment: int):
+        self.directory = directory
+        self.segment = segment
+        self._cond = threading.Condition()
+        self._buffer: List[bytes] = []
+        self._appended = 0
+        self._durable = 0
+        self._closing = False
+        self._error: Optional[BaseException] = None
+        self._file = open(segment_path(directory, segment), "ab")
+        self.size = self._file.tell()
+        self._thread = threading.Thread(target=self._flush_loop, name="wal-flush", daemon=True)
+        self._thread.start()
+
+    def append(self, payload: bytes) -> int:
+        frame = _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._cond:
+            self._buffer.append(frame)
+            self._appended += 1
+            self.size += len(frame)
+            self._cond.notify_all()
+            return self._appended
+
+    def wait(self, seq: int) -> None:
+        """Block until record seq (and everything before it) is on disk"""
+        with self._cond:
+            while self._durable < seq and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise OSError("Write-ahead log is unavailable") from self._error
+
+    def rotate(self) -> int:
+        """Flush, then continue in a fresh segment; returns the new segment number"""
+        with self._cond:
+            while self._durable < self._appended and self._error is None:
+                self._cond.wait()
+            self._file.close()
+            self.segment += 1
+            self._file = open(segment_path(self.directory, self.segment), "ab")
+            self.size = 0
+            return self.segment
+
+    def close(self) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                batch, self._buffer = self._buffer, []
+                target = self._appended
+                f = self._file
+            try:
+                f.write(b"".join(batch))
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException as exc:
+                with self._cond:
+                    self._error = exc
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable = target
+                self._cond.notify_all()
+
+
+# ----------------- snapshots ------------------
+# MAGIC | frame(header json, incl. segment manifests) | per library: frame(chunks json) frame(ids)
+#   frame(u32 width | rows) frame(quantizer state npz, empty if none)
+# rows are float32 vectors, or uint8 codes when the library has a quantizer state
+# frame: u64 length | u32 crc32 | bytes
+
+SNAPSHOT_MAGIC = b"VDBSNAP1"
+SNAPSHOT_FILE = "snapshot.bin"
+
+
+def _write_frame(f, data: bytes) -> None:
+    f.write(_U64.pack(len(data)))
+    f.write(_U32.pack(zlib.crc32(data)))
+    f.write(data)
+
+
+def _read_frame(f) -> bytes:
+    size = _U64.unpack(f.read(_U64.size))[0]
+    crc = _U32.unpack(f.read(_U32.size))[0]
+    data = f.read(size)
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError("Corrupt snapshot frame")
+    return data
+
+
+def write_snapshot(
+    directory: str,
+    wal_segment: int,
+    libraries: List[Dict[str, Any]],
+    documents: List[Dict[str, Any]],
+    blocks: Iterator[Tuple[List[Dict[str, Any]], bytes, np.ndarray, Optional[np.ndarray], Optional[Dict[str, np.ndarray]]]],
+    segments: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Write a snapshot atomically (temp file, fsync, rename). Replay starts at
+    wal_segment. Each block is one library's chunk records without ids or
+    embeddings, their ids as packed 16-byte UUIDs, and its vector rows: the
+    record position of each row, then the rows, (n, dim) float32 vectors or
+    (n, width) uint8 codes plus the state of the quantizer that decodes them.
+    Records are stored as one JSON array so they can be parsed in one call;
+    ids are binary so each is decoded once, and rows only point at them.
+    segments maps library id -> manifest of its memory-mapped vector files,
+    which are referenced rather than copied.
+    """
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        header = {
+            "version": 3, "wal_segment": wal_segment, "libraries": libraries,
+            "documents": documents, "segments": segments or {},
+        }
+        _write_frame(f, json.dumps(header, separators=(",", ":")).encode())
+        for records, ids, positions, rows, state in blocks:
+            _write_frame(f, json.dumps(records, separators=(",", ":")).encode())
+            _write_frame(f, ids)
+            width = 0 if rows is None else rows.shape[1]
+            dtype = np.float32 if state is None else np.uint8
+            _write_frame(f, _U32.pack(width) + (b"" if rows is None else np.ascontiguousarray(rows, dtype=dtype).tobytes()))
+            _write_frame(f, b"" if state is None else _pack_arrays(state))
+            _write_frame(f, np.ascontiguousarray(positions, dtype=np.uint32).tobytes())
+        f.write(_U64.pack(0))  # end marker
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(directory)
+
+
+def read_snapshot(
+    directory: str,
+) -> Optional[Tuple[Dict[str, Any], List[Tuple[bytes, bytes, Optional[np.ndarray], Optional[np.ndarray], Optional[Dict[str, np.ndarray]]]]]]:
+    """
+    (header, [(chunk records JSON, packed ids, row positions, rows, quantizer state)])
+    or None without a snapshot. Before version 3 the ids are the rows' own,
+    records carry their ids, and positions is None.
+    """
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return None
+    blocks = []
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        header = json.loads(_read_frame(f))
+        version = header.get("version", 1)
+        while True:
+            peek = f.read(_U64.size)
+            if _U64.unpack(peek)[0] == 0:
+                break
+            f.seek(-_U64.size, os.SEEK_CUR)
+            records = _read_frame(f)
+            ids = _read_frame(f)
+            raw = _read_frame(f)
+            packed_state = _read_frame(f) if version >= 2 else b""
+            positions = np.frombuffer(_read_frame(f), dtype=np.uint32) if version >= 3 else None
+            state = _unpack_arrays(packed_state) if packed_state else None
+            width = _U32.unpack_from(raw)[0]
+            dtype = np.float32 if state is None else np.uint8
+            rows = np.frombuffer(raw, dtype=dtype, offset=4).reshape(-1, width) if width else None
+            blocks.append((records, ids, positions, rows, state))
+    return header, blocks
+
+
+def _pack_arrays(arrays: Dict[str, np.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _unpack_arrays(data: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def _fsync_dir(directory: str) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from ..models.chunk import Chunk
+
+
+class ChunkRecord:
+    """
+    A chunk as the store keeps it: ids, text and metadata in slots, with no
+    per-instance dict, no Pydantic state and no embedding (vectors live only
+    in the library's matrix). Records are never mutated; an update swaps in
+    a new one, which costs five references, not a copy of the vector.
+    """
+    __slots__ = ("id", "library_id", "document_id", "text", "metadata")
+
+    def __init__(
+        self,
+        id: UUID,
+        library_id: UUID,
+        document_id: Optional[UUID],
+        text: str,
+        metadata: Dict[str, Any],
+    ):
+        self.id = id
+        self.library_id = library_id
+        self.document_id = document_id
+        self.text = text
+        self.metadata = metadata
+
+    @classmethod
+    def from_model(cls, chunk: Chunk) -> "ChunkRecord":
+        return cls(chunk.id, chunk.library_id, chunk.document_id, chunk.text, chunk.metadata)
+
+    def replace(self, **changes: Any) -> "ChunkRecord":
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return ChunkRecord(**fields)
+
+    def to_model(self, embedding: Optional[List[float]]) -> Chunk:
+        """The API model; fields were validated on the way in, so nothing is re-checked"""
+        return Chunk.model_construct(
+            id=self.id,
+            library_id=self.library_id,
+            document_id=self.document_id,
+            text=self.text,
+            embedding=embedding,
+            metadata=self.metadata,
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        """Log / snapshot form; detached chunks omit document_id"""
+        data = {"id": str(self.id), "library_id": str(self.library_id), "text": self.text, "metadata": self.metadata}
+        if self.document_id is not None:
+            data["document_id"] = str(self.document_id)
+        return data
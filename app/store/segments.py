@@ -0,0 +1,308 @@
+import os
+import re
+import struct
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from .embedding_matrix import EmbeddingMatrix, MatrixSnapshot
+
+
+# ----------------- segment files ------------------
+# header (64 bytes): magic | u32 dim | u64 rows | padding
+# then rows * dim float32 vectors | rows float32 norms | rows 16-byte chunk ids
+# Every section is 4-byte aligned, so each one maps straight onto a NumPy array.
+
+SEGMENT_MAGIC = b"VDBSEG01"
+_HEADER = struct.Struct("<8sIQ")
+_HEADER_SIZE = 64
+_NAME = re.compile(r"^seg-(\d{8})\.vec$")
+_WRITE_ROWS = 4096  # rows copied per write while merging
+
+
+def segment_name(seq: int) -> str:
+    return f"seg-{seq:08d}.vec"
+
+
+def write_segment(path: str, ids: Sequence[UUID], parts: Sequence[np.ndarray]) -> None:
+    """Write rows (given as consecutive blocks) to an immutable segment file, atomically"""
+    rows = sum(part.shape[0] for part in parts)
+    dim = parts[0].shape[1]
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(SEGMENT_MAGIC, dim, rows).ljust(_HEADER_SIZE, b"\0"))
+        norms = []
+        for part in parts:
+            for start in range(0, part.shape[0], _WRITE_ROWS):
+                block = np.ascontiguousarray(part[start:start + _WRITE_ROWS], dtype=np.float32)
+                f.write(block.tobytes())
+                norms.append(np.linalg.norm(block, axis=1).astype(np.float32))
+        f.write(np.concatenate(norms).tobytes() if norms else b"")
+        f.write(b"".join(chunk_id.bytes for chunk_id in ids))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class MergePlan(NamedTuple):
+    path: str
+    sources: List[Tuple["Segment", np.ndarray]]  # (segment, live rows at plan time)
+
+
+class Segment:
+    """One immutable segment file, mapped read-only; only the tombstones live in RAM"""
+    __slots__ = ("name", "path", "vectors", "norms", "ids", "alive", "dead")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            magic, dim, rows = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not a vector segment")
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        vec_end = _HEADER_SIZE + rows * dim * 4
+        self.vectors = data[_HEADER_SIZE:vec_end].view(np.float32).reshape(rows, dim)
+        self.norms = data[vec_end:vec_end + rows * 4].view(np.float32)
+        raw_ids = data[vec_end + rows * 4:vec_end + rows * 20].tobytes()
+        self.ids = [UUID(bytes=raw_ids[i:i + 16]) for i in range(0, len(raw_ids), 16)]
+        self.alive = np.ones(rows, dtype=bool)
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return len(self.ids) - self.dead
+
+    def kill(self, row: int) -> None:
+        if self.alive[row]:
+            self.alive[row] = False
+            self.dead += 1
+
+    def view(self) -> MatrixSnapshot:
+        return MatrixSnapshot(
+            vectors=self.vectors,
+            norms=self.norms,
+            ids=self.ids,
+            mask=self.alive.copy() if self.dead else None,
+        )
+
+
+class SegmentedMatrix:
+    """
+    A library's embeddings as immutable memory-mapped segment files plus a
+    small in-RAM memtable (an EmbeddingMatrix) that takes every new write.
+
+    - upsert() tombstones the row's old location and writes to the memtable;
+      a full memtable is flushed into a new segment.
+    - Segments are never modified. Merges write a new file from the live
+      rows of several segments and swap it in (plan_merge / write_merge /
+      install_merge, so the copy runs without the library lock).
+    - Files a merge replaces are only retired, not deleted: the last store
+      snapshot may still reference them, so the store deletes them after its
+      next one.
+
+    Same interface as EmbeddingMatrix except that a library-wide search scans
+    parts() (one view per segment plus the memtable) instead of snapshot().
+    """
+
+    compressed = False
+    row_quantizer = None
+
+    def __init__(self, directory: str, memtable_rows: int, max_segments: int):
+        self.directory = directory
+        self.memtable_rows = memtable_rows
+        self.max_segments = max_segments
+        self.dim: Optional[int] = None
+        self._segments: List[Segment] = []
+        self._where: Dict[UUID, Tuple[Segment, int]] = {}
+        self._memtable = EmbeddingMatrix()
+        self._next_seq = 1
+        self._merging = False
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            m = _NAME.match(name)
+            if m:
+                self._next_seq = max(self._next_seq, int(m.group(1)) + 1)
+
+    def __len__(self) -> int:
+        return len(self._where) + len(self._memtable)
+
+    def __contains__(self, chunk_id: UUID) -> bool:
+        return chunk_id in self._where or chunk_id in self._memtable
+
+    def upsert(self, chunk_id: UUID, embedding: Sequence[float]) -> None:
+        vec = np.asarray(embedding, dtype=np.float32)
+        if vec.ndim != 1 or vec.shape[0] == 0:
+            raise ValueError("Embedding must be a non-empty 1-d vector")
+        if len(self) and vec.shape[0] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {vec.shape[0]} does not match library dimension {self.dim}"
+            )
+        self.remove(chunk_id)
+        self._memtable.upsert(chunk_id, vec)
+        self.dim = vec.shape[0]
+        if len(self._memtable) >= self.memtable_rows:
+            self.flush()
+
+    def bulk_load(self, chunk_ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        """Recovery: rows that were still in the memtable at snapshot time"""
+        for chunk_id, vec in zip(chunk_ids, vectors):
+            self.upsert(chunk_id, vec)
+
+    def remove(self, chunk_id: UUID) -> None:
+        loc = self._where.pop(chunk_id, None)
+        if loc is None:
+            self._memtable.remove(chunk_id)
+            return
+        segment, row = loc
+        segment.kill(row)
+
+    def vector(self, chunk_id: UUID) -> Optional[np.ndarray]:
+        loc = self._where.get(chunk_id)
+        if loc is None:
+            return self._memtable.vector(chunk_id)
+        segment, row = loc
+        return np.array(segment.vectors[row])
+
+    def parts(self, chunk_ids: Optional[Sequence[UUID]] = None) -> List[MatrixSnapshot]:
+        """One view per segment plus the memtable, or a single gathered copy of chunk_ids"""
+        if chunk_ids is None:
+            views = [segment.view() for segment in self._segments if len(segment)]
+            if len(self._memtable):
+                views.append(self._memtable.snapshot())
+            return views
+        ids, vectors = [], []
+        for chunk_id in chunk_ids:
+            vec = self.vector(chunk_id)
+            if vec is not None:
+                ids.append(chunk_id)
+                vectors.append(vec)
+        if not ids:
+            return []
+        block = np.stack(vectors).astype(np.float32, copy=False)
+        return [MatrixSnapshot(vectors=block, norms=np.linalg.norm(block, axis=1), ids=ids, mask=None)]
+
+    def live_items(self) -> Tuple[List[UUID], np.ndarray]:
+        ids: List[UUID] = []
+        blocks = []
+        for segment in self._segments:
+            live = np.flatnonzero(segment.alive)
+            ids.extend(segment.ids[row] for row in live)
+            blocks.append(segment.vectors[live])
+        mem_ids, mem_vectors = self._memtable.live_items()
+        ids.extend(mem_ids)
+        blocks.append(mem_vectors)
+        blocks = [block for block in blocks if block.shape[0]]
+        if not blocks:
+            return [], np.empty((0, self.dim or 0), dtype=np.float32)
+        return ids, np.concatenate(blocks)
+
+    # ----------------- flush & merge (caller holds the library's write lock) ------------------
+
+    def flush(self) -> None:
+        """Write the memtable's live rows to a new segment"""
+        ids, vectors = self._memtable.live_items()
+        if ids:
+            segment = self._add_segment(ids, [vectors])
+            for row, chunk_id in enumerate(ids):
+                self._where[chunk_id] = (segment, row)
+        # a fresh memtable: snapshots of the old one keep their rows
+        self._memtable = EmbeddingMatrix()
+
+    def needs_merge(self) -> bool:
+        if self._merging:
+            return False
+        if len(self._segments) > self.max_segments:
+            return True
+        return any(segment.dead > len(segment) for segment in self._segments)
+
+    def plan_merge(self) -> Optional[MergePlan]:
+        """
+        Pick segments to merge: the smallest ones past max_segments / 2, plus
+        any that are mostly tombstones, with the live rows of each.
+        """
+        if self._merging or not self.needs_merge():
+            return None
+        by_size = sorted(self._segments, key=len)
+        chosen = by_size[:max(2, len(self._segments) - self.max_segments // 2)]
+        chosen += [s for s in by_size[len(chosen):] if s.dead > len(s)]
+        self._merging = True
+        return MergePlan(
+            path=os.path.join(self.directory, segment_name(self._take_seq())),
+            sources=[(segment, np.flatnonzero(segment.alive)) for segment in chosen],
+        )
+
+    @staticmethod
+    def write_merge(plan: MergePlan) -> bool:
+        """Copy the planned live rows into the new file; needs no lock, segments are immutable"""
+        ids = [segment.ids[row] for segment, rows in plan.sources for row in rows]
+        if not ids:
+            return False
+        write_segment(plan.path, ids, [segment.vectors[rows] for segment, rows in plan.sources if len(rows)])
+        return True
+
+    def install_merge(self, plan: MergePlan, written: bool) -> List[str]:
+        """
+        Swap the merged file in; rows deleted or updated during the merge stay
+        dead. Returns the replaced files, for the caller to retire.
+        """
+        self._merging = False
+        merged = Segment(plan.path) if written else None
+        if merged is not None:
+            # liveness only ever goes True -> False on an immutable segment
+            merged.alive = np.concatenate([segment.alive[rows] for segment, rows in plan.sources])
+            merged.dead = int(merged.alive.size - np.count_nonzero(merged.alive))
+            for row in np.flatnonzero(merged.alive):
+                self._where[merged.ids[row]] = (merged, int(row))
+        replaced = {id(segment) for segment, _ in plan.sources}
+        self._segments = [s for s in self._segments if id(s) not in replaced]
+        if merged is not None:
+            self._segments.append(merged)
+        return [segment.path for segment, _ in plan.sources]
+
+    def abort_merge(self, plan: MergePlan) -> None:
+        self._merging = False
+        if os.path.exists(plan.path):
+            os.remove(plan.path)
+
+    # ----------------- snapshots (caller holds the library's lock) ------------------
+
+    def manifest(self) -> Dict[str, Any]:
+        """Segment files and their dead rows; the memtable is snapshotted separately"""
+        return {
+            "dim": self.dim,
+            "segments": [
+                {"name": s.name, "dead": np.flatnonzero(~s.alive).tolist()} for s in self._segments
+            ],
+        }
+
+    def memtable_snapshot(self) -> MatrixSnapshot:
+        return self._memtable.snapshot()
+
+    def files(self) -> List[str]:
+        return [segment.path for segment in self._segments]
+
+    def load_manifest(self, manifest: Dict[str, Any]) -> None:
+        """Map the listed segments (nothing is read but the ids) and apply their tombstones"""
+        self.dim = manifest["dim"]
+        for entry in manifest["segments"]:
+            segment = Segment(os.path.join(self.directory, entry["name"]))
+            for row in entry["dead"]:
+                segment.kill(row)
+            for row in np.flatnonzero(segment.alive):
+                self._where[segment.ids[row]] = (segment, int(row))
+            self._segments.append(segment)
+
+    # ----------------- internals ------------------
+
+    def _take_seq(self) -> int:
+        seq = self._next_seq
+        self._next_seq += 1
+        return seq
+
+    def _add_segment(self, ids: Sequence[UUID], parts: Sequence[np.ndarray]) -> Segment:
+        path = os.path.join(self.directory, segment_name(self._take_seq()))
+        write_segment(path, ids, parts)
+        segment = Segment(path)
+        self._segments.append(segment)
+        return segment
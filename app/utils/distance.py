@@ -0,0 +1,127 @@
+from abc import ABC, abstractmethod
+from typing import Dict
+
+import numpy as np
+
+
+class Metric(ABC):
+    """
+    One search metric, in the forms the search paths need:
+
+    - higher_is_better: similarity (cosine, dot) or distance (l2, l2_squared)
+    - normalize: indexes store unit-length vectors, which turns cosine into a
+      plain dot product (prepare() applies it)
+    - scores(dots, norms, q_norms): batch kernel for scans; turns the q·x
+      products of one BLAS call plus precomputed row norms into ranking
+      scores. Arguments broadcast, so one query or a block of them works the
+      same. report() maps the few selected ones to returned scores (l2 ranks
+      on squared distances and takes the sqrt only there)
+    - distances(vectors, other): lower-is-better distances between prepared
+      vectors, for graph/tree indexes; to_score() maps them back to scores
+    - metric_space: distances() is squared L2 between prepared vectors, so its
+      square root obeys the triangle inequality (needed for VP-tree pruning)
+    """
+
+    name = ""
+    higher_is_better = False
+    normalize = False
+    metric_space = True
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """float32 copy; rows scaled to unit length when the metric normalizes (zero rows stay zero)"""
+        vectors = np.array(vectors, dtype=np.float32, copy=True)
+        if self.normalize and vectors.size:
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            np.divide(vectors, norms, out=vectors, where=norms != 0)
+        return vectors
+
+    def keys(self, scores: np.ndarray) -> np.ndarray:
+        """Sort keys for scores, ascending = best first (always a fresh array)"""
+        return -scores if self.higher_is_better else scores.copy()
+
+    @abstractmethod
+    def scores(self, dots: np.ndarray, norms: np.ndarray, q_norms) -> np.ndarray:
+        ...
+
+    def report(self, scores: np.ndarray) -> np.ndarray:
+        return scores
+
+    @abstractmethod
+    def distances(self, vectors: np.ndarray, other: np.ndarray) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def to_score(self, dists: np.ndarray) -> np.ndarray:
+        ...
+
+
+class Cosine(Metric):
+    name = "cosine"
+    higher_is_better = True
+    normalize = True
+
+    def scores(self, dots, norms, q_norms):
+        denom = norms * q_norms
+        # zero vectors score 0.0
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom != 0)
+
+    def distances(self, vectors, other):
+        # unit vectors: |a - b|^2 = 2 - 2 a·b, one product instead of a difference
+        return 2.0 - 2.0 * (vectors @ other.T)
+
+    def to_score(self, dists):
+        return 1.0 - np.asarray(dists) / 2.0
+
+
+class Dot(Metric):
+    """Raw inner product; not a metric space, so VP-trees can't serve it"""
+    name = "dot"
+    higher_is_better = True
+    metric_space = False
+
+    def scores(self, dots, norms, q_norms):
+        return dots
+
+    def distances(self, vectors, other):
+        return -(vectors @ other.T)
+
+    def to_score(self, dists):
+        return -np.asarray(dists)
+
+
+class SquaredL2(Metric):
+    name = "l2_squared"
+
+    def scores(self, dots, norms, q_norms):
+        return np.maximum(norms * norms - 2.0 * dots + q_norms * q_norms, 0.0)
+
+    def distances(self, vectors, other):
+        if other.ndim == 1:
+            diff = vectors - other
+            return np.einsum("ij,ij->i", diff, diff)
+        sq = np.einsum("ij,ij->i", vectors, vectors)
+        return sq[:, None] + np.einsum("ij,ij->i", other, other)[None, :] - 2.0 * (vectors @ other.T)
+
+    def to_score(self, dists):
+        return np.maximum(dists, 0.0)
+
+
+class L2(SquaredL2):
+    """Ranks on squared distances like l2_squared; the sqrt is only taken on the scores returned"""
+    name = "l2"
+
+    def report(self, scores):
+        return np.sqrt(scores)
+
+    def to_score(self, dists):
+        return np.sqrt(np.maximum(dists, 0.0))
+
+
+METRICS: Dict[str, Metric] = {metric.name: metric for metric in (Cosine(), Dot(), L2(), SquaredL2())}
+
+
+def get_metric(name: str) -> Metric:
+    metric = METRICS.get(name)
+    if metric is None:
+        raise ValueError(f"Unknown metric {name!r}; expected one of {sorted(METRICS)}")
+    return metric
@@ -0,0 +1,380 @@
+import heapq
+import logging
+import math
+import random
+import threading
+from typing import Any, Container, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from .distance import get_metric
+from .rows import RowCodec
+
+logger = logging.getLogger(__name__)
+
+class _Graph:
+    """
+    One immutable-by-replacement HNSW graph. Searches hold a reference to the
+    graph they started on, so a background compaction can swap in a new one.
+    """
+    __slots__ = (
+        "rows", "ids", "node_of", "levels", "neighbors",
+        "deleted", "entry", "max_level", "size", "dead",
+    )
+
+    def __init__(self, rows: np.ndarray):
+        # stored rows (prepared float32 vectors, or codes); starts as the empty template given
+        self.rows = rows[:0]
+        self.ids: List[UUID] = []
+        self.node_of: Dict[UUID, int] = {}
+        self.levels: List[int] = []
+        # neighbors[node][level] -> list of node ids
+        self.neighbors: List[List[List[int]]] = []
+        self.deleted = np.empty(0, dtype=bool)
+        self.entry = -1
+        self.max_level = -1
+        self.size = 0
+        self.dead = 0
+
+
+class HNSWIndex:
+    """
+    Hierarchical Navigable Small World graph (Malkov & Yashunin) over one
+    library's embeddings for one metric.
+
+    - M: links per node on upper layers (2*M on layer 0); more = better recall, more memory.
+    - ef_construction: candidate list size while inserting; more = better graph, slower inserts.
+    - ef_search: candidate list size per query (default here, overridable per request);
+      the recall/latency knob.
+
+    Given the library's quantizer, nodes keep its codes instead of float32
+    vectors and are decoded when their distances are taken.
+
+    Inserts are incremental. Deletes are tombstoned: dead nodes still route
+    queries but are never returned; once they outnumber live nodes the graph is
+    rebuilt in a background thread (if that fails, the current graph stays and
+    compaction is retried after another min_rebuild mutations). Distances come from the metric registry:
+    squared L2 over unit vectors for cosine (one dot product per pair),
+    squared L2 for l2 (sqrt taken only on returned hits), -dot for dot.
+    """
+
+    def __init__(
+        self,
+        metric: str = "cosine",
+        M: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        min_rebuild: int = 1024,
+        seed: int = 0,
+        quantizer: Optional[Any] = None,
+    ):
+        self.metric = metric
+        self._metric = get_metric(metric)
+        self._codec = RowCodec(self._metric.prepare, quantizer)
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.min_rebuild = min_rebuild
+        self._ml = 1.0 / math.log(M)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # why finish_build failed, re-raised to searches waiting on it
+        self._error: Optional[Exception] = None
+        self._graph: Optional[_Graph] = None
+        self._pending: Optional[Tuple[List[UUID], np.ndarray]] = None
+        # mutations recorded while a (re)build is running, replayed onto the new graph
+        self._rebuild_log: Optional[List[Tuple[str, UUID, Optional[np.ndarray]]]] = None
+        # mutations left before a failed compaction is retried
+        self._backoff = 0
+
+    def __len__(self) -> int:
+        g = self._graph
+        return 0 if g is None else len(g.node_of)
+
+    # ----------------- build ------------------
+
+    def begin_build(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        """Start an initial build; mutations from now on are replayed onto it"""
+        with self._lock:
+            self._rebuild_log = []
+            self._pending = (list(ids), self._codec.pack(vectors))
+
+    def finish_build(self) -> None:
+        try:
+            ids, rows = self._pending
+            self._pending = None
+            graph = _Graph(rows)
+            for chunk_id, row in zip(ids, rows):
+                self._insert(graph, chunk_id, row)
+            with self._lock:
+                self._replay(graph)
+                self._graph = graph
+        except Exception as e:
+            self._error = e
+            raise
+        finally:
+            self._ready.set()
+
+    def build(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        self.begin_build(ids, vectors)
+        self.finish_build()
+
+    def _replay(self, graph: _Graph) -> None:
+        log, self._rebuild_log = self._rebuild_log or [], None
+        for op, chunk_id, row in log:
+            self._delete(graph, chunk_id)
+            if op == "add":
+                self._insert(graph, chunk_id, row)
+
+    # ----------------- mutation ------------------
+
+    def add(self, chunk_id: UUID, vector: Sequence[float]) -> None:
+        row = self._codec.pack(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(("add", chunk_id, row))
+            # during the initial build there is no graph yet; the log covers it
+            if self._graph is not None:
+                self._delete(self._graph, chunk_id)
+                self._insert(self._graph, chunk_id, row)
+                self._maybe_compact()
+
+    def remove(self, chunk_id: UUID) -> None:
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(("remove", chunk_id, None))
+            if self._graph is not None:
+                self._delete(self._graph, chunk_id)
+                self._maybe_compact()
+
+    def _delete(self, g: _Graph, chunk_id: UUID) -> None:
+        node = g.node_of.pop(chunk_id, None)
+        if node is not None:
+            g.deleted[node] = True
+            g.dead += 1
+
+    def _maybe_compact(self) -> None:
+        g = self._graph
+        if self._rebuild_log is not None:
+            return
+        if self._backoff:
+            self._backoff -= 1
+            return
+        if g.dead < self.min_rebuild or g.dead < len(g.node_of):
+            return
+        live = list(g.node_of.values())
+        ids = [g.ids[node] for node in live]
+        rows = g.rows[live]
+        self._rebuild_log = []
+
+        def rebuild() -> None:
+            # every mutation since also reached the current graph, so on failure it keeps serving
+            try:
+                graph = _Graph(rows)
+                for chunk_id, row in zip(ids, rows):
+                    self._insert(graph, chunk_id, row)
+            except Exception:
+                logger.exception("hnsw compaction of %d vectors failed", len(ids))
+                with self._lock:
+                    self._rebuild_log = None
+                    self._backoff = self.min_rebuild
+                return
+            with self._lock:
+                self._replay(graph)
+                self._graph = graph
+
+        threading.Thread(target=rebuild, name="hnsw-compact", daemon=True).start()
+
+    def _insert(self, g: _Graph, chunk_id: UUID, row: np.ndarray) -> None:
+        if g.rows.shape[1] != row.shape[0]:
+            if g.size:
+                raise ValueError(
+                    f"Embedding dimension {row.shape[0]} does not match index dimension {g.rows.shape[1]}"
+                )
+            g.rows = np.empty((0, row.shape[0]), dtype=row.dtype)
+        vec = self._codec.unpack(row[None, :])[0]
+
+        node = g.size
+        if node == g.rows.shape[0]:
+            capacity = max(1024, node * 2)
+            rows = np.empty((capacity, g.rows.shape[1]), dtype=g.rows.dtype)
+            rows[:node] = g.rows[:node]
+            deleted = np.zeros(capacity, dtype=bool)
+            deleted[:node] = g.deleted[:node]
+            g.deleted = deleted
+            # swap in after the copy so concurrent readers always see every linked node
+            g.rows = rows
+        g.rows[node] = row
+        level = int(-math.log(1.0 - self._rng.random()) * self._ml)
+        g.ids.append(chunk_id)
+        g.levels.append(level)
+        g.neighbors.append([[] for _ in range(level + 1)])
+
+        if g.entry < 0:
+            g.node_of[chunk_id] = node
+            g.size += 1
+            g.entry, g.max_level = node, level
+            return
+
+        # greedy descent through the layers above the new node's level
+        entry = g.entry
+        entry_dist = float(self._distances(g, vec, [entry])[0])
+        for lvl in range(g.max_level, level, -1):
+            entry, entry_dist = self._greedy(g, vec, entry, entry_dist, lvl)
+
+        entries = [(entry_dist, entry)]
+        for lvl in range(min(level, g.max_level), -1, -1):
+            found = self._search_layer(g, vec, entries, self.ef_construction, lvl, live_only=False)
+            max_links = self.M0 if lvl == 0 else self.M
+            chosen = self._select(g, found, self.M)
+            g.neighbors[node][lvl] = chosen
+            for other in chosen:
+                links = g.neighbors[other][lvl]
+                links.append(node)
+                if len(links) > max_links:
+                    dists = self._distances(g, self._codec.unpack(g.rows[other:other + 1])[0], links)
+                    g.neighbors[other][lvl] = self._select(
+                        g, sorted(zip(dists.tolist(), links)), max_links
+                    )
+            entries = found
+
+        g.node_of[chunk_id] = node
+        g.size += 1
+        if level > g.max_level:
+            g.entry, g.max_level = node, level
+
+    # ----------------- query ------------------
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int,
+        ef_search: Optional[int] = None,
+        allowed: Optional[Container[UUID]] = None,
+    ) -> List[Tuple[UUID, float]]:
+        """
+        Up to k approximate nearest (chunk_id, score), best first. With
+        allowed, other nodes still route the search but are never returned.
+        """
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        g = self._graph
+        if g is None or g.entry < 0:
+            return []
+        q = self._metric.prepare(np.asarray(query, dtype=np.float32))
+        if q.shape[0] != self._codec.dim(g.rows):
+            raise ValueError(
+                f"Query dimension {q.shape[0]} does not match embedding dimension {self._codec.dim(g.rows)}"
+            )
+
+        ef = max(ef_search or self.ef_search, k)
+        entry = g.entry
+        entry_dist = float(self._distances(g, q, [entry])[0])
+        for lvl in range(g.max_level, 0, -1):
+            entry, entry_dist = self._greedy(g, q, entry, entry_dist, lvl)
+        found = self._search_layer(g, q, [(entry_dist, entry)], ef, 0, live_only=True, allowed=allowed)
+
+        found = found[:k]
+        scores = self._metric.to_score(np.array([dist for dist, _ in found])).tolist()
+        return [(g.ids[node], score) for (_, node), score in zip(found, scores)]
+
+    # ----------------- graph primitives ------------------
+
+    def _distances(self, g: _Graph, vec: np.ndarray, nodes: List[int]) -> np.ndarray:
+        return self._metric.distances(self._codec.unpack(g.rows[nodes]), vec)
+
+    def _greedy(
+        self, g: _Graph, vec: np.ndarray, entry: int, entry_dist: float, level: int
+    ) -> Tuple[int, float]:
+        changed = True
+        while changed:
+            changed = False
+            links = g.neighbors[entry][level]
+            if not links:
+                break
+            dists = self._distances(g, vec, links)
+            best = int(np.argmin(dists))
+            if dists[best] < entry_dist:
+                entry, entry_dist = links[best], float(dists[best])
+                changed = True
+        return entry, entry_dist
+
+    def _search_layer(
+        self,
+        g: _Graph,
+        vec: np.ndarray,
+        entries: List[Tuple[float, int]],
+        ef: int,
+        level: int,
+        live_only: bool,
+        allowed: Optional[Container[UUID]] = None,
+    ) -> List[Tuple[float, int]]:
+        """
+        Best-first beam search on one layer; returns up to ef (distance, node)
+        ascending. With live_only, tombstoned nodes route but are not returned;
+        neither are nodes outside allowed.
+        """
+        visited = {node for _, node in entries}
+        candidates = list(entries)
+        heapq.heapify(candidates)
+        # max-heap of (-distance, node)
+        results = [
+            (-dist, node) for dist, node in entries
+            if not (live_only and g.deleted[node])
+            and (allowed is None or g.ids[node] in allowed)
+        ]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if len(results) >= ef and dist > -results[0][0]:
+                break
+            links = [n for n in g.neighbors[node][level] if n not in visited]
+            if not links:
+                continue
+            visited.update(links)
+            dists = self._distances(g, vec, links)
+            for d, other in zip(dists.tolist(), links):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, other))
+                    # re-read: a concurrent insert may have grown the array
+                    if live_only and g.deleted[other]:
+                        continue
+                    if allowed is not None and g.ids[other] not in allowed:
+                        continue
+                    heapq.heappush(results, (-d, other))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted((-neg, node) for neg, node in results)
+
+    def _select(self, g: _Graph, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """
+        Neighbour-selection heuristic: keep a candidate only if it is closer to
+        the base than to every neighbour already kept, which spreads links
+        across clusters. Pads with the nearest pruned candidates up to m.
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        vecs = self._codec.unpack(g.rows[nodes])
+        # all candidate-to-candidate distances in one product
+        pairwise = self._metric.distances(vecs, vecs).tolist()
+
+        kept: List[int] = []
+        pruned: List[int] = []
+        for i, (dist, _) in enumerate(candidates):
+            if len(kept) >= m:
+                break
+            row = pairwise[i]
+            if any(row[j] < dist for j in kept):
+                pruned.append(i)
+            else:
+                kept.append(i)
+        return [nodes[i] for i in kept + pruned[:m - len(kept)]]
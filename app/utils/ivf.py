@@ -0,0 +1,342 @@
+import logging
+import math
+import threading
+from typing import Any, Container, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from .distance import get_metric
+from .knn import brute_force_knn_matrix, merge_top_k, quantized_knn
+from .rows import RowCodec
+
+logger = logging.getLogger(__name__)
+
+def kmeans(
+    vectors: np.ndarray,
+    k: int,
+    iters: int = 20,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Lloyd's k-means on float32 rows. Returns (k, dim) centroids.
+    Empty clusters are re-seeded from random points.
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    k = max(1, min(k, n))
+    centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+    sq = np.einsum("ij,ij->i", vectors, vectors)
+
+    for _ in range(iters):
+        assign = _nearest(vectors, sq, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        counts[empty] = 1
+        updated = sums / counts[:, None]
+        if empty.any():
+            updated[empty] = vectors[rng.choice(n, size=int(empty.sum()), replace=False)]
+        shift = float(np.max(np.abs(updated - centroids)))
+        centroids = updated.astype(np.float32)
+        if shift < 1e-4:
+            break
+    return centroids
+
+
+def _nearest(
+    vectors: np.ndarray, sq: np.ndarray, centroids: np.ndarray, block: int = 8192
+) -> np.ndarray:
+    """Index of the nearest centroid (L2) for every row, in blocks to bound memory"""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(vectors.shape[0], dtype=np.intp)
+    for start in range(0, vectors.shape[0], block):
+        part = vectors[start:start + block]
+        d = sq[start:start + block, None] - 2.0 * (part @ centroids.T) + c_sq[None, :]
+        out[start:start + block] = np.argmin(d, axis=1)
+    return out
+
+
+class _PostingList:
+    """Append-only rows (float32 vectors or codes) of one cluster, with norms and tombstones"""
+    __slots__ = ("rows", "norms", "alive", "ids", "size", "dead")
+
+    def __init__(self, rows: np.ndarray):
+        self.rows = rows[:0]
+        self.norms = np.empty(0, dtype=np.float32)
+        self.alive = np.empty(0, dtype=bool)
+        self.ids: List[UUID] = []
+        self.size = 0
+        self.dead = 0
+
+    def append(self, chunk_id: UUID, stored: np.ndarray, norm: float) -> int:
+        row = self.size
+        if row == self.rows.shape[0]:
+            capacity = max(16, row * 2)
+            rows = np.empty((capacity, self.rows.shape[1]), dtype=self.rows.dtype)
+            norms = np.empty(capacity, dtype=np.float32)
+            alive = np.zeros(capacity, dtype=bool)
+            rows[:row], norms[:row], alive[:row] = self.rows[:row], self.norms[:row], self.alive[:row]
+            self.rows, self.norms, self.alive = rows, norms, alive
+        self.rows[row] = stored
+        self.norms[row] = norm
+        self.alive[row] = True
+        self.ids.append(chunk_id)
+        self.size += 1
+        return row
+
+
+class _State:
+    __slots__ = ("centroids", "lists", "where", "trained")
+
+    def __init__(self, centroids: np.ndarray, rows: np.ndarray, trained: bool = False):
+        self.centroids = centroids
+        # k-means ran (the threshold was met), whatever nlist it ended up with
+        self.trained = trained
+        self.lists = [_PostingList(rows) for _ in range(centroids.shape[0])]
+        # chunk id -> (list, row)
+        self.where: Dict[UUID, Tuple[int, int]] = {}
+
+
+class IVFIndex:
+    """
+    Inverted-file index: k-means centroids partition a library's embeddings
+    into nlist posting lists, and a query scans only the nprobe lists whose
+    centroids are nearest. Memory overhead is one centroid matrix plus ids.
+
+    - Untrained (fewer than train_threshold vectors) it is a single list, i.e.
+      an exact scan; crossing the threshold trains it in a background thread
+      (if training fails it stays a single list and retries after another
+      train_threshold inserts).
+    - New chunks go to their nearest centroid; deletes are tombstoned.
+    - Clustering runs on the metric's prepared vectors (unit vectors for
+      cosine); rows keep raw vectors and are scored with the same kernels as
+      brute force, so scores match it. Given the library's quantizer, rows
+      keep its codes instead and lists are scanned like a compressed library.
+    """
+
+    def __init__(
+        self,
+        metric: str = "cosine",
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        train_threshold: int = 10000,
+        seed: int = 0,
+        quantizer: Optional[Any] = None,
+    ):
+        self.metric = metric
+        self._metric = get_metric(metric)
+        self._codec = RowCodec(quantizer=quantizer)
+        self.requested_nlist = nlist
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # why finish_build failed, re-raised to searches waiting on it
+        self._error: Optional[Exception] = None
+        self._state: Optional[_State] = None
+        self._pending: Optional[Tuple[List[UUID], np.ndarray]] = None
+        self._rebuild_log: Optional[List[Tuple[str, UUID, Optional[np.ndarray]]]] = None
+        # inserts left before a failed training is retried
+        self._backoff = 0
+
+    def __len__(self) -> int:
+        state = self._state
+        return 0 if state is None else len(state.where)
+
+    @property
+    def nlist(self) -> int:
+        state = self._state
+        return 0 if state is None else len(state.lists)
+
+    @property
+    def trained(self) -> bool:
+        state = self._state
+        return state is not None and state.trained
+
+    # ----------------- build ------------------
+
+    def begin_build(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        """Start an initial build; mutations from now on are replayed onto it"""
+        with self._lock:
+            self._rebuild_log = []
+            self._pending = (list(ids), np.array(vectors, dtype=np.float32, copy=True))
+
+    def finish_build(self) -> None:
+        try:
+            ids, vectors = self._pending
+            self._pending = None
+            state = self._train(ids, vectors)
+            with self._lock:
+                self._replay(state)
+                self._state = state
+        except Exception as e:
+            self._error = e
+            raise
+        finally:
+            self._ready.set()
+
+    def build(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        self.begin_build(ids, vectors)
+        self.finish_build()
+
+    def _train(self, ids: List[UUID], vectors: np.ndarray) -> _State:
+        n = len(ids)
+        dim = vectors.shape[1]
+        trained = n >= max(self.train_threshold, 1)
+        if trained:
+            nlist = self.requested_nlist or max(1, int(4 * math.sqrt(n)))
+            # k-means on a bounded sample; 256 points per centroid is plenty
+            rng = np.random.default_rng(self.seed)
+            sample = vectors
+            if n > 256 * nlist:
+                sample = vectors[rng.choice(n, size=256 * nlist, replace=False)]
+            centroids = kmeans(self._unit(sample), nlist, seed=self.seed)
+        else:
+            centroids = np.zeros((1, dim), dtype=np.float32)
+
+        rows = self._codec.pack(vectors)
+        state = _State(centroids, rows, trained)
+        if n:
+            unit = self._unit(vectors)
+            assign = _nearest(unit, np.einsum("ij,ij->i", unit, unit), centroids)
+            norms = np.linalg.norm(self._codec.unpack(rows), axis=1)
+            for chunk_id, stored, norm, lst in zip(ids, rows, norms, assign.tolist()):
+                state.where[chunk_id] = (lst, state.lists[lst].append(chunk_id, stored, norm))
+        return state
+
+    def _replay(self, state: _State) -> None:
+        log, self._rebuild_log = self._rebuild_log or [], None
+        for op, chunk_id, vec in log:
+            self._delete(state, chunk_id)
+            if op == "add":
+                self._insert(state, chunk_id, vec)
+
+    def _unit(self, vectors: np.ndarray) -> np.ndarray:
+        return self._metric.prepare(vectors) if self._metric.normalize else vectors
+
+    # ----------------- mutation ------------------
+
+    def add(self, chunk_id: UUID, vector: Sequence[float]) -> None:
+        vec = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(("add", chunk_id, vec))
+            if self._state is not None:
+                self._delete(self._state, chunk_id)
+                self._insert(self._state, chunk_id, vec)
+                self._maybe_train()
+
+    def remove(self, chunk_id: UUID) -> None:
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(("remove", chunk_id, None))
+            if self._state is not None:
+                self._delete(self._state, chunk_id)
+
+    def _insert(self, state: _State, chunk_id: UUID, vec: np.ndarray) -> None:
+        if vec.shape[0] != state.centroids.shape[1]:
+            raise ValueError(
+                f"Embedding dimension {vec.shape[0]} does not match index dimension {state.centroids.shape[1]}"
+            )
+        unit = self._unit(vec[None, :])
+        lst = int(_nearest(unit, np.einsum("ij,ij->i", unit, unit), state.centroids)[0])
+        stored = self._codec.pack(vec[None, :])
+        norm = float(np.linalg.norm(self._codec.unpack(stored)[0]))
+        state.where[chunk_id] = (lst, state.lists[lst].append(chunk_id, stored[0], norm))
+
+    def _delete(self, state: _State, chunk_id: UUID) -> None:
+        loc = state.where.pop(chunk_id, None)
+        if loc is not None:
+            posting = state.lists[loc[0]]
+            posting.alive[loc[1]] = False
+            posting.dead += 1
+
+    def _maybe_train(self) -> None:
+        state = self._state
+        if self._rebuild_log is not None or self.trained:
+            return
+        if self._backoff:
+            self._backoff -= 1
+            return
+        if len(state.where) < self.train_threshold:
+            return
+        posting = state.lists[0]
+        live = np.flatnonzero(posting.alive[:posting.size])
+        ids = [posting.ids[row] for row in live]
+        vectors = self._codec.unpack(posting.rows[live])
+        self._rebuild_log = []
+
+        def train() -> None:
+            # every mutation since also reached the single list, so on failure it keeps serving
+            try:
+                trained = self._train(ids, vectors)
+            except Exception:
+                logger.exception("ivf training on %d vectors failed", len(ids))
+                with self._lock:
+                    self._rebuild_log = None
+                    self._backoff = max(self.train_threshold, 1)
+                return
+            with self._lock:
+                self._replay(trained)
+                self._state = trained
+
+        threading.Thread(target=train, name="ivf-train", daemon=True).start()
+
+    # ----------------- query ------------------
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int,
+        nprobe: Optional[int] = None,
+        allowed: Optional[Container[UUID]] = None,
+    ) -> List[Tuple[UUID, float]]:
+        """
+        Up to k (chunk_id, score) from the nprobe nearest lists, best first;
+        only chunks in allowed when given
+        """
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        state = self._state
+        q = np.asarray(query, dtype=np.float32)
+        if q.shape[0] != state.centroids.shape[1]:
+            raise ValueError(
+                f"Query dimension {q.shape[0]} does not match embedding dimension {state.centroids.shape[1]}"
+            )
+
+        nprobe = min(nprobe or self.nprobe, len(state.lists))
+        unit = self._unit(q[None, :])[0]
+        c_dist = np.einsum("ij,ij->i", state.centroids, state.centroids) - 2.0 * (state.centroids @ unit)
+        probe = np.argpartition(c_dist, nprobe - 1)[:nprobe] if nprobe < len(state.lists) else range(len(state.lists))
+
+        # per probed list: its top-k ids and scores, merged by selection at the end
+        found_ids: List[UUID] = []
+        found_scores: List[np.ndarray] = []
+        for lst in probe:
+            posting = state.lists[int(lst)]
+            n = posting.size
+            if n == 0:
+                continue
+            ids = posting.ids
+            mask = posting.alive[:n].copy() if posting.dead else None
+            if allowed is not None:
+                keep = np.fromiter((cid in allowed for cid in ids[:n]), dtype=bool, count=n)
+                mask = keep if mask is None else mask & keep
+            quantizer = self._codec.quantizer
+            if quantizer is None:
+                rows, scores = brute_force_knn_matrix(
+                    q, posting.rows[:n], posting.norms[:n], k, self.metric, mask
+                )
+            else:
+                rows, scores = quantized_knn(
+                    q, posting.rows[:n], posting.norms[:n], quantizer, k, self.metric, mask
+                )
+            found_ids.extend(ids[row] for row in rows.tolist())
+            found_scores.append(scores)
+
+        best, merged = merge_top_k(found_scores, k, self.metric)
+        return [(found_ids[i], score) for i, score in zip(best.tolist(), merged.tolist())]
@@ -1,167 +1,161 @@
-import math
-from typing import List, Tuple, Callable, Any
+from typing import List, Tuple, Any, Optional
 from uuid import UUID
 
-import heapq
-import random
+import numpy as np
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    """dot(a,b) / (||a|| * ||b||)"""
-    dot = 0.0
-    sum_sq_a = 0.0
-    sum_sq_b = 0.0
-    for i in range(len(a)):
-        x = a[i]
-        y = b[i]
-        dot += x * y
-        sum_sq_a += x * x
-        sum_sq_b += y * y
-
-    if sum_sq_a == 0.0 or sum_sq_b == 0.0:
-        return 0.0
-
-    norm = math.sqrt(sum_sq_a) * math.sqrt(sum_sq_b)
-    return dot/norm
-
-def l2_distance(
-    a: List[float],
-    b: List[float],
-) -> float:
-    total = 0.0
-    for i in range(len(a)):
-        diff = a[i] - b[i]
-        total += diff * diff
-
-    return math.sqrt(total)
+from .distance import Metric, get_metric
+from .topk import top_k_rows
 
 
 def brute_force_knn(
     query: List[float],
     candidates: List[Tuple[UUID, List[float], Any]],
     k: int,
-    metric_fn,
+    metric: str = "cosine",
 ) -> List[Tuple[UUID, float, Any]]:
-    """score every candidate, sort, slice top-k"""
-
-    scores: List[Tuple[UUID, float, Any]] = []
-
-    for item in candidates:
-        item_id, emb, payload = item
-        score = metric_fn(query, emb)
-        scores.append((item_id, score, payload))
-
-    # higher score = better for cosine; lower = better for L2
-    scores.sort(
-        key=lambda triple: triple[1],
-        reverse=(metric_fn is cosine_similarity)
-    )
-
-    result: List[Tuple[UUID, float, Any]] = []
-    upper = k if k < len(scores) else len(scores)
-    for i in range(upper):
-        result.append(scores[i])
-    return result
+    """score every candidate with the metric's batch kernel, keep the top-k"""
+    if not candidates:
+        return []
+    vectors = np.asarray([emb for _, emb, _ in candidates], dtype=np.float64)
+    rows, scores = brute_force_knn_matrix(query, vectors, np.linalg.norm(vectors, axis=1), k, metric)
+    return [
+        (candidates[row][0], score, candidates[row][2])
+        for row, score in zip(rows.tolist(), scores.tolist())
+    ]
 
 
+def brute_force_knn_matrix(
+    query: List[float],
+    vectors: np.ndarray,
+    norms: np.ndarray,
+    k: int,
+    metric: str = "cosine",
+    mask: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every row with one matrix-vector product and select the top-k
+    with argpartition. Returns (row indices, scores), best first.
+    Rows where mask is False are never returned.
+    """
+    q = np.asarray(query, dtype=np.float32)
+    if vectors.shape[0] == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    if q.shape[0] != vectors.shape[1]:
+        raise ValueError(
+            f"Query dimension {q.shape[0]} does not match embedding dimension {vectors.shape[1]}"
+        )
+
+    m = get_metric(metric)
+    scores = m.scores(vectors @ q, norms, float(np.linalg.norm(q)))
+    return _top_k(scores, k, m, mask)
+
+
+def brute_force_knn_batch(
+    queries: np.ndarray,
+    vectors: np.ndarray,
+    norms: np.ndarray,
+    k: int,
+    metric: str = "cosine",
+    mask: Optional[np.ndarray] = None,
+    max_scores: int = 1 << 24,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    brute_force_knn_matrix for many queries: one matrix-matrix product per
+    block of queries (blocks keep the score matrix under max_scores entries).
+    Returns (row indices, scores) per query, best first.
+    """
+    Q = np.asarray(queries, dtype=np.float32)
+    if vectors.shape[0] == 0:
+        return [(np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)) for _ in range(Q.shape[0])]
+    if Q.shape[1] != vectors.shape[1]:
+        raise ValueError(
+            f"Query dimension {Q.shape[1]} does not match embedding dimension {vectors.shape[1]}"
+        )
+
+    m = get_metric(metric)
+    block = max(1, max_scores // vectors.shape[0])
+    results = []
+    for start in range(0, Q.shape[0], block):
+        part = Q[start:start + block]
+        # (queries, rows) scores from one product
+        scores = m.scores(part @ vectors.T, norms[None, :], np.linalg.norm(part, axis=1)[:, None])
+        results.extend(_top_k(row_scores, k, m, mask) for row_scores in scores)
+    return results
 
 
-def build_vptree(
-    items: List[Tuple[UUID, List[float], Any]],
-    dist_fn: Callable[[List[float],List[float]], float]
-):
+def merge_top_k(
+    scores: List[np.ndarray], k: int, metric: str = "cosine"
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Recursively build a VP-Tree node from items.
-    Returns the root node.
+    Combine per-part top-k score arrays (e.g. one per segment) into the
+    overall top-k. Returns (positions in the concatenated scores, scores).
     """
-    if not items:
-        return None
-
-    # 1) pick a random vantage point
-    idx = random.randrange(len(items))
-    vp_id, vp_emb, vp_obj = items[idx]
-    # remove VP from list
-    rest = items[:idx] + items[idx+1:]
-    if not rest:
-        # leaf
-        return VPTreeNode(vp_id, vp_emb, vp_obj, None, None, None)
-
-    # 2) compute distances to VP
-    dlist = [(dist_fn(vp_emb, emb), id_, emb, obj)
-             for (id_, emb, obj) in rest]
-    dlist.sort(key=lambda x: x[0])
-    # 3) split on median
-    m = len(dlist) // 2
-    radius = dlist[m][0]
-    inner_items = [(id_, emb, obj) for (_, id_, emb, obj) in dlist[:m]]
-    outer_items = [(id_, emb, obj) for (_, id_, emb, obj) in dlist[m:]]
-
-    # 4) recurse
-    inner = build_vptree(inner_items, dist_fn)
-    outer = build_vptree(outer_items, dist_fn)
-
-    return VPTreeNode(vp_id, vp_emb, vp_obj, radius, inner, outer)
-
-
-def vptree_knn(
-    root,
+    if not scores:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    merged = np.concatenate(scores)
+    rows = _best_rows(get_metric(metric).keys(merged), k, None)
+    return rows, merged[rows]
+
+
+def quantized_knn(
     query: List[float],
+    codes: np.ndarray,
+    norms: np.ndarray,
+    quantizer,
     k: int,
-    dist_fn: Callable[[List[float],List[float]], float]
-) -> List[Tuple[UUID, float, Any]]:
+    metric: str = "cosine",
+    mask: Optional[np.ndarray] = None,
+    vectors: Optional[np.ndarray] = None,
+    rerank_factor: int = 10,
+    refine_factor: int = 30,
+) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Query the VP-Tree with the given query vector.
-    Returns up to k nearest (id, distance, obj) sorted by distance asc.
+    kNN over compressed rows: approximate scores from the quantizer's
+    asymmetric q·x̂, then (when full-precision vectors are given) an exact
+    re-rank of the best k * rerank_factor candidates. A quantizer with a
+    refine stage (pq) shortlists k * refine_factor instead, re-scored
+    exactly when vectors are given, else from its finer codes.
+    Returns (row indices, scores), best first.
     """
-    if root is None:
-        return []
+    q = np.asarray(query, dtype=np.float32)
+    if codes.shape[0] == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    if q.shape[0] != quantizer.dim:
+        raise ValueError(
+            f"Query dimension {q.shape[0]} does not match embedding dimension {quantizer.dim}"
+        )
+
+    m = get_metric(metric)
+    q_norm = float(np.linalg.norm(q))
+    scores = m.scores(quantizer.dot_scores(q, codes), norms, q_norm)
+    if vectors is None and not quantizer.refines:
+        return _top_k(scores, k, m, mask)
+
+    # a coarse (pq) scan needs the wider shortlist, whichever stage re-scores it
+    rows = _best_rows(m.keys(scores), k * (refine_factor if quantizer.refines else rerank_factor), mask)
+    if vectors is not None:
+        exact_rows, exact_scores = brute_force_knn_matrix(q, vectors[rows], norms[rows], k, metric)
+        return rows[exact_rows], exact_scores
+    fine_rows, fine_scores = _top_k(
+        m.scores(quantizer.refine_dot_scores(q, codes[rows]), norms[rows], q_norm), k, m, None
+    )
+    return rows[fine_rows], fine_scores
+
+
+def _top_k(
+    scores: np.ndarray, k: int, metric: Metric, mask: Optional[np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    # rank on the kernel's scores, convert only the k returned
+    rows = _best_rows(metric.keys(scores), k, mask)
+    return rows, metric.report(scores[rows])
 
-    # max-heap of (-distance, id, obj)
-    heap: List[Tuple[float, UUID, Any]] = []
-
-    def search(node):
-        if node is None:
-            return
-        d = dist_fn(query, node.embedding)
-        # push/poll to keep top-k smallest d
-        if len(heap) < k:
-            heapq.heappush(heap, (-d, node.id, node.obj))
-        else:
-            # worst dist at top of max-heap
-            if d < -heap[0][0]:
-                heapq.heapreplace(heap, (-d, node.id, node.obj))
-
-        # if leaf, done
-        if node.radius is None:
-            return
-
-        # descend promising side first
-        if d < node.radius:
-            # inside ball
-            search(node.inner)
-            # maybe outside
-            if len(heap) < k or d + (-heap[0][0]) >= node.radius:
-                search(node.outer)
-        else:
-            # outside ball
-            search(node.outer)
-            # maybe inside
-            if len(heap) < k or d - (-heap[0][0]) <= node.radius:
-                search(node.inner)
-
-    search(root)
-
-    # unpack heap to list, sort by ascending distance
-    results = [ (id_, -neg_d, obj) for (neg_d, id_, obj) in heap ]
-    results.sort(key=lambda x: x[1])
-    return results
 
+def _best_rows(keys: np.ndarray, k: int, mask: Optional[np.ndarray]) -> np.ndarray:
+    # keys ascending = best first; overwritten in place for masked rows
+    if mask is not None:
+        keys[~mask] = np.inf
+        n_valid = int(np.count_nonzero(mask))
+    else:
+        n_valid = keys.shape[0]
 
-class VPTreeNode:
-    __slots__ = ("id", "embedding", "obj", "radius", "inner", "outer")
-    def __init__(self, id, embedding, obj, radius, inner, outer):
-        self.id = id
-        self.embedding = embedding
-        self.obj = obj
-        self.radius = radius
-        self.inner = inner
-        self.outer = outer
\ No newline at end of file
+    return top_k_rows(keys, min(k, n_valid))
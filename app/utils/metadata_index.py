@@ -0,0 +1,116 @@
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+from uuid import UUID
+
+
+# a metadata value as an index term; tagged so that True, 1 and 1.0 stay distinct
+# terms (they hash equal in Python) while 1 and 1.0 compare as the same number
+Term = Tuple[str, Hashable]
+
+
+def term(value: Any) -> Optional[Term]:
+    """Index term of a scalar metadata value, None if the value is not indexable"""
+    if isinstance(value, bool):
+        return ("b", value)
+    if isinstance(value, (int, float)):
+        return ("n", float(value))
+    if isinstance(value, str):
+        return ("s", value)
+    if value is None:
+        return ("z", None)
+    return None
+
+
+def index_terms(metadata: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, Term]]:
+    """
+    (key, term) pairs for a metadata dict. Nested dicts use dotted keys and
+    every scalar element of a list is indexed, so {"tags": ["a", "b"]}
+    matches tags == "a" as well as tags == "b".
+    """
+    for key, value in metadata.items():
+        key = prefix + str(key)
+        if isinstance(value, dict):
+            yield from index_terms(value, key + ".")
+            continue
+        for item in value if isinstance(value, list) else (value,):
+            t = term(item)
+            if t is not None:
+                yield key, t
+
+
+class MetadataIndex:
+    """
+    Inverted index over one library's metadata: key -> term -> members
+    (dicts used as insertion-ordered sets, like the store's other indexes).
+    Not thread-safe; the store updates it under the library's write lock.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[Term, Dict[UUID, None]]] = {}
+
+    def add(self, member: UUID, metadata: Dict[str, Any]) -> None:
+        for key, t in index_terms(metadata):
+            self._postings.setdefault(key, {}).setdefault(t, {})[member] = None
+
+    def remove(self, member: UUID, metadata: Dict[str, Any]) -> None:
+        for key, t in index_terms(metadata):
+            terms = self._postings.get(key)
+            members = None if terms is None else terms.get(t)
+            if members is None:
+                continue
+            members.pop(member, None)
+            if not members:
+                del terms[t]
+                if not terms:
+                    del self._postings[key]
+
+    def equal(self, key: str, value: Any) -> Dict[UUID, None]:
+        t = term(value)
+        if t is None:
+            return {}
+        return self._postings.get(key, {}).get(t, {})
+
+    def range(
+        self,
+        key: str,
+        gt: Optional[float] = None,
+        gte: Optional[float] = None,
+        lt: Optional[float] = None,
+        lte: Optional[float] = None,
+    ) -> Dict[UUID, None]:
+        """Members with a numeric value under key inside the bounds"""
+        found: Dict[UUID, None] = {}
+        for (tag, value), members in self._postings.get(key, {}).items():
+            if tag != "n":
+                continue
+            if gt is not None and not value > gt:
+                continue
+            if gte is not None and not value >= gte:
+                continue
+            if lt is not None and not value < lt:
+                continue
+            if lte is not None and not value <= lte:
+                continue
+            found.update(members)
+        return found
+
+
+def evaluate(expr: Any, leaf: Callable[[Any], Dict[UUID, None]]) -> Dict[UUID, None]:
+    """
+    Members matching a filter expression: and/or nodes combine their children,
+    leaf(expr) resolves a single condition. AND intersects starting from the
+    smallest child so the work stays proportional to the most selective one.
+    """
+    if expr.and_ is not None:
+        parts = sorted((evaluate(child, leaf) for child in expr.and_), key=len)
+        result = dict(parts[0])
+        for part in parts[1:]:
+            if not result:
+                break
+            result = {member: None for member in result if member in part}
+        return result
+    if expr.or_ is not None:
+        result: Dict[UUID, None] = {}
+        for child in expr.or_:
+            result.update(evaluate(child, leaf))
+        return result
+    return leaf(expr)
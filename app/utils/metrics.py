@@ -0,0 +1,139 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+
+# (metric name, labels, value) as rendered in the text exposition format
+Sample = Tuple[str, Dict[str, str], float]
+
+# seconds; from a cached lookup (~10us) up to a slow upstream embed call
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label values. observe() is a bisect and
+    a few increments under a lock, cheap enough for every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+inf last), sum]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][slot] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+        out: List[Sample] = []
+        for key, (counts, total) in values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                out.append((self.name + "_bucket", {**labels, "le": _number(bound)}, cumulative))
+            out.append((self.name + "_sum", labels, total))
+            out.append((self.name + "_count", labels, cumulative))
+        return out
+
+
+class CallbackMetric:
+    """
+    A gauge or counter whose values are read at scrape time from state kept
+    elsewhere (store sizes, cache stats): collect() returns (label values, value) pairs.
+    """
+
+    def __init__(
+        self, name: str, help: str, kind: str, labels: Sequence[str],
+        collect: Callable[[], Sequence[Tuple[Tuple[str, ...], float]]],
+    ):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._collect()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        # re-registering a name (module reload) replaces the old metric
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    rendered = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{rendered}}} {_number(value)}")
+                else:
+                    lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+
+# shared instruments, observed on the hot paths; scrape-time metrics are
+# registered by service/metrics_service.py
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "vectordb_stage_seconds",
+    "Time spent per request stage (embed, candidate_fetch, index_lookup, scoring, serialize, insert)",
+    ["stage"],
+))
+LOCK_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "vectordb_lock_wait_seconds",
+    "Time spent waiting for a store library lock",
+    ["mode"],
+))
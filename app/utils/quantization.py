@@ -0,0 +1,172 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+from .ivf import kmeans
+
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantization: each dimension is mapped linearly from its
+    trained [min, max] range onto 0..255 (rows outside it are clamped). One byte per dimension (4x smaller
+    than float32). Queries stay float32 (asymmetric), so q·x̂ is exact for the
+    reconstructed x̂: q·x̂ = q·lo + (q*scale)·codes.
+    """
+
+    name = "int8"
+    # scores from dot_scores are final; no shortlist re-scoring stage
+    refines = False
+
+    def __init__(self):
+        self.lo: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def dim(self) -> int:
+        return self.lo.shape[0]
+
+    @property
+    def code_width(self) -> int:
+        return self.dim
+
+    def train(self, vectors: np.ndarray) -> None:
+        # the sample's full range plus 5% each side: clamping rows (clipped
+        # tails, or later rows outside the sample) costs more recall than the
+        # slightly coarser step
+        lo = vectors.min(axis=0)
+        width = np.maximum(vectors.max(axis=0) - lo, 1e-12)
+        self.lo = (lo - 0.05 * width).astype(np.float32)
+        self.scale = (1.1 * width / 255.0).astype(np.float32)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Trained parameters, for snapshots (codes only decode with the quantizer that made them)"""
+        return {"lo": self.lo, "scale": self.scale}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.lo = np.asarray(state["lo"], dtype=np.float32)
+        self.scale = np.asarray(state["scale"], dtype=np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.lo) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.lo + codes.astype(np.float32) * self.scale
+
+    def dot_scores(self, query: np.ndarray, codes: np.ndarray, block: int = 16384) -> np.ndarray:
+        """q·x̂ for every code row, in blocks to bound the float32 temporary"""
+        bias = float(query @ self.lo)
+        weights = (query * self.scale).astype(np.float32)
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], block):
+            out[start:start + block] = codes[start:start + block].astype(np.float32) @ weights
+        out += bias
+        return out
+
+
+class ProductQuantizer:
+    """
+    Product quantization with an int8 refine stage. The vector is split into
+    m sub-vectors of sub_dim dims and each is replaced by the id of its
+    nearest of 256 k-means centroids (m bytes), followed by the vector's
+    int8 scalar codes (dim bytes), so a row costs dim + m bytes.
+
+    Scans score the PQ part with asymmetric distance tables
+    (table[j, c] = q_j · centroid_j[c], summed over j), then re-score a
+    shortlist from the int8 part (refine_dot_scores). PQ codes alone give
+    recall@10 of only ~0.5-0.7; the refine brings it to that of int8 while
+    keeping every row compressed. Decoding uses the int8 part.
+    """
+
+    name = "pq"
+    refines = True
+
+    def __init__(self, sub_dim: int = 4, ksub: int = 256):
+        self.sub_dim = sub_dim
+        self.ksub = ksub
+        self.dim: Optional[int] = None
+        # (m, ksub, sub_dim)
+        self.centroids: Optional[np.ndarray] = None
+        self.fine = ScalarQuantizer()
+
+    @property
+    def m(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def code_width(self) -> int:
+        return self.m + self.dim
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        # zero-pad so the dimension divides evenly: (n, m, sub_dim)
+        n, d = vectors.shape
+        m = -(-d // self.sub_dim)
+        if m * self.sub_dim != d:
+            vectors = np.pad(vectors, ((0, 0), (0, m * self.sub_dim - d)))
+        return vectors.reshape(n, m, self.sub_dim)
+
+    def train(self, vectors: np.ndarray) -> None:
+        self.dim = vectors.shape[1]
+        parts = self._split(vectors.astype(np.float32))
+        ksub = min(self.ksub, vectors.shape[0])
+        self.centroids = np.stack([
+            _pad_rows(kmeans(np.ascontiguousarray(parts[:, j, :]), ksub, iters=10, seed=j), self.ksub)
+            for j in range(parts.shape[1])
+        ])
+        self.fine.train(vectors)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"dim": np.array(self.dim), "centroids": self.centroids, **self.fine.state()}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.dim = int(state["dim"])
+        self.centroids = np.asarray(state["centroids"], dtype=np.float32)
+        self.sub_dim = self.centroids.shape[2]
+        self.ksub = self.centroids.shape[1]
+        self.fine.load_state(state)
+
+    def encode(self, vectors: np.ndarray, block: int = 8192) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        c_sq = np.einsum("mks,mks->mk", self.centroids, self.centroids)
+        codes = np.empty((vectors.shape[0], self.code_width), dtype=np.uint8)
+        for start in range(0, vectors.shape[0], block):
+            parts = self._split(vectors[start:start + block])
+            # one sub-space at a time: the temporary is (block, ksub), whatever the dimension.
+            # |p - c|^2 without the |p|^2 term, which doesn't change the argmin
+            for j in range(self.m):
+                d = c_sq[j][None, :] - 2.0 * (parts[:, j, :] @ self.centroids[j].T)
+                codes[start:start + block, j] = np.argmin(d, axis=1)
+            codes[start:start + block, self.m:] = self.fine.encode(vectors[start:start + block])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.fine.decode(codes[:, self.m:])
+
+    def dot_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate q·x for every code row via one (m, 256) lookup table over the PQ part"""
+        q = self._split(np.asarray(query, dtype=np.float32)[None, :])[0]
+        table = np.einsum("mkd,md->mk", self.centroids, q)
+        out = np.zeros(codes.shape[0], dtype=np.float32)
+        for j in range(self.m):
+            out += table[j][codes[:, j]]
+        return out
+
+    def refine_dot_scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """q·x̂ from the int8 part, for re-scoring a shortlist"""
+        return self.fine.dot_scores(np.asarray(query, dtype=np.float32), codes[:, self.m:])
+
+
+def _pad_rows(centroids: np.ndarray, rows: int) -> np.ndarray:
+    # fewer training points than centroids: repeat so every code stays valid
+    if centroids.shape[0] >= rows:
+        return centroids
+    reps = -(-rows // centroids.shape[0])
+    return np.tile(centroids, (reps, 1))[:rows]
+
+
+def make_quantizer(kind: str, pq_sub_dim: int = 4):
+    if kind == "int8":
+        return ScalarQuantizer()
+    if kind == "pq":
+        return ProductQuantizer(sub_dim=pq_sub_dim)
+    raise ValueError(f"Unknown compression {kind!r}")
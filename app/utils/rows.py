@@ -0,0 +1,41 @@
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+
+class RowCodec:
+    """
+    How a search index keeps its rows.
+
+    - No quantizer: float32 rows, passed through prepare when given (e.g.
+      unit length for cosine). unpack() returns them as they are.
+    - With the library's quantizer (a compressed library keeping codes only):
+      its uint8 codes, so the index holds no float32 copy of the library.
+      Rows are decoded, then prepared, only when they are scored.
+    """
+
+    def __init__(
+        self,
+        prepare: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+        quantizer: Optional[Any] = None,
+    ):
+        self.prepare = prepare
+        self.quantizer = quantizer
+
+    def pack(self, vectors: np.ndarray) -> np.ndarray:
+        """Rows to store for (n, dim) raw vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.quantizer is not None:
+            return self.quantizer.encode(vectors)
+        return vectors if self.prepare is None else self.prepare(vectors)
+
+    def unpack(self, rows: np.ndarray) -> np.ndarray:
+        """Prepared float32 vectors for stored rows"""
+        if self.quantizer is None:
+            return rows
+        vectors = self.quantizer.decode(rows)
+        return vectors if self.prepare is None else self.prepare(vectors)
+
+    def dim(self, rows: np.ndarray) -> int:
+        """Embedding dimension of stored rows (codes are wider or narrower than it)"""
+        return rows.shape[1] if self.quantizer is None else self.quantizer.dim
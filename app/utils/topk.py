@@ -0,0 +1,65 @@
+import heapq
+import math
+from typing import Any, List, Tuple
+
+import numpy as np
+
+
+def top_k_rows(keys: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k smallest keys, best first, in O(N + k log k): one
+    argpartition finds the k-th key, one pass collects the rows up to it and
+    only those are sorted. Ties are broken by index, so equal keys at the
+    cut-off always resolve the same way. k >= N returns every index.
+    """
+    n = keys.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k == n:
+        return np.argsort(keys, kind="stable")
+    kth = keys[np.argpartition(keys, k - 1)[k - 1]]
+    if kth != kth:
+        # NaN at the cut-off: fewer than k comparable keys, NaNs rank last
+        return np.argsort(keys, kind="stable")[:k]
+    # ascending indices, so a stable sort by key leaves ties in index order
+    rows = np.flatnonzero(keys <= kth)
+    return rows[np.argsort(keys[rows], kind="stable")[:k]]
+
+
+class TopK:
+    """
+    The k best items of a stream by ascending key, for paths that produce
+    candidates one at a time (tree and graph traversals). A fixed-size
+    max-heap: O(log k) per accepted offer, never more than k entries. On equal
+    keys the earlier offer wins, so results do not depend on heap layout.
+    """
+
+    __slots__ = ("k", "bound", "_heap", "_seq")
+
+    def __init__(self, k: int):
+        self.k = max(k, 0)
+        # key an offer has to beat to get in: +inf until k items are held
+        self.bound = math.inf if self.k else -math.inf
+        # (-key, -arrival, item): the root is the worst entry, latest on ties
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def offer(self, key: float, item: Any) -> bool:
+        if key >= self.bound:
+            return False
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, (-key, -self._seq, item))
+        else:
+            heapq.heapreplace(self._heap, (-key, -self._seq, item))
+        self._seq += 1
+        if len(self._heap) == self.k:
+            self.bound = -self._heap[0][0]
+        return True
+
+    def items(self) -> List[Tuple[float, Any]]:
+        """(key, item) pairs, best first"""
+        return [(-neg_key, item) for neg_key, _, item in sorted(self._heap, reverse=True)]
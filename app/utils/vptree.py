@@ -0,0 +1,337 @@
+import logging
+import threading
+from typing import Any, Container, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from .distance import get_metric
+from .rows import RowCodec
+from .topk import TopK
+
+logger = logging.getLogger(__name__)
+
+class VPTreeIndex:
+    """
+    Persistent VP-Tree over one library's embeddings for one metric.
+
+    - The tree is built once over a private float32 copy of the vectors,
+      permuted so each leaf bucket is a contiguous block scored in one shot.
+      Given the library's quantizer, it keeps that quantizer's codes instead
+      and decodes a bucket when scoring it.
+    - Inserts land in a small delta buffer that is brute-forced next to the tree.
+    - Deletes (and the old version of updated chunks) are tombstoned.
+    - Once the delta or tombstones pass a threshold the tree is rebuilt in a
+      background thread; mutations made meanwhile are replayed onto the new tree.
+      If that rebuild fails the old tree and delta keep serving, and it is
+      retried after another min_rebuild mutations.
+
+    The tree prunes on L2 between the metric's prepared vectors, so it serves
+    metric-space metrics only: l2/l2_squared directly and cosine as L2 over
+    unit vectors (a true metric, so pruning is valid). Distances are mapped
+    back to scores by the metric. Raw dot product is rejected.
+    """
+
+    def __init__(
+        self,
+        metric: str = "cosine",
+        leaf_size: int = 64,
+        rebuild_ratio: float = 0.1,
+        min_rebuild: int = 256,
+        seed: int = 0,
+        quantizer: Optional[Any] = None,
+    ):
+        self.metric = metric
+        self._metric = get_metric(metric)
+        if not self._metric.metric_space:
+            raise ValueError(f"vptree cannot serve metric {metric!r}: it is not a metric space")
+        self._codec = RowCodec(self._metric.prepare, quantizer)
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # why finish_build failed, re-raised to searches waiting on it
+        self._error: Optional[Exception] = None
+
+        # tree arrays; rows (prepared vectors, or codes) are in leaf order
+        self._ids: List[UUID] = []
+        self._row_of: Dict[UUID, int] = {}
+        self._rows = np.empty((0, 0), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        # per node: vantage row, radius, inner/outer child, leaf bucket [lo, hi)
+        self._vp: List[int] = []
+        self._radius: List[float] = []
+        self._inner: List[int] = []
+        self._outer: List[int] = []
+        self._lo: List[int] = []
+        self._hi: List[int] = []
+
+        # chunk id -> stored row
+        self._delta: Dict[UUID, np.ndarray] = {}
+        self._delta_cache: Optional[Tuple[List[UUID], np.ndarray]] = None
+        self._dead = 0
+        # mutations recorded while a rebuild is running, replayed on swap
+        self._rebuild_log: Optional[List[Tuple[str, UUID, Optional[np.ndarray]]]] = None
+        # mutations left before a failed background rebuild is retried
+        self._backoff = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ids) - self._dead + len(self._delta)
+
+    # ----------------- build ------------------
+
+    def begin_build(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        """Start an initial build; mutations from now on are replayed onto it"""
+        with self._lock:
+            self._rebuild_log = []
+            self._pending = (list(ids), self._codec.pack(vectors))
+
+    def finish_build(self) -> None:
+        """Build the tree for the pending item set and swap it in"""
+        try:
+            ids, rows = self._pending
+            self._pending = None
+            built = self._build(ids, rows)
+            with self._lock:
+                self._swap(built)
+        except Exception as e:
+            self._error = e
+            raise
+        finally:
+            self._ready.set()
+
+    def build(self, ids: Sequence[UUID], vectors: np.ndarray) -> None:
+        self.begin_build(ids, vectors)
+        self.finish_build()
+
+    def _build(self, ids: List[UUID], stored: np.ndarray):
+        # decoded in full only while building; the tree keeps the rows as stored
+        vectors = self._codec.unpack(stored)
+        n = len(ids)
+        vp: List[int] = []
+        radius: List[float] = []
+        inner: List[int] = []
+        outer: List[int] = []
+        lo: List[int] = []
+        hi: List[int] = []
+        order: List[np.ndarray] = []
+        placed = 0
+
+        def new_node() -> int:
+            vp.append(-1)
+            radius.append(0.0)
+            inner.append(-1)
+            outer.append(-1)
+            lo.append(0)
+            hi.append(0)
+            return len(vp) - 1
+
+        # explicit stack so deep/degenerate trees can't hit the recursion limit;
+        # children are pushed outer-then-inner so leaves are placed in tree order
+        root = new_node() if n else -1
+        stack: List[Tuple[int, np.ndarray]] = [(root, np.arange(n))] if n else []
+        pending_vp: List[Tuple[int, int]] = []
+        while stack:
+            node, rows = stack.pop()
+            if len(rows) <= self.leaf_size:
+                lo[node] = placed
+                placed += len(rows)
+                hi[node] = placed
+                order.append(rows)
+                continue
+
+            pick = int(self._rng.integers(len(rows)))
+            vp_row = int(rows[pick])
+            rest = np.delete(rows, pick)
+            diff = vectors[rest] - vectors[vp_row]
+            dist = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+            m = len(rest) // 2
+            part = np.argpartition(dist, m)
+            radius[node] = float(dist[part[m]])
+            pending_vp.append((node, vp_row))
+
+            inner[node] = new_node()
+            outer[node] = new_node()
+            stack.append((outer[node], rest[part[m:]]))
+            stack.append((inner[node], rest[part[:m]]))
+
+        # vantage points are stored after all leaf rows
+        vp_rows = np.array([row for _, row in pending_vp], dtype=np.intp)
+        perm = np.concatenate(order + [vp_rows]) if n else np.empty(0, dtype=np.intp)
+        for i, (node, _) in enumerate(pending_vp):
+            vp[node] = placed + i
+
+        tree_vectors = vectors[perm]
+        tree_ids = [ids[row] for row in perm]
+        return (
+            tree_ids,
+            stored[perm],
+            np.einsum("ij,ij->i", tree_vectors, tree_vectors),
+            (vp, radius, inner, outer, lo, hi),
+        )
+
+    def _swap(self, built) -> None:
+        ids, rows, sq_norms, nodes = built
+        self._ids = ids
+        self._row_of = {cid: row for row, cid in enumerate(ids)}
+        self._rows = rows
+        self._sq_norms = sq_norms
+        self._alive = np.ones(len(ids), dtype=bool)
+        self._vp, self._radius, self._inner, self._outer, self._lo, self._hi = nodes
+        self._dead = 0
+        self._delta = {}
+        self._delta_cache = None
+
+        log, self._rebuild_log = self._rebuild_log or [], None
+        for op, chunk_id, row in log:
+            self._tombstone(chunk_id)
+            self._delta.pop(chunk_id, None)
+            if op == "add":
+                self._delta[chunk_id] = row
+
+    # ----------------- mutation ------------------
+
+    def add(self, chunk_id: UUID, vector: Sequence[float]) -> None:
+        row = self._codec.pack(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        with self._lock:
+            self._tombstone(chunk_id)
+            self._delta[chunk_id] = row
+            self._delta_cache = None
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(("add", chunk_id, row))
+            self._maybe_rebuild()
+
+    def remove(self, chunk_id: UUID) -> None:
+        with self._lock:
+            self._tombstone(chunk_id)
+            if self._delta.pop(chunk_id, None) is not None:
+                self._delta_cache = None
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(("remove", chunk_id, None))
+            self._maybe_rebuild()
+
+    def _tombstone(self, chunk_id: UUID) -> None:
+        row = self._row_of.get(chunk_id)
+        if row is not None and self._alive[row]:
+            self._alive[row] = False
+            self._dead += 1
+
+    def _maybe_rebuild(self) -> None:
+        if self._rebuild_log is not None:
+            return
+        if self._backoff:
+            self._backoff -= 1
+            return
+        threshold = max(self.min_rebuild, int(len(self._ids) * self.rebuild_ratio))
+        if len(self._delta) < threshold and self._dead < threshold:
+            return
+
+        live = np.flatnonzero(self._alive)
+        ids = [self._ids[row] for row in live] + list(self._delta)
+        rows = self._rows[live]
+        if self._delta:
+            rows = np.vstack([rows, np.stack(list(self._delta.values()))])
+        self._rebuild_log = []
+        threading.Thread(target=self._rebuild, args=(ids, rows), name="vptree-rebuild", daemon=True).start()
+
+    def _rebuild(self, ids: List[UUID], rows: np.ndarray) -> None:
+        # unlike the initial build, a failure here is not fatal: every mutation
+        # since also reached the current tree and delta, which keep serving
+        try:
+            built = self._build(ids, rows)
+        except Exception:
+            logger.exception("vptree rebuild of %d vectors failed", len(ids))
+            with self._lock:
+                self._rebuild_log = None
+                self._backoff = self.min_rebuild
+            return
+        with self._lock:
+            self._swap(built)
+
+    # ----------------- query ------------------
+
+    def search(
+        self, query: Sequence[float], k: int, allowed: Optional[Container[UUID]] = None
+    ) -> List[Tuple[UUID, float]]:
+        """Up to k nearest (chunk_id, score), best first; only chunks in allowed when given"""
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        q = self._metric.prepare(np.asarray(query, dtype=np.float32)[None, :])[0]
+        if self._rows.shape[0] and q.shape[0] != self._codec.dim(self._rows):
+            raise ValueError(
+                f"Query dimension {q.shape[0]} does not match embedding dimension {self._codec.dim(self._rows)}"
+            )
+
+        with self._lock:
+            # grab consistent references; a background swap replaces, never mutates, them
+            ids, rows, sq_norms = self._ids, self._rows, self._sq_norms
+            alive = self._alive.copy() if self._dead else None
+            vp, radius, inner, outer, lo, hi = (
+                self._vp, self._radius, self._inner, self._outer, self._lo, self._hi
+            )
+            delta = self._delta_arrays()
+
+        q_sq = float(q @ q)
+        unpack = self._codec.unpack
+        # best k (distance, chunk_id) so far; its bound prunes the traversal
+        top = TopK(k)
+
+        def distances(lo_row: int, hi_row: int) -> np.ndarray:
+            dots = unpack(rows[lo_row:hi_row]) @ q
+            return np.sqrt(np.maximum(sq_norms[lo_row:hi_row] - 2.0 * dots + q_sq, 0.0))
+
+        def offer(lo_row: int, dist: np.ndarray) -> None:
+            # only rows beating the current bound can get in; most of a bucket doesn't
+            for i in np.flatnonzero(dist < top.bound).tolist():
+                row = lo_row + i
+                if alive is not None and not alive[row]:
+                    continue
+                if allowed is not None and ids[row] not in allowed:
+                    continue
+                top.offer(float(dist[i]), ids[row])
+
+        # explicit stack of (node, lower bound on any distance inside it)
+        stack: List[Tuple[int, float]] = [(0, 0.0)] if vp else []
+        while stack:
+            node, bound = stack.pop()
+            if bound > top.bound:
+                continue
+            if inner[node] < 0:
+                offer(lo[node], distances(lo[node], hi[node]))
+                continue
+
+            vp_dist = distances(vp[node], vp[node] + 1)
+            offer(vp[node], vp_dist)
+            d = float(vp_dist[0])
+            r = radius[node]
+            # near side popped first
+            if d < r:
+                stack.append((outer[node], max(r - d, 0.0)))
+                stack.append((inner[node], 0.0))
+            else:
+                stack.append((inner[node], max(d - r, 0.0)))
+                stack.append((outer[node], 0.0))
+
+        if delta is not None:
+            delta_ids, delta_vectors = delta
+            diff = delta_vectors - q
+            d = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+            for i in np.flatnonzero(d < top.bound).tolist():
+                if allowed is None or delta_ids[i] in allowed:
+                    top.offer(float(d[i]), delta_ids[i])
+
+        hits = top.items()
+        scores = self._metric.to_score(np.square([dist for dist, _ in hits])).tolist()
+        return [(cid, score) for (_, cid), score in zip(hits, scores)]
+
+    def _delta_arrays(self) -> Optional[Tuple[List[UUID], np.ndarray]]:
+        if not self._delta:
+            return None
+        if self._delta_cache is None:
+            self._delta_cache = (list(self._delta), self._codec.unpack(np.stack(list(self._delta.values()))))
+        return self._delta_cache
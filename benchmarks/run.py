@@ -0,0 +1,490 @@
+"""
+Benchmark suite: kNN algorithms, store CRUD and end-to-end HTTP search.
+
+    python -m benchmarks.run --n 5000 --dim 128 --out results.json
+    python -m benchmarks.run --suites knn --algorithms brute ivf --datasets clustered
+    python -m benchmarks.run --suites compression --compressions int8
+    python -m benchmarks.run --compare baseline.json results.json
+
+Everything runs in-process against the in-memory store (DATA_DIR is ignored)
+with the deterministic fake embedder, so runs with the same seed see the
+same data. Results are one JSON document; --compare exits non-zero when a
+result regressed past the tolerance, for CI between releases.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID, uuid4
+
+import numpy as np
+
+
+ALGORITHMS = ("brute", "vptree", "hnsw", "ivf")
+METRICS = ("cosine", "dot", "l2", "l2_squared")
+DATASETS = ("uniform", "clustered")
+COMPRESSIONS = ("int8", "pq")
+SUITES = ("knn", "compression", "store", "api")
+
+_INSERT_BATCH = 1000
+
+
+# ----------------- data ------------------
+
+def make_dataset(kind: str, n: int, dim: int, queries: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (vectors, queries) as float32. "uniform" is isotropic Gaussian noise, the
+    worst case for space partitioning; "clustered" draws points around
+    ~sqrt(n) centres with uneven sizes and spreads, closer to real text
+    embeddings. Queries are perturbed data points, so they have near neighbours.
+    """
+    rng = np.random.default_rng(seed)
+    if kind == "uniform":
+        vectors = rng.standard_normal((n, dim))
+    else:
+        n_clusters = max(2, int(math.sqrt(n)))
+        centres = rng.standard_normal((n_clusters, dim)) * 3.0
+        weights = rng.dirichlet(np.ones(n_clusters))
+        labels = rng.choice(n_clusters, size=n, p=weights)
+        spread = rng.uniform(0.3, 1.0, size=n_clusters)[labels, None]
+        vectors = centres[labels] + rng.standard_normal((n, dim)) * spread
+    picks = rng.choice(n, size=queries)
+    noise = rng.standard_normal((queries, dim)) * 0.1 * vectors.std()
+    return vectors.astype(np.float32), (vectors[picks] + noise).astype(np.float32)
+
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, k: int, metric: str) -> List[List[int]]:
+    """
+    Exact top-k rows, the ranking brute_force_knn defines, computed with
+    float64 NumPy in one pass (brute_force_knn itself, which scores through
+    the metric registry, is cross-checked on a few queries).
+    """
+    v = vectors.astype(np.float64)
+    q = queries.astype(np.float64)
+    if metric == "cosine":
+        scores = -(q @ v.T) / np.outer(np.linalg.norm(q, axis=1), np.linalg.norm(v, axis=1))
+    elif metric == "dot":
+        scores = -(q @ v.T)
+    else:
+        scores = (q * q).sum(1)[:, None] - 2 * q @ v.T + (v * v).sum(1)[None, :]
+    top = np.argpartition(scores, min(k, v.shape[0] - 1), axis=1)[:, :k]
+    return [list(row[np.argsort(s[row], kind="stable")]) for row, s in zip(top, scores)]
+
+
+def _check_reference(vectors: np.ndarray, queries: np.ndarray, k: int, metric: str, truth: List[List[int]]) -> None:
+    from app.utils.knn import brute_force_knn
+
+    candidates = [(i, row.tolist(), None) for i, row in enumerate(vectors)]
+    for q, expected in zip(queries[:2], truth):
+        found = {i for i, _, _ in brute_force_knn(q.tolist(), candidates, k, metric)}
+        if len(found & set(expected)) < k - 1:  # allow one tie at the boundary
+            raise RuntimeError(f"ground truth disagrees with brute_force_knn ({metric})")
+
+
+# ----------------- measuring ------------------
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p90": float(np.percentile(ms, 90)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def timed_calls(fn: Callable[[Any], Any], args: Sequence[Any]) -> Tuple[List[float], List[Any], float]:
+    """Run fn once per arg; (per-call seconds, results, wall seconds)"""
+    out, latencies = [], []
+    start = time.perf_counter()
+    for arg in args:
+        t = time.perf_counter()
+        out.append(fn(arg))
+        latencies.append(time.perf_counter() - t)
+    return latencies, out, time.perf_counter() - start
+
+
+class PeakMemory:
+    """Peak Python + NumPy allocations inside the block (tracemalloc), None when disabled"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.peak: Optional[int] = None
+
+    def __enter__(self):
+        if self.enabled:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+# ----------------- suites ------------------
+
+def _new_library(name: str, **fields: Any) -> Tuple[UUID, UUID]:
+    from app.models.document import Document
+    from app.models.library import Library
+    from app.store.in_memory import save_document, save_library
+
+    lib = Library(id=uuid4(), name=name, **fields)
+    save_library(lib)
+    doc = Document(id=uuid4(), library_id=lib.id)
+    save_document(doc)
+    return lib.id, doc.id
+
+
+def _load(library_id: UUID, document_id: UUID, vectors: np.ndarray) -> List[UUID]:
+    from app.models.chunk import Chunk
+    from app.store.in_memory import add_chunks_to_document
+
+    ids = []
+    for start in range(0, len(vectors), _INSERT_BATCH):
+        chunks = [
+            Chunk(id=uuid4(), library_id=library_id, document_id=document_id, text=f"row {start + i}", embedding=row.tolist())
+            for i, row in enumerate(vectors[start:start + _INSERT_BATCH])
+        ]
+        add_chunks_to_document(chunks, document_id)
+        ids.extend(chunk.id for chunk in chunks)
+    return ids
+
+
+def bench_knn(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from app.service.search_service import _run_knn
+    from app.store.in_memory import rebuild_library_index
+    from app.utils.distance import get_metric
+
+    results = []
+    for dataset in args.datasets:
+        vectors, queries = make_dataset(dataset, args.n, args.dim, args.queries, args.seed)
+        library_id, document_id = _new_library(f"bench-{dataset}")
+        ids = _load(library_id, document_id, vectors)
+        row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        for metric in args.metrics:
+            truth = ground_truth(vectors, queries, args.k, metric)
+            _check_reference(vectors, queries, args.k, metric, truth)
+            for algorithm in args.algorithms:
+                if algorithm == "vptree" and not get_metric(metric).metric_space:
+                    continue  # VP-trees need a metric space; dot is rejected
+                params = {"nlist": max(1, int(math.sqrt(args.n))), "train_threshold": 0} if algorithm == "ivf" else {}
+                with PeakMemory(args.memory) as memory:
+                    build = 0.0
+                    if algorithm != "brute":
+                        start = time.perf_counter()
+                        rebuild_library_index(library_id, algorithm, metric, params)
+                        build = time.perf_counter() - start
+                    latencies, hits, wall = timed_calls(
+                        lambda q: _run_knn(library_id, q, args.k, metric, algorithm), queries
+                    )
+                recall = np.mean([
+                    len({row_of[chunk_id] for chunk_id, _ in found} & set(expected)) / args.k
+                    for found, expected in zip(hits, truth)
+                ])
+                results.append({
+                    "id": f"knn/{dataset}/{metric}/{algorithm}",
+                    "suite": "knn",
+                    "dataset": dataset,
+                    "metric": metric,
+                    "algorithm": algorithm,
+                    "n": args.n,
+                    "dim": args.dim,
+                    "k": args.k,
+                    "build_seconds": build,
+                    "latency_ms": latency_summary(latencies),
+                    "qps": len(queries) / wall,
+                    f"recall_at_{args.k}": float(recall),
+                    "peak_memory_bytes": memory.peak,
+                })
+                _progress(results[-1])
+    return results
+
+
+def bench_compression(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Brute-force search over int8 / pq libraries, scanning codes only and
+    with the float32 re-rank rows kept. Reports recall@k against exact
+    ground truth and the bytes the library's matrix holds.
+    """
+    from app.service.search_service import _run_knn
+    from app.store.in_memory import _matrices
+
+    results = []
+    for dataset in args.datasets:
+        vectors, queries = make_dataset(dataset, args.n, args.dim, args.queries, args.seed)
+        truths = {metric: ground_truth(vectors, queries, args.k, metric) for metric in args.metrics}
+        for compression in args.compressions:
+            for rerank in (False, True):
+                library_id, document_id = _new_library(
+                    f"bench-{dataset}-{compression}", compression=compression, rerank=rerank
+                )
+                ids = _load(library_id, document_id, vectors)
+                row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+                for metric in args.metrics:
+                    latencies, hits, wall = timed_calls(
+                        lambda q: _run_knn(library_id, q, args.k, metric, "brute"), queries
+                    )
+                    recall = np.mean([
+                        len({row_of[chunk_id] for chunk_id, _ in found} & set(expected)) / args.k
+                        for found, expected in zip(hits, truths[metric])
+                    ])
+                    results.append({
+                        "id": f"compression/{dataset}/{metric}/{compression}/{'rerank' if rerank else 'codes'}",
+                        "suite": "compression",
+                        "dataset": dataset,
+                        "metric": metric,
+                        "compression": compression,
+                        "rerank": rerank,
+                        "n": args.n,
+                        "dim": args.dim,
+                        "k": args.k,
+                        "latency_ms": latency_summary(latencies),
+                        "qps": len(queries) / wall,
+                        f"recall_at_{args.k}": float(recall),
+                        "matrix_bytes": _matrices[library_id].nbytes,
+                    })
+                    _progress(results[-1])
+    return results
+
+
+def bench_store(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from app.models.chunk import Chunk
+    from app.store.in_memory import add_chunk_to_document, delete_chunk, get_chunk, list_chunks, save_chunk
+
+    vectors, _ = make_dataset("uniform", args.n, args.dim, 1, args.seed)
+    library_id, document_id = _new_library("bench-store")
+    results = []
+
+    def record(op: str, latencies: List[float], wall: float, rows: int) -> None:
+        results.append({
+            "id": f"store/{op}",
+            "suite": "store",
+            "op": op,
+            "n": args.n,
+            "dim": args.dim,
+            "latency_ms": latency_summary(latencies),
+            "rows_per_second": rows / wall,
+        })
+        _progress(results[-1])
+
+    batches = [vectors[start:start + _INSERT_BATCH] for start in range(0, len(vectors), _INSERT_BATCH)]
+    latencies, _, wall = timed_calls(lambda block: _load(library_id, document_id, block), batches)
+    record(f"insert_batch_{_INSERT_BATCH}", latencies, wall, len(vectors))
+
+    singles = vectors[:args.store_ops]
+    chunks = [
+        Chunk(id=uuid4(), library_id=library_id, document_id=document_id, text="single", embedding=row.tolist())
+        for row in singles
+    ]
+    latencies, _, wall = timed_calls(lambda chunk: add_chunk_to_document(chunk, document_id), chunks)
+    record("insert", latencies, wall, len(chunks))
+
+    latencies, _, wall = timed_calls(lambda chunk: get_chunk(chunk.id), chunks)
+    record("get", latencies, wall, len(chunks))
+
+    latencies, _, wall = timed_calls(
+        lambda chunk: save_chunk(chunk.model_copy(update={"metadata": {"updated": True}})), chunks
+    )
+    record("update_metadata", latencies, wall, len(chunks))
+
+    latencies, listed, wall = timed_calls(lambda _: list_chunks(library_id, document_id), range(5))
+    record("list_document", latencies, wall, sum(len(rows) for rows in listed))
+
+    latencies, _, wall = timed_calls(lambda chunk: delete_chunk(chunk.id), chunks)
+    record("delete", latencies, wall, len(chunks))
+    return results
+
+
+def bench_api(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    from fastapi.testclient import TestClient
+    from app.config import Config
+    from app.main import app
+
+    vectors, queries = make_dataset("clustered", args.n, args.dim, args.queries, args.seed)
+    headers = {"x-key": Config.API_KEY}
+    results = []
+    with TestClient(app) as client:
+        library_id = client.post("/libraries", json={"name": "bench-api"}, headers=headers).json()["id"]
+        document_id = client.post(f"/libraries/{library_id}/documents", json={}, headers=headers).json()["id"]
+        start = time.perf_counter()
+        for block_start in range(0, len(vectors), _INSERT_BATCH):
+            block = vectors[block_start:block_start + _INSERT_BATCH]
+            response = client.post(
+                f"/libraries/{library_id}/documents/{document_id}/chunks:bulk",
+                json={"chunks": [{"text": f"row {block_start + i}", "embedding": row.tolist()} for i, row in enumerate(block)]},
+                headers=headers,
+            )
+            response.raise_for_status()
+        results.append({
+            "id": "api/bulk_insert",
+            "suite": "api",
+            "n": args.n,
+            "dim": args.dim,
+            "rows_per_second": len(vectors) / (time.perf_counter() - start),
+        })
+        _progress(results[-1])
+
+        url = f"/libraries/{library_id}/search"
+        for algorithm in args.algorithms:
+            for kind in ("text", "vector"):
+                if kind == "text":
+                    # distinct texts: every request embeds (fake backend) and misses both caches
+                    bodies = [{"text": f"benchmark query {algorithm} {i}"} for i in range(args.queries)]
+                else:
+                    bodies = [{"vector": q.tolist()} for q in queries]
+                bodies = [{**body, "k": args.k, "algorithm": algorithm} for body in bodies]
+                # the first request of an index algorithm pays for its build
+                client.post(url, json=bodies[0], headers=headers).raise_for_status()
+                latencies, responses, wall = timed_calls(lambda body: client.post(url, json=body, headers=headers), bodies[1:])
+                if any(response.status_code != 200 for response in responses):
+                    raise RuntimeError(f"search failed: {responses[0].text}")
+                results.append({
+                    "id": f"api/search/{kind}/{algorithm}",
+                    "suite": "api",
+                    "algorithm": algorithm,
+                    "query": kind,
+                    "n": args.n,
+                    "dim": args.dim,
+                    "k": args.k,
+                    "latency_ms": latency_summary(latencies),
+                    "qps": len(bodies[1:]) / wall,
+                })
+                _progress(results[-1])
+    return results
+
+
+# ----------------- output & comparison ------------------
+
+def _progress(result: Dict[str, Any]) -> None:
+    if "latency_ms" in result:
+        summary = f"p50={result['latency_ms']['p50']:8.3f}ms p99={result['latency_ms']['p99']:8.3f}ms"
+    else:
+        summary = f"{result['rows_per_second']:10.0f} rows/s"
+    print(f"{result['id']:<40} {summary}", file=sys.stderr)
+
+
+def _meta(args: argparse.Namespace) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+    }
+
+
+# metric path -> True when higher is better
+_COMPARED = {
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p99"): False,
+    ("qps",): True,
+    ("rows_per_second",): True,
+    ("build_seconds",): False,
+    ("matrix_bytes",): False,
+}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float, recall_drop: float) -> List[str]:
+    """Regressions of current against baseline, matched by result id"""
+    before = {result["id"]: result for result in baseline["results"]}
+    problems = []
+    for result in current["results"]:
+        old = before.get(result["id"])
+        if old is None:
+            continue
+        for path, higher_is_better in _COMPARED.items():
+            a, b = _dig(old, path), _dig(result, path)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                problems.append(f"{result['id']} {'.'.join(path)}: {a:.4g} -> {b:.4g} ({change:+.0%})")
+        for key in result:
+            if key.startswith("recall_at_") and key in old and result[key] < old[key] - recall_drop:
+                problems.append(f"{result['id']} {key}: {old[key]:.3f} -> {result[key]:.3f}")
+    return problems
+
+
+def _dig(result: Dict[str, Any], path: Tuple[str, ...]) -> Optional[float]:
+    value: Any = result
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n", type=int, default=5000, help="Vectors per dataset")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS))
+    parser.add_argument("--metrics", nargs="+", choices=METRICS, default=["cosine", "dot", "l2"],
+                        help="l2_squared ranks like l2 and is left out by default")
+    parser.add_argument("--datasets", nargs="+", choices=DATASETS, default=list(DATASETS))
+    parser.add_argument("--compressions", nargs="+", choices=COMPRESSIONS, default=list(COMPRESSIONS))
+    parser.add_argument("--store-ops", type=int, default=1000, help="Single-row store operations to time")
+    parser.add_argument("--memory", action="store_true",
+                        help="Record peak allocations per kNN run (tracemalloc slows Python-heavy index builds)")
+    parser.add_argument("--out", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown for --compare")
+    parser.add_argument("--recall-drop", type=float, default=0.01, help="Allowed absolute recall drop for --compare")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        problems = compare(baseline, current, args.tolerance, args.recall_drop)
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} regression(s)", file=sys.stderr)
+        return 1 if problems else 0
+
+    # the app reads its config at import time: memory-only store, offline embedder
+    os.environ.pop("DATA_DIR", None)
+    os.environ["EMBEDDING_BACKEND"] = "fake"
+    os.environ["FAKE_EMBEDDING_DIM"] = str(args.dim)
+    os.environ.setdefault("API_KEY", "bench")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    results: List[Dict[str, Any]] = []
+    for suite, run in (("knn", bench_knn), ("compression", bench_compression), ("store", bench_store), ("api", bench_api)):
+        if suite in args.suites:
+            results.extend(run(args))
+
+    report = json.dumps({"meta": _meta(args), "results": results}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
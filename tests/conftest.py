@@ -0,0 +1,126 @@
+import threading
+from typing import Any, Dict, List, Tuple
+from uuid import uuid4
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app import dependencies
+from app.main import app
+from app.models.chunk import Chunk
+from app.models.document import Document
+from app.models.library import Library
+from app.service.embedding_service import EmbeddingService, FakeBackend, set_embedding_service
+from app.store import in_memory as store
+from app.utils.knn import brute_force_knn_matrix
+
+# module-level tables of the store, emptied around every test
+_TABLES = (
+    "_libraries", "_documents", "_chunks", "_library_documents", "_library_chunks",
+    "_document_chunks", "_chunk_metadata", "_document_metadata", "_unindexed", "_matrices",
+    "_indexes", "_building", "_versions", "_retired",
+)
+
+
+def wipe_store() -> None:
+    """Forget everything in memory, as a process restart would (the data dir is left alone)"""
+    store.close_store()
+    for name in _TABLES:
+        getattr(store, name).clear()
+    store._data_dir = None
+
+
+@pytest.fixture(autouse=True)
+def clean_store():
+    wipe_store()
+    yield
+    wipe_store()
+
+
+@pytest.fixture
+def embedder():
+    """The process-wide embedding service, on an offline 16-dim FakeBackend"""
+    service = EmbeddingService(FakeBackend(dim=16), batch_size=4, coalesce_ms=1)
+    set_embedding_service(service)
+    yield service
+    set_embedding_service(None)
+
+
+@pytest.fixture
+def client(monkeypatch, embedder):
+    monkeypatch.setattr(dependencies, "api_key", "test")
+    with TestClient(app, headers={"X-Key": "test"}) as client:
+        yield client
+
+
+def new_library(**fields: Any) -> Library:
+    lib = Library(id=uuid4(), name="test", **fields)
+    store.save_library(lib)
+    return lib
+
+
+def new_document(library_id, **fields: Any) -> Document:
+    doc = Document(id=uuid4(), library_id=library_id, **fields)
+    store.save_document(doc)
+    return doc
+
+
+def add_chunks(doc: Document, vectors: np.ndarray, **metadata: Any) -> list:
+    chunks = [
+        Chunk(
+            id=uuid4(),
+            library_id=doc.library_id,
+            document_id=doc.id,
+            text=f"chunk {i}",
+            embedding=row.tolist(),
+            metadata=dict(metadata, i=i),
+        )
+        for i, row in enumerate(vectors)
+    ]
+    store.add_chunks_to_document(chunks, doc.id)
+    return chunks
+
+
+def dump_store() -> Dict[str, Any]:
+    """Everything a client can read back, for comparing the store before and after recovery"""
+    state = {}
+    for lib in store.list_libraries():
+        state[str(lib.id)] = {
+            "library": lib.model_dump(),
+            "documents": sorted(
+                (doc.model_dump() for doc in store.list_documents(lib.id)), key=lambda d: str(d["id"])
+            ),
+            "chunks": {
+                str(chunk.id): chunk.model_dump() for chunk in store.list_all_chunks_in_library(lib.id)
+            },
+        }
+    return state
+
+
+def clustered(n: int, dim: int, seed: int, queries: int = 30) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+    """Ids, float32 rows around 16 centres, and queries near existing rows"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((16, dim)) * 3.0
+    vectors = centres[rng.integers(0, 16, n)] + rng.standard_normal((n, dim))
+    near = vectors[rng.integers(0, n, queries)] + rng.standard_normal((queries, dim)) * 0.1
+    return [uuid4() for _ in range(n)], vectors.astype(np.float32), near.astype(np.float32)
+
+
+def index_recall(index, ids, vectors, queries, metric: str, k: int = 10, **search: Any) -> float:
+    """Mean recall@k of index.search against brute force over the same rows"""
+    norms = np.linalg.norm(vectors, axis=1)
+    hits = 0
+    for q in queries:
+        rows, _ = brute_force_knn_matrix(q, vectors, norms, k, metric)
+        expected = {ids[row] for row in rows.tolist()}
+        hits += len(expected & {chunk_id for chunk_id, _ in index.search(q, k, **search)})
+    return hits / (k * len(queries))
+
+
+def join_threads(name: str, timeout: float = 10.0) -> None:
+    """Wait for the background threads with this name (index rebuilds, merges) to finish"""
+    for thread in threading.enumerate():
+        if thread.name == name:
+            thread.join(timeout)
+            assert not thread.is_alive(), f"{name} still running"
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.service import search_service
+
+from conftest import add_chunks, new_document, new_library
+
+
+@pytest.fixture
+def library():
+    search_service._result_cache.clear()
+    lib = new_library()
+    doc = new_document(lib.id)
+    add_chunks(doc, np.random.default_rng(0).standard_normal((200, 16)), group="a")
+    add_chunks(doc, np.random.default_rng(1).standard_normal((10, 16)), group="b")
+    return lib
+
+
+def _search(client, lib, **body):
+    response = client.post(f"/libraries/{lib.id}/search", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _batch(client, lib, **body):
+    return client.post(f"/libraries/{lib.id}/search:batch", json=body)
+
+
+@pytest.mark.parametrize("algorithm", ["brute", "hnsw", "ivf"])
+@pytest.mark.parametrize("metric", ["cosine", "l2"])
+def test_batch_answers_like_single_searches(client, library, algorithm, metric):
+    vectors = np.random.default_rng(2).standard_normal((5, 16)).tolist()
+    queries = [{"vector": vector} for vector in vectors] + [{"text": "hello"}, {"text": "world"}]
+    response = _batch(client, library, queries=queries, k=4, metric=metric, algorithm=algorithm)
+    assert response.status_code == 200
+    expected = [
+        _search(client, library, k=4, metric=metric, algorithm=algorithm, **query) for query in queries
+    ]
+    assert response.json() == expected
+
+
+def test_batch_shares_filter_and_projection(client, library):
+    queries = [{"vector": v} for v in np.random.default_rng(3).standard_normal((3, 16)).tolist()]
+    response = _batch(
+        client, library, queries=queries, k=20, filter={"key": "group", "eq": "b"}, include=["id", "metadata"],
+    )
+    results = response.json()
+    assert [len(hits) for hits in results] == [10, 10, 10]
+    assert all(set(hit) == {"id", "metadata"} and hit["metadata"]["group"] == "b" for hits in results for hit in hits)
+
+
+def test_cached_queries_skip_scoring(client, library):
+    queries = [{"vector": v} for v in np.random.default_rng(4).standard_normal((4, 16)).tolist()]
+    first = _batch(client, library, queries=queries[:2], k=3).json()
+    hits = search_service.result_cache_stats()["hits"]
+    again = _batch(client, library, queries=queries, k=3).json()
+    assert again[:2] == first
+    assert search_service.result_cache_stats()["hits"] == hits + 2
+
+
+def test_batch_errors(client, library, embedder):
+    bad_dims = [{"vector": [1.0] * 16}, {"vector": [1.0] * 8}]
+    assert _batch(client, library, queries=bad_dims, k=1).status_code == 422
+    assert _batch(client, library, queries=[{"vector": [1.0] * 8}], k=1).status_code == 422
+    assert _batch(client, library, queries=[{"text": "a", "vector": [1.0]}], k=1).status_code == 422
+    assert _batch(client, library, queries=[], k=1).status_code == 422
+    missing = new_library()
+    client.delete(f"/libraries/{missing.id}")
+    assert _batch(client, missing, queries=[{"vector": [1.0]}], k=1).status_code == 404
+    # texts are embedded in one call
+    calls = embedder.backend.calls
+    _batch(client, library, queries=[{"text": f"q{i}"} for i in range(3)], k=1)
+    assert embedder.backend.calls == calls + 1
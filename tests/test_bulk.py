@@ -0,0 +1,60 @@
+import numpy as np
+
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+def _url(doc) -> str:
+    return f"/libraries/{doc.library_id}/documents/{doc.id}/chunks:bulk"
+
+
+def test_bulk_create_embeds_only_missing_rows(client, embedder):
+    doc = new_document(new_library().id)
+    given = [0.5] * 16
+    rows = [{"text": f"t{i}"} for i in range(10)] + [{"text": "given", "embedding": given}]
+    response = client.post(_url(doc), json={"chunks": rows})
+    assert response.status_code == 201
+    chunks = response.json()
+    assert [chunk["text"] for chunk in chunks] == [row["text"] for row in rows]
+    # 10 missing embeddings in batches of 4
+    assert embedder.backend.calls == 3
+    assert chunks[-1]["embedding"] == given
+    assert all(len(chunk["embedding"]) == 16 for chunk in chunks)
+    assert [str(cid) for cid in store.get_document(doc.id).chunk_ids] == [chunk["id"] for chunk in chunks]
+
+
+def test_bulk_create_is_all_or_nothing(client):
+    doc = new_document(new_library().id)
+    rows = [{"text": "a", "embedding": [1.0, 0.0]}, {"text": "b", "embedding": [1.0, 0.0, 0.0]}]
+    response = client.post(_url(doc), json={"chunks": rows})
+    assert response.status_code == 422
+    assert store.list_chunks(doc.library_id, doc.id) == []
+    assert store.get_document(doc.id).chunk_ids == []
+
+
+def test_bulk_create_checks_the_parent(client):
+    doc = new_document(new_library().id)
+    other = new_library()
+    response = client.post(
+        f"/libraries/{other.id}/documents/{doc.id}/chunks:bulk", json={"chunks": [{"text": "a"}]}
+    )
+    assert response.status_code == 404
+    assert client.post(_url(doc), json={"chunks": []}).status_code == 422
+
+
+def test_bulk_create_reaches_existing_indexes(client):
+    doc = new_document(new_library().id)
+    rng = np.random.default_rng(0)
+    add_chunks(doc, rng.standard_normal((50, 16)))
+    index = store.get_library_index(doc.library_id, "hnsw", "cosine")
+    vectors = rng.standard_normal((30, 16))
+    response = client.post(
+        _url(doc), json={"chunks": [{"text": "v", "embedding": row.tolist()} for row in vectors]}
+    )
+    assert response.status_code == 201
+    # index upkeep runs after the write lock is released, but before the call returns
+    assert not any(store._index_work)
+    assert len(index) == 80
+    for chunk, row in zip(response.json(), vectors):
+        assert str(index.search(row, 1)[0][0]) == chunk["id"]
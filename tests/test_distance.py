@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from app.utils.distance import METRICS, get_metric
+
+
+def _reference(metric: str, q: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    q, vectors = q.astype(np.float64), vectors.astype(np.float64)
+    if metric == "cosine":
+        return vectors @ q / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(q))
+    if metric == "dot":
+        return vectors @ q
+    sq = ((vectors - q) ** 2).sum(axis=1)
+    return np.sqrt(sq) if metric == "l2" else sq
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal(8).astype(np.float32), rng.standard_normal((50, 8)).astype(np.float32)
+
+
+def test_get_metric():
+    assert set(METRICS) == {"cosine", "dot", "l2", "l2_squared"}
+    assert get_metric("l2").name == "l2"
+    with pytest.raises(ValueError, match="Unknown metric"):
+        get_metric("manhattan")
+
+
+@pytest.mark.parametrize("name", sorted(METRICS))
+def test_scan_kernel_matches_numpy(name, data):
+    q, vectors = data
+    metric = get_metric(name)
+    raw = metric.scores(vectors @ q, np.linalg.norm(vectors, axis=1), np.linalg.norm(q))
+    expected = _reference(name, q, vectors)
+    np.testing.assert_allclose(metric.report(raw), expected, rtol=1e-4, atol=1e-5)
+
+    # keys rank best first, whichever way the metric points
+    order = np.argsort(metric.keys(raw))
+    best = np.argsort(-expected if metric.higher_is_better else expected)
+    assert order[:5].tolist() == best[:5].tolist()
+
+
+@pytest.mark.parametrize("name", sorted(METRICS))
+def test_index_distances_map_back_to_scores(name, data):
+    q, vectors = data
+    metric = get_metric(name)
+    prepared, pq = metric.prepare(vectors), metric.prepare(q[None, :])
+    one = metric.to_score(metric.distances(prepared, pq[0]))
+    block = metric.to_score(metric.distances(prepared, pq))[:, 0]
+    expected = _reference(name, q, vectors)
+    np.testing.assert_allclose(one, expected, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(block, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_prepare_copies_and_normalizes():
+    vectors = np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float64)
+    prepared = get_metric("cosine").prepare(vectors)
+    assert prepared.dtype == np.float32
+    np.testing.assert_allclose(prepared, [[0.6, 0.8], [0.0, 0.0]])
+    assert vectors[0, 0] == 3.0
+    assert get_metric("l2").prepare(vectors)[0].tolist() == [3.0, 4.0]
+
+
+def test_zero_vectors_score_zero_for_cosine():
+    metric = get_metric("cosine")
+    scores = metric.scores(np.zeros(2), np.array([0.0, 1.0]), 0.0)
+    assert scores.tolist() == [0.0, 0.0]
+
+
+def test_only_dot_is_not_a_metric_space():
+    assert [name for name, metric in METRICS.items() if not metric.metric_space] == ["dot"]
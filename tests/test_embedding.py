@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from app.service.embedding_service import EmbeddingService, EmbeddingServiceError, FakeBackend
+
+
+class FlakyBackend(FakeBackend):
+    """FakeBackend failing its first `failures` calls, tracking calls in flight"""
+
+    def __init__(self, failures: int = 0, retryable: bool = True, delay: float = 0.0):
+        super().__init__(dim=8)
+        self.failures = failures
+        self.retryable = retryable
+        self.delay = delay
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def embed(self, texts, input_type):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            self.batches.append(list(texts))
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("upstream 503")
+            return await super().embed(texts, input_type)
+        finally:
+            self.in_flight -= 1
+
+    def is_retryable(self, exc):
+        return self.retryable
+
+
+def _service(backend, **kwargs):
+    return EmbeddingService(backend, backoff=0.001, **kwargs)
+
+
+def test_embed_batches_with_bounded_concurrency():
+    backend = FlakyBackend(delay=0.01)
+    service = _service(backend, batch_size=3, concurrency=2)
+    texts = [f"t{i}" for i in range(10)]
+    embeddings = asyncio.run(service.embed(texts))
+    assert [len(batch) for batch in backend.batches] == [3, 3, 3, 1]
+    assert backend.max_in_flight == 2
+    expected = asyncio.run(FakeBackend(dim=8).embed(texts, "classification"))
+    assert embeddings == expected
+
+
+def test_retryable_errors_are_retried():
+    backend = FlakyBackend(failures=2)
+    service = _service(backend, max_retries=3)
+    assert len(asyncio.run(service.embed(["a"]))) == 1
+    assert len(backend.batches) == 3
+
+
+def test_retries_give_up():
+    backend = FlakyBackend(failures=10)
+    with pytest.raises(EmbeddingServiceError):
+        asyncio.run(_service(backend, max_retries=2).embed(["a"]))
+    assert len(backend.batches) == 3
+
+
+def test_other_errors_are_not_retried():
+    backend = FlakyBackend(failures=1, retryable=False)
+    with pytest.raises(EmbeddingServiceError):
+        asyncio.run(_service(backend).embed(["a"]))
+    assert len(backend.batches) == 1
+
+
+def test_embed_one_coalesces_concurrent_requests():
+    backend = FlakyBackend()
+    service = _service(backend, batch_size=4, coalesce_ms=20)
+
+    async def run():
+        results = await asyncio.gather(*(service.embed_one(f"t{i}") for i in range(6)))
+        # every delivery task has finished and been released
+        assert not service._state().tasks
+        return results
+
+    results = asyncio.run(run())
+    # a full batch goes out at once, the rest when the coalescing window closes
+    assert backend.batches == [["t0", "t1", "t2", "t3"], ["t4", "t5"]]
+    assert results == asyncio.run(FakeBackend(dim=8).embed([f"t{i}" for i in range(6)], "classification"))
+
+
+def test_coalesced_failure_reaches_every_caller():
+    backend = FlakyBackend(failures=1, retryable=False)
+    service = _service(backend, coalesce_ms=5)
+
+    async def run():
+        return await asyncio.gather(
+            *(service.embed_one(f"t{i}") for i in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert len(backend.batches) == 1
+    assert all(isinstance(result, EmbeddingServiceError) for result in results)
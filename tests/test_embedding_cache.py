@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from app.service.embedding_cache import EmbeddingCache
+from app.service.embedding_service import EmbeddingService, FakeBackend
+from app.utils.lru_cache import LRUCache
+
+
+def test_lru_evicts_least_recent_and_expires():
+    now = [0.0]
+    cache = LRUCache(2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+    now[0] = 11
+    assert cache.get("a") is None and cache.get("c") is None
+
+
+def test_keys_ignore_whitespace_but_not_case():
+    key = EmbeddingCache.key
+    assert key("m", "q", "hello   world\n") == key("m", "q", "hello world")
+    assert key("m", "q", "Hello") != key("m", "q", "hello")
+    assert key("m", "q", "x") != key("other", "q", "x")
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(4, path=path)
+    key = cache.key("m", "q", "text")
+    stored = cache.put(key, [1.0, 2.0])
+    assert not stored.flags.writeable
+    cache.close()
+
+    warm = EmbeddingCache(4, path=path)
+    np.testing.assert_array_equal(asyncio.run(warm.get_many([key]))[0], [1.0, 2.0])
+    assert warm.stats()["disk_hits"] == 1
+    # promoted to memory: no second disk hit
+    asyncio.run(warm.get_many([key]))
+    assert warm.stats()["disk_hits"] == 1
+    warm.close()
+
+
+def test_disk_reads_and_writes_stay_off_the_loop(tmp_path, monkeypatch):
+    cache = EmbeddingCache(1, path=str(tmp_path / "cache.db"))
+    threads = []
+    for name in ("_disk_get", "_disk_put"):
+        original = getattr(cache, name)
+
+        def traced(*args, original=original):
+            threads.append(threading.current_thread())
+            return original(*args)
+
+        monkeypatch.setattr(cache, name, traced)
+
+    keys = [cache.key("m", "q", f"t{i}") for i in range(3)]
+
+    async def run():
+        for i, key in enumerate(keys):
+            cache.put(key, [float(i)])
+        cache.flush()
+        return await cache.get_many(keys)
+
+    vectors = asyncio.run(run())
+    # only the last put is still in memory, the others come back from disk
+    assert [vec.tolist() for vec in vectors] == [[0.0], [1.0], [2.0]]
+    assert threads and threading.main_thread() not in threads
+    cache.close()
+
+
+def test_disk_tier_is_purged_to_its_bound(tmp_path):
+    cache = EmbeddingCache(1, path=str(tmp_path / "cache.db"), disk_maxsize=10, purge_every=5)
+    for i in range(40):
+        cache.put(cache.key("m", "q", f"t{i}"), [float(i)])
+    cache.flush()
+    (count,) = cache._disk.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    assert count <= 15
+    cache.close()
+
+
+def test_queries_are_embedded_once():
+    backend = FakeBackend(dim=8)
+    service = EmbeddingService(backend, coalesce_ms=1, cache=EmbeddingCache(16))
+
+    async def run():
+        first = await service.embed_query("hello")
+        again = await service.embed_query("hello ")
+        batch = await service.embed_queries(["hello", "new", "new"])
+        return first, again, batch
+
+    first, again, batch = asyncio.run(run())
+    assert again is first and batch[0] is first
+    np.testing.assert_array_equal(batch[1], batch[2])
+    # "hello" once, then one call for the batch's single miss
+    assert backend.calls == 2
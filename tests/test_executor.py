@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.service import executor as executor_module
+from app.service.executor import SearchExecutor, SearchOverloadedError
+
+from conftest import new_library
+
+
+def test_runs_off_the_event_loop():
+    executor = SearchExecutor(workers=2, max_pending=4)
+
+    async def run():
+        return await executor.run(threading.current_thread)
+
+    try:
+        assert asyncio.run(run()) is not threading.main_thread()
+    finally:
+        executor.shutdown()
+
+
+def test_full_queue_fails_fast():
+    executor = SearchExecutor(workers=1, max_pending=2)
+    release = threading.Event()
+
+    async def run():
+        held = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(SearchOverloadedError):
+            await executor.run(lambda: None)
+        release.set()
+        await asyncio.gather(*held)
+        # slots come back once the work ends
+        assert executor.pending == 0
+        assert await executor.run(lambda: 7) == 7
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+
+def test_timeout_keeps_the_slot_until_the_work_ends():
+    executor = SearchExecutor(workers=1, max_pending=4, timeout=0.05)
+    release = threading.Event()
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run(release.wait, 5)
+        # the caller gave up but the call is still running
+        assert executor.pending == 1
+        release.set()
+        deadline = time.monotonic() + 5
+        while executor.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        assert executor.pending == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+
+def test_the_loop_stays_responsive():
+    executor = SearchExecutor(workers=1, max_pending=4)
+
+    async def run():
+        search = asyncio.ensure_future(executor.run(time.sleep, 0.3))
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        ticked = time.perf_counter() - start
+        await search
+        return ticked
+
+    try:
+        assert asyncio.run(run()) < 0.2
+    finally:
+        executor.shutdown()
+
+
+def test_overloaded_searches_get_503(client, monkeypatch):
+    lib = new_library()
+    monkeypatch.setattr(executor_module, "_executor", SearchExecutor(workers=1, max_pending=0))
+    response = client.post(f"/libraries/{lib.id}/search", json={"vector": [1.0, 0.0], "k": 1})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
@@ -0,0 +1,83 @@
+import io
+import json
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.models.chunk import Chunk
+from app.service.export_service import JSON, NDJSON, NPY, negotiate
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+@pytest.fixture
+def library():
+    lib = new_library()
+    docs = [new_document(lib.id) for _ in range(2)]
+    chunks = add_chunks(docs[0], np.random.default_rng(0).standard_normal((30, 4)), part=0)
+    chunks += add_chunks(docs[1], np.random.default_rng(1).standard_normal((10, 4)), part=1)
+    bare = Chunk(id=uuid4(), library_id=lib.id, document_id=docs[1].id, text="no vector")
+    store.add_chunk_to_document(bare, docs[1].id)
+    return lib, docs, chunks + [bare]
+
+
+def test_negotiate():
+    offered = [NDJSON, NPY]
+    assert negotiate(None, offered) == NDJSON
+    assert negotiate(NPY, offered) == NPY
+    assert negotiate(f"{NDJSON};q=0.5, {NPY}", offered) == NPY
+    assert negotiate("application/*", offered) == NDJSON
+    assert negotiate(f"{NPY};q=0, text/html", offered) is None
+    assert negotiate("*/*", [JSON, NDJSON]) == JSON
+
+
+def test_ndjson_export_has_every_chunk(client, library):
+    lib, _, chunks = library
+    response = client.get(f"/libraries/{lib.id}/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(NDJSON)
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [str(chunk.id) for chunk in chunks]
+    for row, chunk in zip(rows, chunks):
+        assert row["library_id"] == str(lib.id)
+        assert row["document_id"] == str(chunk.document_id)
+        assert row["text"] == chunk.text and row["metadata"] == chunk.metadata
+        if chunk.embedding is None:
+            assert row["embedding"] is None
+        else:
+            np.testing.assert_allclose(row["embedding"], chunk.embedding, rtol=1e-6)
+
+
+def test_npy_export_loads_with_numpy(client, library):
+    lib, _, chunks = library
+    response = client.get(f"/libraries/{lib.id}/export", headers={"Accept": NPY})
+    assert response.status_code == 200
+    table = np.load(io.BytesIO(response.content))
+    assert [chunk_id.decode() for chunk_id in table["id"]] == [str(chunk.id) for chunk in chunks]
+    assert table["document_id"][0].decode() == str(chunks[0].document_id)
+    np.testing.assert_array_equal(table["embedding"][:-1], np.array([chunk.embedding for chunk in chunks[:-1]], dtype=np.float32))
+    assert np.isnan(table["embedding"][-1]).all()
+
+
+def test_chunk_listing_formats(client, library):
+    lib, docs, chunks = library
+    url = f"/libraries/{lib.id}/documents/{docs[1].id}/chunks"
+    expected = [str(chunk.id) for chunk in chunks if chunk.document_id == docs[1].id]
+    assert [chunk["id"] for chunk in client.get(url).json()] == expected
+    ndjson = client.get(url, headers={"Accept": NDJSON})
+    assert [json.loads(line)["id"] for line in ndjson.text.splitlines()] == expected
+    table = np.load(io.BytesIO(client.get(url, headers={"Accept": NPY}).content))
+    assert [chunk_id.decode() for chunk_id in table["id"]] == expected
+    assert client.get(url, headers={"Accept": "text/html"}).status_code == 406
+
+
+def test_export_errors(client, library):
+    lib, docs, _ = library
+    assert client.get(f"/libraries/{lib.id}/export", headers={"Accept": JSON}).status_code == 406
+    assert client.get(f"/libraries/{uuid4()}/export").status_code == 404
+    other = new_library()
+    assert client.get(
+        f"/libraries/{other.id}/documents/{docs[0].id}/chunks", headers={"Accept": NDJSON}
+    ).status_code == 404
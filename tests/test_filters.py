@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from app.models.search import MetadataFilter
+from app.service import search_service
+from app.service.search_service import search_library_service
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+def _filter(**expr) -> MetadataFilter:
+    return MetadataFilter.model_validate(expr)
+
+
+@pytest.fixture
+def library():
+    lib = new_library()
+    en = new_document(lib.id, metadata={"lang": "en", "year": 2021})
+    de = new_document(lib.id, metadata={"lang": "de", "year": 2019})
+    rng = np.random.default_rng(0)
+    chunks = []
+    for doc in (en, de):
+        for i, row in enumerate(rng.standard_normal((100, 8))):
+            chunks += add_chunks(
+                doc, row[None, :],
+                n=i, tags=["even" if i % 2 == 0 else "odd"], author={"name": f"a{i % 3}"}, flag=i < 5,
+            )
+    return lib, en, de, chunks
+
+
+def _matching(chunks, predicate):
+    return {chunk.id for chunk in chunks if predicate(store.get_chunk_record(chunk.id).metadata)}
+
+
+def test_conditions_match_like_a_scan(library):
+    lib, _, _, chunks = library
+    cases = [
+        (_filter(key="n", eq=3), lambda m: m["n"] == 3),
+        (_filter(key="n", gte=10, lt=20), lambda m: 10 <= m["n"] < 20),
+        (_filter(key="n", **{"in": [1, 2, 500]}), lambda m: m["n"] in (1, 2)),
+        (_filter(key="tags", eq="even"), lambda m: "even" in m["tags"]),
+        (_filter(key="author.name", eq="a1"), lambda m: m["author"]["name"] == "a1"),
+        (_filter(key="flag", eq=True), lambda m: m["flag"] is True),
+        # True and 1 are different terms
+        (_filter(key="n", eq=True), lambda m: False),
+        (_filter(**{"and": [{"key": "n", "lt": 50}, {"key": "tags", "eq": "odd"}]}),
+         lambda m: m["n"] < 50 and "odd" in m["tags"]),
+        (_filter(**{"or": [{"key": "n", "eq": 0}, {"key": "author.name", "eq": "a2"}]}),
+         lambda m: m["n"] == 0 or m["author"]["name"] == "a2"),
+    ]
+    for expr, predicate in cases:
+        assert set(store.filter_chunk_ids(lib.id, expr)) == _matching(chunks, predicate), expr
+
+
+def test_document_scope(library):
+    lib, en, de, chunks = library
+    found = store.filter_chunk_ids(lib.id, _filter(key="year", gt=2020, scope="document"))
+    assert set(found) == {chunk.id for chunk in chunks if chunk.document_id == en.id}
+    both = _filter(**{"and": [{"key": "lang", "eq": "de", "scope": "document"}, {"key": "n", "lt": 3}]})
+    assert set(store.filter_chunk_ids(lib.id, both)) == {
+        chunk.id for chunk in chunks if chunk.document_id == de.id and chunk.metadata["n"] < 3
+    }
+
+
+def test_invalid_filters_are_rejected():
+    for expr in ({"key": "n"}, {"eq": 1}, {"key": "n", "eq": 1, "and": [{"key": "m", "eq": 2}]}):
+        with pytest.raises(ValueError):
+            MetadataFilter.model_validate(expr)
+
+
+@pytest.mark.parametrize("algorithm", ["brute", "vptree", "hnsw", "ivf"])
+@pytest.mark.parametrize("expr", [
+    {"key": "flag", "eq": True},                  # few matches: pre-filtered exact scan
+    {"key": "tags", "eq": "even"},                # many matches: filtered traversal / over-fetch
+])
+def test_filtered_search_returns_only_matches(library, algorithm, expr):
+    lib, _, _, chunks = library
+    expr = _filter(**expr)
+    allowed = set(store.filter_chunk_ids(lib.id, expr))
+    q = np.random.default_rng(1).standard_normal(8).tolist()
+    hits = search_library_service(lib.id, q, 5, algorithm=algorithm, filter=expr, include=["id"])
+    assert len(hits) == 5
+    assert {hit["id"] for hit in hits} <= {str(chunk_id) for chunk_id in allowed}
+    if algorithm == "brute":
+        vectors = {chunk.id: np.asarray(chunk.embedding) for chunk in chunks if chunk.id in allowed}
+        scores = {cid: v @ q / (np.linalg.norm(v) * np.linalg.norm(q)) for cid, v in vectors.items()}
+        expected = sorted(scores, key=scores.get, reverse=True)[:5]
+        assert [hit["id"] for hit in hits] == [str(cid) for cid in expected]
+
+
+def test_document_metadata_changes_invalidate_cached_searches(library):
+    lib, en, de, _ = library
+    search_service._result_cache.clear()
+    expr = _filter(key="lang", eq="fr", scope="document")
+    q = np.ones(8).tolist()
+    assert search_library_service(lib.id, q, 5, filter=expr) == []
+    store.save_document(store.get_document(de.id).model_copy(update={"metadata": {"lang": "fr"}}))
+    hits = search_library_service(lib.id, q, 5, filter=expr, include=["id", "document_id"])
+    assert len(hits) == 5 and all(hit["document_id"] == str(de.id) for hit in hits)
+    store.delete_document(de.id)
+    assert search_library_service(lib.id, q, 5, filter=expr) == []
+
+
+def test_moving_a_document_invalidates_both_libraries(library):
+    lib, en, _, _ = library
+    other = new_library()
+    versions = store.library_version(lib.id), store.library_version(other.id)
+    store.save_document(store.get_document(en.id).model_copy(update={"library_id": other.id}))
+    assert store.library_version(lib.id) != versions[0]
+    assert store.library_version(other.id) != versions[1]
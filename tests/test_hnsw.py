@@ -0,0 +1,72 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.utils import hnsw
+from app.utils.hnsw import HNSWIndex
+
+from conftest import clustered, index_recall, join_threads
+
+
+@pytest.mark.parametrize("metric", ["cosine", "dot", "l2"])
+def test_recall_against_brute_force(metric):
+    ids, vectors, queries = clustered(1500, 16, 1)
+    index = HNSWIndex(metric, M=8, ef_construction=100)
+    index.build(ids, vectors)
+    assert index_recall(index, ids, vectors, queries, metric, ef_search=64) >= 0.95
+
+
+def test_incremental_updates_match_brute_force():
+    ids, vectors, queries = clustered(800, 8, 3)
+    index = HNSWIndex("l2", M=8, ef_construction=100)
+    index.build(ids[:600], vectors[:600])
+    for chunk_id, vec in zip(ids[600:], vectors[600:]):
+        index.add(chunk_id, vec)
+    removed = set(ids[:100])
+    for chunk_id in removed:
+        index.remove(chunk_id)
+
+    assert len(index) == 700
+    for q in queries:
+        assert not removed & {chunk_id for chunk_id, _ in index.search(q, 10)}
+    assert index_recall(index, ids[100:], vectors[100:], queries, "l2") >= 0.95
+
+
+def test_failed_build_is_raised_to_searches():
+    index = HNSWIndex("cosine")
+    index.begin_build([uuid4()], np.ones((1, 4), dtype=np.float32))
+    index._pending = (None, None)  # makes the build itself fail
+    with pytest.raises(Exception) as built:
+        index.finish_build()
+
+    # a search waiting on the build gets the same error instead of blocking
+    with pytest.raises(type(built.value)):
+        index.search(np.ones(4), 1)
+
+
+def test_failed_compaction_keeps_the_graph_and_retries(monkeypatch):
+    ids, vectors, queries = clustered(400, 8, 6)
+    index = HNSWIndex("l2", M=8, ef_construction=100, min_rebuild=16)
+    index.build(ids, vectors)
+
+    def out_of_memory(dim):
+        raise MemoryError
+
+    graph = hnsw._Graph
+    monkeypatch.setattr(hnsw, "_Graph", out_of_memory)
+    for chunk_id in ids[:250]:
+        index.remove(chunk_id)
+        join_threads("hnsw-compact")
+    assert index._rebuild_log is None
+    assert index._graph.dead == 250
+    assert index_recall(index, ids[250:], vectors[250:], queries, "l2") >= 0.95
+
+    # once graphs can be built again the next attempt drops the tombstones
+    monkeypatch.setattr(hnsw, "_Graph", graph)
+    for chunk_id in ids[250:280]:
+        index.remove(chunk_id)
+        join_threads("hnsw-compact")
+    assert index._graph.size < 400
+    assert len(index) == 120
+    assert index_recall(index, ids[280:], vectors[280:], queries, "l2") >= 0.95
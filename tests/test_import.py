@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+
+import numpy as np
+import pytest
+
+from app.service import import_service
+from app.service.import_service import import_library_service
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+def _ndjson(rows) -> bytes:
+    return b"\n".join(json.dumps(row).encode() for row in rows) + b"\n"
+
+
+async def _records(rows):
+    for line_no, row in enumerate(rows, 1):
+        yield line_no, row
+
+
+def _import(library_id, rows, batch_rows):
+    return asyncio.run(import_library_service(library_id, _records(rows), batch_rows=batch_rows))
+
+
+def _documents(library_id):
+    return {tuple(doc.metadata.items()): doc for doc in store.list_documents(library_id)}
+
+
+def test_import_groups_rows_and_embeds_missing_ones(client):
+    lib = new_library()
+    rng = np.random.default_rng(0)
+    rows = [
+        {"document": "a", "text": f"a{i}", "embedding": rng.standard_normal(16).tolist(), "metadata": {"i": i}}
+        for i in range(5)
+    ]
+    rows += [{"document": "b", "text": f"b{i}", "document_metadata": {"name": "b"}} for i in range(3)]
+    response = client.post(f"/libraries/{lib.id}/import", content=_ndjson(rows))
+    assert response.status_code == 200
+    summary = response.json()
+    assert (summary["documents"], summary["chunks"], summary["embedded"]) == (2, 8, 3)
+
+    docs = store.list_documents(lib.id)
+    assert sorted(len(doc.chunk_ids) for doc in docs) == [3, 5]
+    b = next(doc for doc in docs if doc.metadata == {"name": "b"})
+    assert [chunk.text for chunk in store.list_chunks(lib.id, b.id)] == ["b0", "b1", "b2"]
+    assert all(len(chunk.embedding) == 16 for chunk in store.list_chunks(lib.id, b.id))
+
+
+def test_first_row_setting_document_metadata_wins_across_batches(embedder):
+    lib = new_library()
+    rows = [
+        {"document": "a", "text": "a0"},
+        {"document": "b", "text": "b0", "document_metadata": {"name": "b"}},
+        {"document": "a", "text": "a1"},
+        # a's first metadata arrives two batches after the document was saved
+        {"document": "a", "text": "a2", "document_metadata": {"name": "a"}},
+        {"document": "b", "text": "b1", "document_metadata": {"name": "ignored"}},
+        {"document": "a", "text": "a3", "document_metadata": {"name": "ignored"}},
+    ]
+    summary = _import(lib.id, rows, batch_rows=2)
+    assert (summary.documents, summary.chunks) == (2, 6)
+
+    docs = _documents(lib.id)
+    assert set(docs) == {(("name", "a"),), (("name", "b"),)}
+    assert len(docs[(("name", "a"),)].chunk_ids) == 4
+    assert len(docs[(("name", "b"),)].chunk_ids) == 2
+    # document filters see the late metadata
+    a = docs[(("name", "a"),)].id
+    assert store._document_metadata[lib.id].equal("name", "a") == {a: None}
+    assert store._document_metadata[lib.id].equal("name", "ignored") == {}
+
+
+def test_bad_rows_are_rejected_with_their_line(client):
+    lib = new_library()
+    rows = [{"document": "a", "text": "ok", "embedding": [0.5] * 16}] * 3
+    body = _ndjson(rows) + b'{"document": "a"}\n'
+    response = client.post(f"/libraries/{lib.id}/import", content=body)
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("line 4: text")
+
+    response = client.post(f"/libraries/{lib.id}/import", content=b"not json\n")
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("line 1: invalid JSON")
+
+    assert client.post(f"/libraries/{lib.id}/import", content=_ndjson(rows)).status_code == 200
+    bad_dim = [{"document": "a", "text": "ok", "embedding": [0.5] * 3}]
+    response = client.post(f"/libraries/{lib.id}/import", content=_ndjson(bad_dim))
+    assert response.status_code == 422
+    assert "rejected" in response.json()["detail"]
+
+    response = client.post("/libraries/00000000-0000-0000-0000-000000000000/import", content=_ndjson(rows))
+    assert response.status_code == 404
+
+
+def test_indexes_are_rebuilt_once_after_import(embedder):
+    doc = new_document(new_library().id)
+    add_chunks(doc, np.random.default_rng(1).standard_normal((20, 16)))
+    store.get_library_index(doc.library_id, "hnsw", "cosine")
+
+    rows = [{"document": "x", "text": f"x{i}"} for i in range(10)]
+    summary = _import(doc.library_id, rows, batch_rows=4)
+    assert summary.indexes == ["hnsw/cosine"]
+    index = store.get_library_index(doc.library_id, "hnsw", "cosine")
+    assert len(index) == 30
+
+
+def test_rebuild_failure_does_not_hide_the_import_error(embedder, monkeypatch, caplog):
+    doc = new_document(new_library().id)
+    add_chunks(doc, np.random.default_rng(2).standard_normal((10, 16)))
+    store.get_library_index(doc.library_id, "vptree", "cosine")
+
+    def broken_rebuild(*args):
+        raise RuntimeError("rebuild failed")
+
+    monkeypatch.setattr(import_service, "rebuild_library_index", broken_rebuild)
+    rows = [{"document": "x", "text": "x0"}, {"document": "x"}]
+    with caplog.at_level(logging.ERROR, logger=import_service.__name__):
+        with pytest.raises(ValueError, match="line 2"):
+            _import(doc.library_id, rows, batch_rows=10)
+    assert "after a failed import" in caplog.text
+
+    # with nothing else going wrong, the rebuild error is the one reported
+    store.get_library_index(doc.library_id, "vptree", "cosine")
+    with pytest.raises(RuntimeError, match="rebuild failed"):
+        _import(doc.library_id, rows[:1], batch_rows=10)
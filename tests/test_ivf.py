@@ -0,0 +1,84 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.utils import ivf
+from app.utils.ivf import IVFIndex
+
+from conftest import clustered, index_recall, join_threads
+
+
+@pytest.mark.parametrize("metric", ["cosine", "dot", "l2"])
+def test_recall_against_brute_force(metric):
+    ids, vectors, queries = clustered(2000, 16, 2)
+    index = IVFIndex(metric, nlist=16, nprobe=4, train_threshold=0)
+    index.build(ids, vectors)
+    assert index.trained and index.nlist == 16
+    assert index_recall(index, ids, vectors, queries, metric) >= 0.95
+    # probing every list is an exact scan
+    assert index_recall(index, ids, vectors, queries, metric, nprobe=16) == 1.0
+
+
+def test_incremental_updates_match_brute_force():
+    ids, vectors, queries = clustered(800, 8, 3)
+    index = IVFIndex("l2", nlist=8, nprobe=8, train_threshold=0)
+    index.build(ids[:600], vectors[:600])
+    for chunk_id, vec in zip(ids[600:], vectors[600:]):
+        index.add(chunk_id, vec)
+    for chunk_id in ids[:100]:
+        index.remove(chunk_id)
+
+    assert len(index) == 700
+    assert index_recall(index, ids[100:], vectors[100:], queries, "l2") == 1.0
+
+
+def test_single_list_trains_once():
+    index = IVFIndex("cosine", nlist=1, train_threshold=10)
+    index.build([], np.empty((0, 8), dtype=np.float32))
+    trains = []
+    train = index._train
+    index._train = lambda *args: trains.append(1) or train(*args)
+    rng = np.random.default_rng(4)
+    for _ in range(200):
+        index.add(uuid4(), rng.standard_normal(8))
+        join_threads("ivf-train")
+    assert index.trained and index.nlist == 1
+    assert len(trains) == 1
+
+
+def test_failed_build_is_raised_to_searches():
+    index = IVFIndex("cosine", train_threshold=0)
+    index.begin_build([uuid4()], np.ones((1, 4), dtype=np.float32))
+    index._pending = (None, None)  # makes the build itself fail
+    with pytest.raises(Exception) as built:
+        index.finish_build()
+
+    # a search waiting on the build gets the same error instead of blocking
+    with pytest.raises(type(built.value)):
+        index.search(np.ones(4), 1)
+
+
+def test_failed_training_keeps_serving_and_retries(monkeypatch):
+    ids, vectors, queries = clustered(300, 8, 7)
+    index = IVFIndex("l2", nlist=4, nprobe=4, train_threshold=100)
+    index.build([], np.empty((0, 8), dtype=np.float32))
+
+    def out_of_memory(*args, **kwargs):
+        raise MemoryError
+
+    kmeans = ivf.kmeans
+    monkeypatch.setattr(ivf, "kmeans", out_of_memory)
+    for chunk_id, vec in zip(ids[:150], vectors[:150]):
+        index.add(chunk_id, vec)
+        join_threads("ivf-train")
+    assert not index.trained and index._rebuild_log is None
+    assert index_recall(index, ids[:150], vectors[:150], queries, "l2") == 1.0
+
+    # once k-means works again the next attempt trains the index
+    monkeypatch.setattr(ivf, "kmeans", kmeans)
+    for chunk_id, vec in zip(ids[150:], vectors[150:]):
+        index.add(chunk_id, vec)
+        join_threads("ivf-train")
+    assert index.trained and index.nlist == 4
+    assert index_recall(index, ids, vectors, queries, "l2") == 1.0
@@ -0,0 +1,105 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.store import in_memory as store
+from app.utils.rwlock import RWLock
+
+from conftest import add_chunks, new_document, new_library
+
+
+def _in_thread(fn) -> threading.Thread:
+    thread = threading.Thread(target=fn, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share_and_writers_exclude():
+    lock = RWLock()
+    both_inside = threading.Barrier(2, timeout=5)
+
+    def reader():
+        with lock.read():
+            both_inside.wait()
+
+    threads = [_in_thread(reader) for _ in range(2)]
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+
+    entered = threading.Event()
+    with lock.read():
+        writer = _in_thread(lambda: (lock.acquire_write(), entered.set(), lock.release_write()))
+        assert not entered.wait(0.1)
+    assert entered.wait(5)
+    writer.join(5)
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    order = []
+    lock.acquire_read()
+    writer = _in_thread(lambda: (lock.acquire_write(), order.append("writer"), lock.release_write()))
+    while not lock._waiting_writers:
+        time.sleep(0.001)
+    reader = _in_thread(lambda: (lock.acquire_read(), order.append("reader"), lock.release_read()))
+    time.sleep(0.05)
+    assert order == []
+    lock.release_read()
+    writer.join(5)
+    reader.join(5)
+    assert order == ["writer", "reader"]
+
+
+def test_writer_may_reenter():
+    lock = RWLock()
+    with lock.write():
+        with lock.write():
+            with lock.read():
+                pass
+        assert lock._writer == threading.get_ident()
+    assert lock._writer is None
+
+
+def test_a_writer_only_blocks_its_own_stripe():
+    a = new_library()
+    b = next(lib for lib in iter(new_library, None) if store._stripe(lib.id) != store._stripe(a.id))
+    new_document(b.id)
+    holding, release = threading.Event(), threading.Event()
+
+    def write_a():
+        with store._write(a.id):
+            holding.set()
+            release.wait(5)
+
+    writer = _in_thread(write_a)
+    assert holding.wait(5)
+    try:
+        done = []
+        reader = _in_thread(lambda: done.append(store.list_documents(b.id)))
+        reader.join(2)
+        assert done and len(done[0]) == 1
+        blocked = _in_thread(lambda: done.append(store.list_documents(a.id)))
+        blocked.join(0.1)
+        assert blocked.is_alive()
+    finally:
+        release.set()
+    writer.join(5)
+    blocked.join(5)
+    assert done[-1] == []
+
+
+def test_concurrent_writers_keep_a_library_consistent():
+    doc = new_document(new_library().id)
+    add_chunks(doc, np.ones((1, 4)))
+    store.get_library_index(doc.library_id, "hnsw", "cosine")
+    with ThreadPoolExecutor(8) as pool:
+        batches = list(pool.map(
+            lambda seed: add_chunks(doc, np.random.default_rng(seed).standard_normal((20, 4))), range(16)
+        ))
+    ids = {chunk.id for batch in batches for chunk in batch}
+    assert len(store.list_chunk_ids(doc.library_id)) == 321
+    assert ids <= set(store.get_document(doc.id).chunk_ids)
+    assert len(store._indexes[doc.library_id][("hnsw", "cosine")]) == 321
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from app.service.embedding_cache import EmbeddingCache
+from app.utils.metrics import LOCK_WAIT_SECONDS, STAGE_SECONDS, CallbackMetric, Histogram, Registry
+
+from conftest import add_chunks, new_document, new_library
+
+
+def _parse(text: str) -> dict:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def _count(histogram: Histogram, label: str) -> float:
+    samples = {(name, labels.get(histogram.labels[0])): value for name, labels, value in histogram.samples()}
+    return samples.get((histogram.name + "_count", label), 0)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("t_seconds", "test", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, "a")
+    histogram.observe(0.5, "b")
+    with pytest.raises(RuntimeError):
+        with histogram.time("b"):
+            raise RuntimeError
+    samples = {(name, tuple(sorted(labels.items()))): value for name, labels, value in histogram.samples()}
+
+    def bucket(stage, le):
+        return samples[("t_seconds_bucket", (("le", le), ("stage", stage)))]
+
+    # bounds are inclusive, as in Prometheus
+    assert [bucket("a", le) for le in ("0.1", "1", "+Inf")] == [2, 3, 4]
+    assert samples[("t_seconds_sum", (("stage", "a"),))] == pytest.approx(2.65)
+    assert samples[("t_seconds_count", (("stage", "a"),))] == 4
+    # timed blocks are observed even when they raise
+    assert samples[("t_seconds_count", (("stage", "b"),))] == 2
+
+
+def test_registry_renders_text_format():
+    registry = Registry()
+    registry.register(CallbackMetric("t_old", "replaced", "gauge", [], lambda: [((), 1)]))
+    registry.register(CallbackMetric("t_old", "Sizes", "gauge", ["name"], lambda: [(('a "b"\n',), 2.5), (("c",), 3)]))
+    registry.register(Histogram("t_empty", "Nothing observed"))
+    assert registry.render() == (
+        "# HELP t_old Sizes\n"
+        "# TYPE t_old gauge\n"
+        't_old{name="a \\"b\\"\\n"} 2.5\n'
+        't_old{name="c"} 3\n'
+        "# HELP t_empty Nothing observed\n"
+        "# TYPE t_empty histogram\n"
+    )
+
+
+def test_requests_record_stages_and_lock_waits(client):
+    doc = new_document(new_library().id)
+    before = {
+        stage: _count(STAGE_SECONDS, stage) for stage in ("embed", "insert", "scoring", "serialize")
+    }
+    reads, writes = _count(LOCK_WAIT_SECONDS, "read"), _count(LOCK_WAIT_SECONDS, "write")
+
+    response = client.post(
+        f"/libraries/{doc.library_id}/documents/{doc.id}/chunks", json={"text": "hello world"}
+    )
+    assert response.status_code == 201, response.text
+    response = client.post(f"/libraries/{doc.library_id}/search", json={"text": "hello", "k": 1})
+    assert response.status_code == 200, response.text
+
+    for stage in before:
+        assert _count(STAGE_SECONDS, stage) > before[stage], stage
+    assert _count(LOCK_WAIT_SECONDS, "read") > reads
+    assert _count(LOCK_WAIT_SECONDS, "write") > writes
+
+
+def test_metrics_endpoint_reports_store_and_caches(client, embedder, monkeypatch):
+    monkeypatch.setattr(embedder, "cache", EmbeddingCache(16))
+    doc = new_document(new_library().id)
+    add_chunks(doc, np.random.default_rng(0).standard_normal((12, 16)))
+    lib = doc.library_id
+    # a new k misses the result cache but reuses the query embedding; the repeat hits both
+    for k in (3, 2, 2):
+        response = client.post(f"/libraries/{lib}/search", json={"text": "q", "k": k, "algorithm": "hnsw"})
+        assert response.status_code == 200, response.text
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = _parse(response.text)
+    assert samples[f'vectordb_library_chunks{{library_id="{lib}"}}'] == 12
+    assert samples[f'vectordb_library_documents{{library_id="{lib}"}}'] == 1
+    assert samples[f'vectordb_library_vectors{{library_id="{lib}"}}'] == 12
+    assert samples[f'vectordb_index_size{{library_id="{lib}",algorithm="hnsw",metric="cosine"}}'] == 12
+    for cache in ("search_results", "query_embeddings"):
+        assert samples[f'vectordb_cache_hits_total{{cache="{cache}"}}'] >= 1
+        assert f'vectordb_cache_hit_ratio{{cache="{cache}"}}' in samples
+        assert samples[f'vectordb_cache_entries{{cache="{cache}"}}'] >= 1
+    assert samples['vectordb_stage_seconds_count{stage="index_lookup"}'] >= 1
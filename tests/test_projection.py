@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from app.models.search import DEFAULT_INCLUDE
+from app.service.search_service import _rows
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+@pytest.fixture
+def library():
+    lib = new_library()
+    doc = new_document(lib.id)
+    return lib, doc, add_chunks(doc, np.random.default_rng(0).standard_normal((20, 4)), source="x")
+
+
+def _search(client, lib, **body):
+    response = client.post(f"/libraries/{lib.id}/search", json={"vector": [1.0, 0.0, 0.0, 0.0], "k": 3, **body})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_default_fields_leave_out_embeddings(client, library):
+    lib, _, _ = library
+    hits = _search(client, lib)
+    assert all(set(hit) == set(DEFAULT_INCLUDE) for hit in hits)
+
+
+def test_ids_only(client, library):
+    lib, _, chunks = library
+    hits = _search(client, lib, include=["id"])
+    assert all(set(hit) == {"id"} for hit in hits)
+    assert {hit["id"] for hit in hits} <= {str(chunk.id) for chunk in chunks}
+
+
+def test_every_field_on_request(client, library):
+    lib, doc, chunks = library
+    by_id = {str(chunk.id): chunk for chunk in chunks}
+    hits = _search(client, lib, include=["id", "score", "document_id", "text", "metadata", "embedding"])
+    for hit in hits:
+        chunk = by_id[hit["id"]]
+        assert hit["document_id"] == str(doc.id)
+        assert hit["text"] == chunk.text and hit["metadata"] == chunk.metadata
+        np.testing.assert_allclose(hit["embedding"], chunk.embedding, rtol=1e-6)
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+
+
+def test_unknown_fields_are_rejected(client, library):
+    lib, _, _ = library
+    response = client.post(f"/libraries/{lib.id}/search", json={"vector": [1.0] * 4, "k": 1, "include": ["vector"]})
+    assert response.status_code == 422
+    response = client.post(f"/libraries/{lib.id}/search", json={"vector": [1.0] * 4, "k": 1, "include": []})
+    assert response.status_code == 422
+
+
+def test_hits_deleted_after_scoring_are_dropped(library):
+    _, _, chunks = library
+    hits = [(chunk.id, 1.0 - i / 10) for i, chunk in enumerate(chunks[:4])]
+    store.delete_chunk(chunks[1].id)
+    rows = _rows(hits, 3, ["id", "score"], exclude_id=chunks[0].id)
+    assert [row["id"] for row in rows] == [str(chunks[2].id), str(chunks[3].id)]
+    assert rows[0]["score"] == pytest.approx(0.8)
@@ -0,0 +1,104 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.config import Config
+from app.store import in_memory as store
+from app.store.embedding_matrix import EmbeddingMatrix
+from app.utils.knn import brute_force_knn_matrix, quantized_knn
+from app.utils.quantization import ProductQuantizer, ScalarQuantizer, make_quantizer
+
+from conftest import add_chunks, index_recall, new_document, new_library
+
+K = 10
+
+
+def _data(seed: int):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((40, 64)) * 3.0
+    vectors = centres[rng.integers(0, 40, 3000)] + rng.standard_normal((3000, 64)) * rng.uniform(0.3, 1.0)
+    queries = vectors[rng.integers(0, 3000, 50)] + rng.standard_normal((50, 64)) * 0.1
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def _matrix(compression: str, vectors: np.ndarray, keep_full: bool) -> EmbeddingMatrix:
+    matrix = EmbeddingMatrix(quantizer=make_quantizer(compression), keep_full=keep_full, train_size=1024)
+    matrix.bulk_load([uuid4() for _ in vectors], vectors)
+    assert matrix.compressed
+    return matrix
+
+
+def _recall(matrix: EmbeddingMatrix, vectors: np.ndarray, queries: np.ndarray, metric: str) -> float:
+    view = matrix.snapshot()
+    norms = np.linalg.norm(vectors, axis=1)
+    hits = 0
+    for q in queries:
+        expected, _ = brute_force_knn_matrix(q, vectors, norms, K, metric)
+        found, _ = quantized_knn(q, view.codes, view.norms, view.quantizer, K, metric, view.mask, view.vectors)
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+    return hits / (K * len(queries))
+
+
+@pytest.mark.parametrize("compression", ["int8", "pq"])
+@pytest.mark.parametrize("metric", ["cosine", "dot", "l2"])
+def test_codes_alone_keep_recall(compression, metric):
+    vectors, queries = _data(0)
+    assert _recall(_matrix(compression, vectors, keep_full=False), vectors, queries, metric) >= 0.95
+
+
+@pytest.mark.parametrize("compression", ["int8", "pq"])
+def test_rerank_restores_exact_order(compression):
+    vectors, queries = _data(1)
+    assert _recall(_matrix(compression, vectors, keep_full=True), vectors, queries, "l2") >= 0.95
+
+
+def test_codes_take_a_fraction_of_the_memory():
+    vectors, _ = _data(2)
+    plain = EmbeddingMatrix()
+    plain.bulk_load([uuid4() for _ in vectors], vectors)
+    # one byte per dim; pq adds one per PQ_SUBVECTOR_DIM dims
+    assert _matrix("int8", vectors, keep_full=False).nbytes < plain.nbytes / 3
+    assert _matrix("pq", vectors, keep_full=False).nbytes < plain.nbytes / 2.5
+    assert _matrix("int8", vectors, keep_full=True).nbytes > plain.nbytes
+
+
+def test_pq_encode_blocks_give_the_same_codes():
+    vectors, _ = _data(4)
+    pq = ProductQuantizer(sub_dim=4)
+    pq.train(vectors[:1024])
+    np.testing.assert_array_equal(pq.encode(vectors, block=7), pq.encode(vectors))
+
+
+@pytest.mark.parametrize("quantizer", [ScalarQuantizer, lambda: ProductQuantizer(sub_dim=4)])
+def test_quantizer_state_round_trips(quantizer):
+    vectors, _ = _data(3)
+    trained = quantizer()
+    trained.train(vectors[:1024])
+    restored = quantizer()
+    restored.load_state(trained.state())
+    codes = trained.encode(vectors)
+    np.testing.assert_array_equal(restored.encode(vectors), codes)
+    np.testing.assert_array_equal(restored.decode(codes), trained.decode(codes))
+
+
+@pytest.mark.parametrize("algorithm", ["vptree", "hnsw", "ivf"])
+def test_indexes_over_codes_hold_no_float_copy(monkeypatch, algorithm):
+    monkeypatch.setattr(Config, "QUANTIZATION_TRAIN_SIZE", 256)
+    monkeypatch.setattr(Config, "IVF_TRAIN_THRESHOLD", 0)
+    vectors, queries = _data(5)
+    vectors, queries = vectors[:1000], queries[:20]
+    lib = new_library(compression="int8")
+    doc = new_document(lib.id)
+    chunks = add_chunks(doc, vectors[:100])
+    # built before the quantizer trains: float32 rows, dropped once it does
+    assert store.get_library_index(lib.id, algorithm, "l2") is not None
+    chunks += add_chunks(doc, vectors[100:])
+    assert store._matrices[lib.id].row_quantizer is not None
+    assert (algorithm, "l2") not in store._indexes.get(lib.id, {})
+
+    index = store.get_library_index(lib.id, algorithm, "l2")
+    assert index._codec.quantizer is store._matrices[lib.id].row_quantizer
+    ids = [chunk.id for chunk in chunks]
+    decoded = store._matrices[lib.id].live_items()[1]
+    assert index_recall(index, ids, decoded, queries, "l2") >= 0.95
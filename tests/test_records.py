@@ -0,0 +1,72 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.models.chunk import Chunk
+from app.models.search import MetadataFilter
+from app.store import in_memory as store
+from app.store.embedding_matrix import EmbeddingMatrix
+from app.store.records import ChunkRecord
+
+from conftest import add_chunks, new_document, new_library
+
+
+def test_record_round_trip():
+    chunk = Chunk(
+        id=uuid4(), library_id=uuid4(), document_id=uuid4(), text="t", embedding=[1.0, 2.0], metadata={"a": 1}
+    )
+    record = ChunkRecord.from_model(chunk)
+    assert not hasattr(record, "__dict__")
+    assert not hasattr(record, "embedding")
+    assert record.to_model([1.0, 2.0]) == chunk
+    assert record.to_json() == {
+        "id": str(chunk.id), "library_id": str(chunk.library_id), "document_id": str(chunk.document_id),
+        "text": "t", "metadata": {"a": 1},
+    }
+
+    detached = record.replace(document_id=None, text="u")
+    assert (record.document_id, record.text) == (chunk.document_id, "t")
+    assert (detached.id, detached.text, detached.metadata) == (chunk.id, "u", {"a": 1})
+    assert detached.metadata is record.metadata
+    assert "document_id" not in detached.to_json()
+    assert detached.to_model(None).embedding is None
+
+
+def test_store_keeps_records_and_materializes_vectors():
+    doc = new_document(new_library().id)
+    vectors = np.random.default_rng(0).standard_normal((3, 4)).astype(np.float32)
+    chunks = add_chunks(doc, vectors)
+    for chunk, vector in zip(chunks, vectors):
+        assert isinstance(store._chunks[chunk.id], ChunkRecord)
+        assert store.get_chunk_record(chunk.id) is store._chunks[chunk.id]
+        np.testing.assert_allclose(store.get_chunk(chunk.id).embedding, vector, rtol=1e-6)
+
+
+def test_patch_without_embedding_leaves_the_vector_alone(monkeypatch):
+    doc = new_document(new_library().id)
+    chunk = store.get_chunk(add_chunks(doc, np.random.default_rng(1).standard_normal((1, 4)))[0].id)
+
+    def no_upsert(*args):
+        raise AssertionError("vector rewritten")
+
+    monkeypatch.setattr(EmbeddingMatrix, "upsert", no_upsert)
+    patched = store.patch_chunk(chunk.id, {"text": "new", "metadata": {"tag": "x"}})
+    assert (patched.text, patched.metadata, patched.embedding) == ("new", {"tag": "x"}, chunk.embedding)
+    assert store.filter_chunk_ids(doc.library_id, MetadataFilter(key="tag", eq="x")) == {chunk.id: None}
+
+    monkeypatch.undo()
+    patched = store.patch_chunk(chunk.id, {"embedding": [1.0, 0.0, 0.0, 0.0]})
+    assert (patched.text, patched.embedding) == ("new", [1.0, 0.0, 0.0, 0.0])
+
+
+def test_get_chunk_checks_its_parents(client):
+    doc = new_document(new_library().id)
+    chunk = add_chunks(doc, np.ones((1, 4)))[0]
+    response = client.get(f"/libraries/{doc.library_id}/documents/{doc.id}/chunks/{chunk.id}")
+    assert response.status_code == 200
+    assert response.json()["text"] == chunk.text
+    other = new_document(doc.library_id)
+    response = client.get(f"/libraries/{doc.library_id}/documents/{other.id}/chunks/{chunk.id}")
+    assert response.status_code == 404
+
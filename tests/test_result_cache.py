@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from app.service import search_service
+from app.service.search_service import result_cache_stats, search_library_service
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    search_service._result_cache.clear()
+
+
+def _ids(hits):
+    return [hit["id"] for hit in hits]
+
+
+def _hits() -> int:
+    return result_cache_stats()["hits"]
+
+
+def test_repeated_searches_are_served_from_the_cache():
+    doc = new_document(new_library().id)
+    add_chunks(doc, np.random.default_rng(0).standard_normal((40, 8)))
+    q = np.random.default_rng(1).standard_normal(8).tolist()
+    first = search_library_service(doc.library_id, q, 5)
+    before = _hits()
+    assert search_library_service(doc.library_id, q, 5) == first
+    assert _hits() == before + 1
+    # other parameters are other entries
+    search_library_service(doc.library_id, q, 5, metric="dot")
+    search_library_service(doc.library_id, q, 6)
+    assert _hits() == before + 1
+
+
+@pytest.mark.parametrize("change", ["add", "patch", "delete"])
+def test_chunk_writes_invalidate(change):
+    doc = new_document(new_library().id)
+    chunks = add_chunks(doc, np.random.default_rng(2).standard_normal((40, 8)))
+    q = np.random.default_rng(3).standard_normal(8)
+    first = _ids(search_library_service(doc.library_id, q.tolist(), 3))
+    top = next(chunk for chunk in chunks if str(chunk.id) == first[0])
+    if change == "add":
+        (added,) = add_chunks(doc, q[None, :])
+        expected = str(added.id)
+    elif change == "patch":
+        store.patch_chunk(top.id, {"embedding": (-q).tolist()})
+        expected = first[1]
+    else:
+        store.delete_chunk(top.id)
+        expected = first[1]
+    assert _ids(search_library_service(doc.library_id, q.tolist(), 3))[0] == expected
+
+
+def test_index_rebuilds_invalidate():
+    doc = new_document(new_library().id)
+    add_chunks(doc, np.random.default_rng(4).standard_normal((40, 8)))
+    q = np.random.default_rng(5).standard_normal(8).tolist()
+    search_library_service(doc.library_id, q, 5, algorithm="ivf")
+    version = store.library_version(doc.library_id)
+    store.rebuild_library_index(doc.library_id, "ivf", "cosine", {"nlist": 2})
+    assert store.library_version(doc.library_id) != version
+    before = _hits()
+    search_library_service(doc.library_id, q, 5, algorithm="ivf")
+    assert _hits() == before
+
+
+def test_versions_are_never_reused():
+    lib = new_library()
+    doc = new_document(lib.id)
+    add_chunks(doc, np.ones((1, 4)))
+    version = store.library_version(lib.id)
+    store.delete_library(lib.id)
+    assert store.library_version(lib.id) is None
+    store.save_library(lib)
+    assert store.library_version(lib.id) != version
@@ -0,0 +1,85 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from app.config import Config
+from app.service.search_service import _run_knn
+from app.store import in_memory as store
+from app.store.segments import SegmentedMatrix
+
+from conftest import add_chunks, dump_store, new_document, new_library, wipe_store
+
+
+@pytest.fixture
+def mmap_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "MMAP_VECTORS", True)
+    monkeypatch.setattr(Config, "MEMTABLE_ROWS", 50)
+    monkeypatch.setattr(Config, "MAX_SEGMENTS", 3)
+    store.open_store(str(tmp_path))
+    return str(tmp_path)
+
+
+def _settle(matrix: SegmentedMatrix) -> None:
+    # merges copy rows in a background thread
+    deadline = time.monotonic() + 10
+    while matrix._merging and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not matrix._merging
+
+
+def _fill(rng: np.random.Generator):
+    lib = new_library()
+    doc = new_document(lib.id)
+    chunks = []
+    for _ in range(10):
+        chunks += add_chunks(doc, rng.standard_normal((40, 8)))
+    for chunk in chunks[:30]:
+        store.patch_chunk(chunk.id, {"embedding": rng.standard_normal(8).tolist()})
+    for chunk in chunks[30:60]:
+        store.delete_chunk(chunk.id)
+    matrix = store._matrices[lib.id]
+    _settle(matrix)
+    return lib, matrix
+
+
+def test_writes_flush_into_merged_segments(mmap_store):
+    lib, matrix = _fill(np.random.default_rng(0))
+    assert isinstance(matrix, SegmentedMatrix)
+    assert len(matrix) == 370
+    assert 0 < len(matrix._segments) <= Config.MAX_SEGMENTS + 1
+    assert all(os.path.exists(segment.path) for segment in matrix._segments)
+
+
+@pytest.mark.parametrize("snapshot", [True, False])
+def test_recovery_maps_the_same_rows(mmap_store, snapshot):
+    lib, matrix = _fill(np.random.default_rng(1))
+    if snapshot:
+        store.snapshot()
+    before = dump_store()
+    ids, vectors = matrix.live_items()
+
+    wipe_store()
+    store.open_store(mmap_store)
+    assert dump_store() == before
+    recovered = store._matrices[lib.id]
+    recovered_ids, recovered_vectors = recovered.live_items()
+    assert sorted(recovered_ids) == sorted(ids)
+    order = {chunk_id: row for row, chunk_id in enumerate(recovered_ids)}
+    np.testing.assert_array_equal(recovered_vectors[[order[chunk_id] for chunk_id in ids]], vectors)
+    if snapshot:
+        # segment files are mapped, not read into memory
+        assert recovered._segments
+        assert all(isinstance(segment.vectors, np.memmap) for segment in recovered._segments)
+
+
+def test_search_spans_segments_and_memtable(mmap_store):
+    lib, matrix = _fill(np.random.default_rng(2))
+    assert len(matrix.parts()) > 1
+    ids, vectors = matrix.live_items()
+    norms = np.linalg.norm(vectors, axis=1)
+    for q in np.random.default_rng(3).standard_normal((10, 8)):
+        scores = vectors @ q / (norms * np.linalg.norm(q))
+        expected = [ids[row] for row in np.argsort(-scores)[:5]]
+        assert [chunk_id for chunk_id, _ in _run_knn(lib.id, q, 5, "cosine", "brute")] == expected
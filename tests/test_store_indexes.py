@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+
+from app.models.chunk import Chunk
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+def _check_consistent() -> None:
+    """Every secondary index equals what a full scan of the tables gives"""
+    library_documents, library_chunks, document_chunks = {}, {}, {}
+    for doc in store._documents.values():
+        library_documents.setdefault(doc.library_id, set()).add(doc.id)
+    for chunk in store._chunks.values():
+        library_chunks.setdefault(chunk.library_id, set()).add(chunk.id)
+        if chunk.document_id is not None:
+            document_chunks.setdefault(chunk.document_id, set()).add(chunk.id)
+    assert {k: set(v) for k, v in store._library_documents.items()} == library_documents
+    assert {k: set(v) for k, v in store._library_chunks.items()} == library_chunks
+    assert {k: set(v) for k, v in store._document_chunks.items()} == document_chunks
+    for library_id, index in store._chunk_metadata.items():
+        for chunk_id in library_chunks.get(library_id, ()):
+            i = store._chunks[chunk_id].metadata.get("i")
+            if i is not None:
+                assert chunk_id in index.equal("i", i)
+
+
+def test_listings_use_the_indexes():
+    libs = [new_library() for _ in range(3)]
+    docs = [new_document(lib.id) for lib in libs for _ in range(2)]
+    chunks = {doc.id: add_chunks(doc, np.ones((3, 4))) for doc in docs}
+    for lib in libs:
+        assert {doc.id for doc in store.list_documents(lib.id)} == {doc.id for doc in docs if doc.library_id == lib.id}
+    for doc in docs:
+        assert [chunk.id for chunk in store.list_chunks(doc.library_id, doc.id)] == [chunk.id for chunk in chunks[doc.id]]
+        assert store.list_chunk_ids(doc.library_id, doc.id) == [chunk.id for chunk in chunks[doc.id]]
+    _check_consistent()
+
+
+def test_cascading_deletes_leave_nothing_behind():
+    lib = new_library()
+    docs = [new_document(lib.id) for _ in range(3)]
+    for doc in docs:
+        add_chunks(doc, np.ones((4, 4)))
+    store.delete_document(docs[0].id)
+    assert len(store.list_all_chunks_in_library(lib.id)) == 8
+    _check_consistent()
+    store.delete_library(lib.id)
+    _check_consistent()
+    assert not store._chunks and not store._documents
+    assert not store._library_chunks and not store._document_chunks and not store._library_documents
+
+
+def test_random_mutations_keep_indexes_consistent():
+    rng = random.Random(0)
+    libs = [new_library() for _ in range(2)]
+    docs = [new_document(lib.id) for lib in libs for _ in range(2)]
+    chunks = []
+    for step in range(300):
+        op = rng.choice(["add", "add", "patch", "move", "delete", "doc_meta"])
+        if op == "add" or not chunks:
+            doc = rng.choice(docs)
+            chunks += add_chunks(doc, np.ones((1, 4)), step=step)
+        elif op == "patch":
+            chunk = rng.choice(chunks)
+            store.patch_chunk(chunk.id, {"metadata": {"i": step}})
+        elif op == "move":
+            chunk = rng.choice(chunks)
+            record = store.get_chunk_record(chunk.id)
+            target = rng.choice([doc for doc in docs if doc.library_id == record.library_id])
+            store.patch_chunk(chunk.id, {"document_id": target.id})
+        elif op == "delete":
+            chunk = chunks.pop(rng.randrange(len(chunks)))
+            store.delete_chunk(chunk.id)
+        else:
+            doc = rng.choice(docs)
+            store.save_document(store.get_document(doc.id).model_copy(update={"metadata": {"step": step}}))
+    _check_consistent()
+
+
+def test_saving_a_chunk_into_another_library_moves_it():
+    a, b = new_library(), new_library()
+    doc_a, doc_b = new_document(a.id), new_document(b.id)
+    (chunk,) = add_chunks(doc_a, np.ones((1, 4)))
+    store.save_chunk(Chunk(id=chunk.id, library_id=b.id, document_id=doc_b.id, text="moved", embedding=[0.0, 1.0, 0.0, 0.0]))
+    assert store.list_chunk_ids(a.id) == []
+    assert store.list_chunk_ids(b.id) == [chunk.id]
+    assert store.library_vector_count(a.id) == 0 and store.library_vector_count(b.id) == 1
+    _check_consistent()
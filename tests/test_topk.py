@@ -0,0 +1,61 @@
+from uuid import uuid4
+
+import numpy as np
+
+from app.utils.knn import brute_force_knn, brute_force_knn_matrix
+from app.utils.topk import TopK, top_k_rows
+from app.utils.vptree import VPTreeIndex
+
+
+def test_ties_resolve_by_row_index():
+    keys = np.array([3.0, 1.0, 2.0, 1.0, 2.0, 1.0, 0.5])
+    assert top_k_rows(keys, 3).tolist() == [6, 1, 3]
+    assert top_k_rows(keys, 5).tolist() == [6, 1, 3, 5, 2]
+    # every row tied: the first k rows, whatever argpartition's layout
+    assert top_k_rows(np.zeros(1000), 4).tolist() == [0, 1, 2, 3]
+
+
+def test_k_larger_than_n_returns_everything_sorted():
+    keys = np.array([2.0, 0.0, 1.0])
+    assert top_k_rows(keys, 10).tolist() == [1, 2, 0]
+    assert top_k_rows(keys, 0).tolist() == []
+    assert top_k_rows(np.empty(0), 5).tolist() == []
+
+
+def test_nan_keys_rank_last():
+    keys = np.array([np.nan, 1.0, np.nan, 0.0])
+    assert top_k_rows(keys, 3).tolist() == [3, 1, 0]
+
+
+def test_stream_top_k_keeps_earliest_on_ties():
+    top = TopK(2)
+    for key, item in [(1.0, "a"), (0.5, "b"), (1.0, "c"), (0.5, "d"), (0.5, "e")]:
+        top.offer(key, item)
+    assert top.items() == [(0.5, "b"), (0.5, "d")]
+    assert top.bound == 0.5
+    assert TopK(0).items() == []
+
+
+def test_brute_force_k_beyond_n():
+    vectors = np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], dtype=np.float32)
+    rows, scores = brute_force_knn_matrix([1.0, 0.0], vectors, np.linalg.norm(vectors, axis=1), 10, "cosine")
+    assert rows.tolist() == [0, 2, 1]
+    np.testing.assert_allclose(scores, [1.0, np.sqrt(0.5), 0.0], atol=1e-6)
+
+    # duplicates score equally and come back in candidate order
+    candidates = [(i, [1.0, 1.0], None) for i in range(5)]
+    assert [i for i, _, _ in brute_force_knn([1.0, 1.0], candidates, 3, "l2")] == [0, 1, 2]
+
+
+def test_vptree_ranks_like_brute_force():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 6)).astype(np.float32)
+    ids = [uuid4() for _ in range(len(vectors))]
+    index = VPTreeIndex("l2")
+    index.build(ids, vectors)
+    candidates = [(chunk_id, row.tolist(), None) for chunk_id, row in zip(ids, vectors)]
+    for q in rng.standard_normal((10, 6)).tolist():
+        found = index.search(q, 7)
+        expected = brute_force_knn(q, candidates, 7, "l2")
+        assert [chunk_id for chunk_id, _ in found] == [chunk_id for chunk_id, _, _ in expected]
+        np.testing.assert_allclose([d for _, d in found], [d for _, d, _ in expected], rtol=1e-4)
@@ -0,0 +1,59 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.models.chunk import Chunk
+from app.store import in_memory as store
+
+from conftest import add_chunks, new_document, new_library
+
+
+@pytest.fixture
+def library():
+    lib = new_library()
+    doc = new_document(lib.id)
+    vectors = np.random.default_rng(0).standard_normal((50, 8))
+    return lib, doc, add_chunks(doc, vectors), vectors
+
+
+def _post(client, path, **body):
+    return client.post(path, json=body)
+
+
+def test_vector_search_skips_the_embedding_service(client, embedder, library):
+    lib, _, chunks, vectors = library
+    response = _post(client, f"/libraries/{lib.id}/search", vector=vectors[7].tolist(), k=3)
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == str(chunks[7].id)
+    assert embedder.backend.calls == 0
+
+
+def test_similar_to_chunk_excludes_the_source(client, library):
+    lib, doc, chunks, vectors = library
+    for path in (f"/libraries/{lib.id}/search", f"/libraries/{lib.id}/documents/{doc.id}/search"):
+        hits = _post(client, path, similar_to_chunk_id=str(chunks[3].id), k=5, metric="l2").json()
+        assert len(hits) == 5
+        distances = np.linalg.norm(vectors - vectors[3], axis=1)
+        expected = [str(chunks[i].id) for i in np.argsort(distances)[1:6]]
+        assert [hit["id"] for hit in hits] == expected
+
+
+def test_vector_search_errors(client, library):
+    lib, _, chunks, _ = library
+    url = f"/libraries/{lib.id}/search"
+    assert _post(client, url, vector=[1.0, 2.0], k=1).status_code == 422
+    assert _post(client, url, vector=[1.0] * 8, text="both", k=1).status_code == 422
+    assert _post(client, url, k=1).status_code == 422
+
+    other = new_library()
+    (foreign,) = add_chunks(new_document(other.id), np.ones((1, 8)))
+    assert _post(client, url, similar_to_chunk_id=str(foreign.id), k=1).status_code == 404
+
+    bare = Chunk(id=uuid4(), library_id=lib.id, document_id=chunks[0].document_id, text="no vector")
+    store.add_chunk_to_document(bare, bare.document_id)
+    assert _post(client, url, similar_to_chunk_id=str(bare.id), k=1).status_code == 422
+
+    missing = new_library()
+    store.delete_library(missing.id)
+    assert _post(client, f"/libraries/{missing.id}/search", vector=[1.0] * 8, k=1).status_code == 404
@@ -0,0 +1,81 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.utils.vptree import VPTreeIndex
+
+from conftest import clustered, index_recall, join_threads
+
+
+@pytest.mark.parametrize("metric", ["cosine", "l2", "l2_squared"])
+def test_vptree_is_exact(metric):
+    ids, vectors, queries = clustered(1500, 16, 0)
+    index = VPTreeIndex(metric)
+    index.build(ids, vectors)
+    assert index_recall(index, ids, vectors, queries, metric) == 1.0
+
+
+def test_vptree_rejects_dot():
+    with pytest.raises(ValueError):
+        VPTreeIndex("dot")
+
+
+def test_incremental_updates_match_brute_force():
+    ids, vectors, queries = clustered(800, 8, 3)
+    index = VPTreeIndex("l2", min_rebuild=64)
+    index.build(ids[:600], vectors[:600])
+    for chunk_id, vec in zip(ids[600:], vectors[600:]):
+        index.add(chunk_id, vec)
+    for chunk_id in ids[:100]:
+        index.remove(chunk_id)
+    join_threads("vptree-rebuild")
+
+    assert len(index) == 700
+    assert index_recall(index, ids[100:], vectors[100:], queries, "l2") == 1.0
+
+
+def test_allowed_restricts_results():
+    ids, vectors, queries = clustered(500, 8, 4)
+    index = VPTreeIndex("cosine")
+    index.build(ids, vectors)
+    allowed = set(ids[::7])
+    for q in queries:
+        assert {chunk_id for chunk_id, _ in index.search(q, 10, allowed)} <= allowed
+
+
+def test_failed_build_is_raised_to_searches():
+    index = VPTreeIndex("cosine")
+    index.begin_build([uuid4()], np.ones((1, 4), dtype=np.float32))
+    index._pending = (None, None)  # makes the build itself fail
+    with pytest.raises(Exception) as built:
+        index.finish_build()
+
+    # a search waiting on the build gets the same error instead of blocking
+    with pytest.raises(type(built.value)):
+        index.search(np.ones(4), 1)
+
+
+def test_failed_background_rebuild_keeps_serving_and_retries(monkeypatch):
+    ids, vectors, queries = clustered(300, 8, 5)
+    index = VPTreeIndex("l2", rebuild_ratio=0, min_rebuild=20)
+    index.build(ids[:100], vectors[:100])
+
+    def out_of_memory(*args):
+        raise MemoryError
+
+    build = index._build
+    monkeypatch.setattr(index, "_build", out_of_memory)
+    for chunk_id, vec in zip(ids[100:200], vectors[100:200]):
+        index.add(chunk_id, vec)
+        join_threads("vptree-rebuild")
+    assert index._rebuild_log is None
+    assert index_recall(index, ids[:200], vectors[:200], queries, "l2") == 1.0
+
+    # once builds work again the next attempt folds the delta into the tree
+    monkeypatch.setattr(index, "_build", build)
+    for chunk_id, vec in zip(ids[200:], vectors[200:]):
+        index.add(chunk_id, vec)
+        join_threads("vptree-rebuild")
+    assert len(index._delta) < 20
+    assert index_recall(index, ids, vectors, queries, "l2") == 1.0